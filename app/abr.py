@@ -0,0 +1,98 @@
+import os
+import subprocess
+
+# Escalera por defecto: copia de la fuente + 720p + 480p
+DEFAULT_LADDER = 'source,720p:2800k,480p:1200k'
+
+
+def parse_ladder(spec):
+    """Parsea una escalera ABR del tipo 'source,720p:2800k,480p:1200k'"""
+    renditions = []
+    for item in (spec or DEFAULT_LADDER).split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if item == 'source':
+            renditions.append({'name': 'source', 'height': None, 'video_bitrate': None})
+            continue
+
+        name, _, bitrate = item.partition(':')
+        height = int(name.lower().rstrip('p'))
+        renditions.append({
+            'name': f'{height}p',
+            'height': height,
+            'video_bitrate': bitrate or None
+        })
+
+    if not renditions:
+        raise ValueError('La escalera ABR está vacía')
+    return renditions
+
+
+def probe_has_audio(ffprobe_path, source_url, timeout=10):
+    """True si la fuente tiene pista de audio, False si no; None si no se ha podido averiguar"""
+    try:
+        result = subprocess.run(
+            [ffprobe_path, '-v', 'error', '-select_streams', 'a', '-show_entries', 'stream=index',
+             '-of', 'csv=p=0', source_url],
+            capture_output=True, text=True, timeout=timeout, stdin=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    return bool(result.stdout.strip())
+
+
+def build_abr_output_args(renditions, stream_dir, segment_time=2, list_size=10,
+                          preset='veryfast', audio_bitrate='128k', audio=True):
+    """Argumentos de salida FFmpeg para generar todas las variantes con una sola decodificación.
+
+    La fuente se copia tal cual; el resto de variantes salen de un único `split`
+    del vídeo decodificado. Cada variante se escribe en `stream_dir/<índice>/`
+    y se genera un `master.m3u8` que las referencia. Con `audio=False` (fuente
+    solo vídeo) las variantes no llevan pista de audio.
+    """
+    scaled = [(i, r) for i, r in enumerate(renditions) if r['height']]
+
+    args = []
+    if scaled:
+        labels = ''.join(f'[s{i}]' for i, _ in scaled)
+        filters = [f'[0:v]split={len(scaled)}{labels}']
+        for i, rendition in scaled:
+            filters.append(f"[s{i}]scale=-2:{rendition['height']}[v{i}]")
+        args += ['-filter_complex', ';'.join(filters)]
+
+    for i, rendition in enumerate(renditions):
+        if rendition['height']:
+            args += ['-map', f'[v{i}]', f'-c:v:{i}', 'libx264', f'-preset:v:{i}', preset]
+            if rendition['video_bitrate']:
+                args += [
+                    f'-b:v:{i}', rendition['video_bitrate'],
+                    f'-maxrate:v:{i}', rendition['video_bitrate'],
+                    f'-bufsize:v:{i}', rendition['video_bitrate']
+                ]
+        else:
+            args += ['-map', '0:v:0', f'-c:v:{i}', 'copy']
+
+    if audio:
+        for i in range(len(renditions)):
+            args += ['-map', '0:a:0']
+        args += ['-c:a', 'aac', '-b:a', audio_bitrate, '-ac', '2']
+
+    # Keyframes alineados con los segmentos para poder cambiar de variante
+    args += [
+        '-force_key_frames', f'expr:gte(t,n_forced*{segment_time})',
+        '-sc_threshold', '0',
+        '-f', 'hls',
+        '-hls_time', str(segment_time),
+        '-hls_list_size', str(list_size),
+        '-hls_flags', 'delete_segments+independent_segments+omit_endlist',
+        '-master_pl_name', 'master.m3u8',
+        '-var_stream_map', ' '.join(
+            f'v:{i},a:{i}' if audio else f'v:{i}' for i in range(len(renditions))
+        ),
+        '-hls_segment_filename', os.path.join(stream_dir, '%v', 'segment_%03d.ts'),
+        os.path.join(stream_dir, '%v', 'playlist.m3u8')
+    ]
+    return args
@@ -0,0 +1,188 @@
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+# Columnas de texto guardadas en el buffer compartido, en este orden por canal
+STRING_FIELDS = ('name', 'url', 'logo', 'tvg_id')
+# Campos que el índice puede servir
+INDEX_FIELDS = ('id', 'group_id', 'group_title') + STRING_FIELDS + ('health_status', 'health_latency_ms')
+
+
+class ChannelIndex:
+    """Índice columnar en memoria de los canales de una lista, ordenados por nombre.
+
+    En lugar de un dict por canal guarda arrays de enteros (ids, grupos, latencia),
+    los textos concatenados en un único buffer UTF-8 con un array de offsets, y los
+    títulos de grupo y estados internados. Los dicts solo se crean para la página pedida.
+    """
+
+    def __init__(self, playlist_id, version, rows, validators=None):
+        self.playlist_id = playlist_id
+        self.version = version
+        # Estado de la lista al construir el índice (para ETag/Last-Modified de lo que sirve)
+        self.validators = validators or {'version': version}
+        self.built_at = time.time()
+
+        self.ids = array('q')
+        self.group_ids = array('q')
+        self.latencies = array('i')
+        self.offsets = array('Q', [0])
+        self.group_titles = []
+        self.group_title_idx = array('i')
+        self.statuses = []
+        self.status_idx = array('b')
+        self.by_group = {}
+
+        interned_titles = {}
+        interned_statuses = {}
+        buffer = bytearray()
+
+        for position, row in enumerate(rows):
+            channel_id, group_id, group_title, name, url, logo, tvg_id, status, latency = row
+            self.ids.append(channel_id)
+            self.group_ids.append(group_id or 0)
+            self.latencies.append(-1 if latency is None else latency)
+
+            for value in (name, url, logo, tvg_id):
+                buffer += (value or '').encode('utf-8')
+                self.offsets.append(len(buffer))
+
+            title = group_title or ''
+            if title not in interned_titles:
+                interned_titles[title] = len(self.group_titles)
+                self.group_titles.append(title)
+            self.group_title_idx.append(interned_titles[title])
+
+            status = status or 'unknown'
+            if status not in interned_statuses:
+                interned_statuses[status] = len(self.statuses)
+                self.statuses.append(status)
+            self.status_idx.append(interned_statuses[status])
+
+            if group_id:
+                self.by_group.setdefault(group_id, array('I')).append(position)
+
+        self.buffer = bytes(buffer)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _string(self, position, field_number):
+        slot = position * len(STRING_FIELDS) + field_number
+        return self.buffer[self.offsets[slot]:self.offsets[slot + 1]].decode('utf-8')
+
+    def _value(self, position, field):
+        if field == 'id':
+            return self.ids[position]
+        if field == 'group_id':
+            return self.group_ids[position] or None
+        if field == 'group_title':
+            return self.group_titles[self.group_title_idx[position]]
+        if field == 'health_status':
+            return self.statuses[self.status_idx[position]]
+        if field == 'health_latency_ms':
+            latency = self.latencies[position]
+            return None if latency < 0 else latency
+        return self._string(position, STRING_FIELDS.index(field))
+
+    def count(self, group_id=None):
+        if group_id:
+            return len(self.by_group.get(group_id, ()))
+        return len(self.ids)
+
+    def page(self, group_id=None, limit=None, offset=0, fields=INDEX_FIELDS, as_rows=False):
+        """Canales de la página pedida con solo los campos de `fields`.
+
+        Con `as_rows=True` cada canal es una lista de valores en el orden de `fields`.
+        """
+        positions = self.by_group.get(group_id, ()) if group_id else range(len(self.ids))
+        end = offset + limit if limit else None
+        if as_rows:
+            return [[self._value(position, field) for field in fields] for position in positions[offset:end]]
+        return [
+            {field: self._value(position, field) for field in fields}
+            for position in positions[offset:end]
+        ]
+
+    def memory_bytes(self):
+        arrays = (self.ids, self.group_ids, self.latencies, self.offsets, self.group_title_idx, self.status_idx)
+        total = len(self.buffer) + sum(a.itemsize * len(a) for a in arrays)
+        total += sum(a.itemsize * len(a) for a in self.by_group.values())
+        return total
+
+
+class ChannelIndexCache:
+    """Caché LRU de índices por lista, invalidada por la versión de la lista.
+
+    La versión se consulta como mucho cada `version_ttl` segundos, y el índice se
+    reconstruye también pasado `max_age` para recoger cambios de salud de los canales.
+    """
+
+    def __init__(self, db, max_playlists=4, version_ttl=2.0, max_age=300):
+        self.db = db
+        self.max_playlists = max_playlists
+        self.version_ttl = version_ttl
+        self.max_age = max_age
+        self._indexes = OrderedDict()
+        self._version_checked = {}
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def _current(self, playlist_id, now):
+        """Índice en caché si sigue siendo válido"""
+        with self._lock:
+            index = self._indexes.get(playlist_id)
+            if not index or now - index.built_at > self.max_age:
+                return None
+            if now - self._version_checked.get(playlist_id, 0) < self.version_ttl:
+                self._indexes.move_to_end(playlist_id)
+                return index
+
+        version = self.db.get_playlist_version(playlist_id)
+        with self._lock:
+            if version != index.version:
+                self._indexes.pop(playlist_id, None)
+                return None
+            self._version_checked[playlist_id] = now
+            self._indexes.move_to_end(playlist_id)
+            return index
+
+    def get(self, playlist_id):
+        """Retorna (índice, acierto). El índice es None si la lista no existe"""
+        now = time.time()
+        index = self._current(playlist_id, now)
+        if index:
+            return index, True
+
+        # Un solo hilo construye a la vez; los demás reutilizan su resultado
+        with self._build_lock:
+            index = self._current(playlist_id, now)
+            if index:
+                return index, True
+
+            validators = self.db.get_playlist_validators(playlist_id)
+            if validators is None:
+                return None, False
+            index = ChannelIndex(playlist_id, validators['version'],
+                                 self.db.iter_channel_index_rows(playlist_id), validators)
+
+            with self._lock:
+                self._indexes[playlist_id] = index
+                self._version_checked[playlist_id] = time.time()
+                while len(self._indexes) > self.max_playlists:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._version_checked.pop(evicted, None)
+            return index, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                playlist_id: {
+                    'version': index.version,
+                    'channels': len(index),
+                    'memory_bytes': index.memory_bytes(),
+                    'built_at': index.built_at
+                }
+                for playlist_id, index in self._indexes.items()
+            }
@@ -0,0 +1,119 @@
+import bisect
+import hashlib
+
+import requests
+
+from .failover import SourceHealth
+
+# Marca las peticiones reenviadas entre nodos: el receptor las sirve sin volver a enrutar
+HOP_HEADER = 'X-IPTV-Cluster-Hop'
+# Nodo que ha servido la respuesta de un stream
+NODE_HEADER = 'X-IPTV-Node'
+
+# Cabeceras que se reenvían al nodo dueño y las de su respuesta que se devuelven.
+# El cuerpo se reenvía sin decodificar: el dueño comprime según el Accept-Encoding
+# del cliente y su Content-Encoding llega tal cual
+FORWARD_REQUEST_HEADERS = (
+    'Range', 'If-Range', 'If-None-Match', 'If-Modified-Since', 'User-Agent', 'Accept-Encoding'
+)
+FORWARD_RESPONSE_HEADERS = (
+    'Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges', 'Content-Encoding', 'Vary',
+    'Cache-Control', 'ETag', 'Last-Modified', 'Retry-After', 'Location', NODE_HEADER
+)
+
+
+def parse_nodes(value):
+    """'http://a:80, http://b:80/' -> ['http://a:80', 'http://b:80']"""
+    return [node.strip().rstrip('/') for node in (value or '').split(',') if node.strip()]
+
+
+class HashRing:
+    """Anillo de hash consistente con `replicas` puntos virtuales por nodo.
+
+    Al añadir o quitar un nodo solo cambian de dueño las claves de los tramos que
+    ocupaba (~1/N del total); el resto se queda donde estaba.
+    """
+
+    def __init__(self, nodes, replicas=160):
+        self.nodes = sorted(set(nodes))
+        points = sorted(
+            (self._hash(f'{node}#{replica}'), node)
+            for node in self.nodes for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def preference(self, key):
+        """Nodos en orden de preferencia para `key`: el dueño y después los siguientes del anillo"""
+        if not self._hashes:
+            return []
+        start = bisect.bisect(self._hashes, self._hash(key))
+        result = []
+        for offset in range(len(self._hashes)):
+            node = self._owners[(start + offset) % len(self._hashes)]
+            if node not in result:
+                result.append(node)
+                if len(result) == len(self.nodes):
+                    break
+        return result
+
+
+class Cluster:
+    """Reparto de los streams entre nodos transcodificadores.
+
+    Cada stream_id tiene un nodo dueño en el anillo; los demás nodos le reenvían las
+    peticiones, así que cada canal se transcodifica una sola vez en todo el clúster.
+    Un nodo que no responde queda en cuarentena (con espera creciente) y sus streams
+    pasan al siguiente del anillo hasta que vuelve.
+    """
+
+    def __init__(self, self_node, nodes, cooldown=10, max_cooldown=120, timeout=(3, 30), pool_size=32):
+        self.self_node = self_node.rstrip('/') if self_node else None
+        nodes = [node.rstrip('/') for node in nodes]
+        if self.self_node and self.self_node not in nodes:
+            nodes.append(self.self_node)
+        self.ring = HashRing(nodes)
+        self.health = SourceHealth(base_cooldown=cooldown, max_cooldown=max_cooldown)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def enabled(self):
+        return self.self_node is not None and len(self.ring.nodes) > 1
+
+    def candidates(self, key):
+        """Nodos a probar para `key`: los disponibles en orden del anillo (este nodo siempre lo está)"""
+        return [
+            node for node in self.ring.preference(key)
+            if node == self.self_node or self.health.is_available(node)
+        ]
+
+    def owner(self, key):
+        candidates = self.candidates(key)
+        return candidates[0] if candidates else self.self_node
+
+    def forward(self, node, method, path, headers):
+        """Reenvía una petición a `node` en streaming. Lanza requests.RequestException si no responde"""
+        headers = {name: headers[name] for name in FORWARD_REQUEST_HEADERS if name in headers}
+        # Sin Accept-Encoding del cliente, requests pediría gzip/br por su cuenta
+        headers.setdefault('Accept-Encoding', 'identity')
+        headers[HOP_HEADER] = self.self_node
+        return self.session.request(method, node + path, headers=headers, stream=True,
+                                    timeout=self.timeout, allow_redirects=False)
+
+    def status(self):
+        return {
+            'self': self.self_node,
+            'enabled': self.enabled,
+            'nodes': {
+                node: dict(self.health.snapshot([node])[node], available=self.health.is_available(node))
+                for node in self.ring.nodes
+            }
+        }
@@ -0,0 +1,62 @@
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se usa gzip
+    brotli = None
+
+# Tipos que merece la pena comprimir (JSON de la API, páginas y listas M3U/HLS)
+COMPRESSIBLE_TYPES = {
+    'application/json', 'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/vnd.apple.mpegurl', 'application/x-mpegurl',
+    'audio/x-mpegurl', 'audio/mpegurl'
+}
+
+
+class ResponseCompressor:
+    """Comprime con brotli o gzip las respuestas de texto según Accept-Encoding.
+
+    Se registra como `after_request`. Deja intactas las respuestas en streaming o
+    passthrough (proxy, segmentos, send_file), las parciales y las ya codificadas.
+    Los niveles son bajos porque las respuestas son dinámicas y se comprimen en cada petición.
+    """
+
+    def __init__(self, min_size=1024, gzip_level=5, brotli_quality=4):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = ['br', 'gzip'] if brotli else ['gzip']
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level)
+
+    def __call__(self, response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or response.mimetype not in COMPRESSIBLE_TYPES
+                or 'Content-Encoding' in response.headers):
+            return response
+
+        # La respuesta depende de Accept-Encoding aunque esta vez no se comprima
+        response.vary.add('Accept-Encoding')
+
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if not encoding:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        response.set_data(self.compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+def install_compression(app, min_size=1024):
+    """Registra la compresión de respuestas en la app. Retorna las codificaciones disponibles"""
+    compressor = ResponseCompressor(min_size=min_size)
+    app.after_request(compressor)
+    return compressor.encodings
@@ -1,13 +1,24 @@
 import sqlite3
 import os
+import time
+from collections import defaultdict
 from datetime import datetime
+from .m3u_parser import normalize_channel_name
+
+# Columnas de channels que se pueden pedir con ?fields=
+CHANNEL_COLUMNS = (
+    'id', 'playlist_id', 'group_id', 'name', 'url', 'logo', 'tvg_id', 'tvg_name', 'group_title',
+    'name_key', 'health_status', 'health_latency_ms', 'health_checked_at'
+)
+
+# Versión del esquema guardada en PRAGMA user_version: subirla al cambiar init_db
+SCHEMA_VERSION = 4
 
 class Database:
-    def __init__(self, db_path='data/iptv.db'):
+    def __init__(self, db_path='data/iptv.db', init_schema=True):
         self.db_path = db_path
-        # Crear directorio si no existe
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self.init_db()
+        if init_schema:
+            self.init_db()
     
     def get_connection(self):
         # Timeout de 30 segundos para evitar "database is locked"
@@ -16,12 +27,35 @@ class Database:
         # Habilitar WAL mode para mejor concurrencia
         conn.execute('PRAGMA journal_mode=WAL')
         conn.execute('PRAGMA busy_timeout=30000')
+        # SQLite no aplica las claves foráneas (ni ON DELETE CASCADE) si no se activan por conexión
+        conn.execute('PRAGMA foreign_keys=ON')
         return conn
     
     def init_db(self):
-        """Inicializar la base de datos con las tablas necesarias"""
+        """Inicializar la base de datos con las tablas necesarias.
+
+        Si el esquema ya está en SCHEMA_VERSION no hace nada más que leer la versión.
+        La migración va en una transacción BEGIN IMMEDIATE: si varios procesos arrancan
+        a la vez sobre la misma base, uno migra y los demás esperan y ven la versión nueva.
+        """
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        if not os.path.exists(self.db_path):
+            # Base nueva: auto_vacuum incremental desde el principio (debe fijarse antes del WAL;
+            # en una base existente exige un VACUUM completo)
+            conn = sqlite3.connect(self.db_path)
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.close()
         conn = self.get_connection()
         try:
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+                return
+            
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+                conn.rollback()
+                return
+            
             # Tabla para las listas M3U
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS playlists (
@@ -29,6 +63,18 @@ class Database:
                     name TEXT NOT NULL,
                     url TEXT,
                     file_content TEXT,
+                    version INTEGER DEFAULT 1,
+                    health_version INTEGER DEFAULT 0,
+                    health_updated_at REAL,
+                    epg_url TEXT,
+                    content_hash TEXT,
+                    refresh_interval INTEGER,
+                    next_refresh_at REAL,
+                    last_refresh_at REAL,
+                    last_refresh_duration REAL,
+                    last_refresh_status TEXT,
+                    last_refresh_error TEXT,
+                    refresh_failures INTEGER DEFAULT 0,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
@@ -56,6 +102,10 @@ class Database:
                     tvg_id TEXT,
                     tvg_name TEXT,
                     group_title TEXT,
+                    name_key TEXT,
+                    health_status TEXT DEFAULT 'unknown',
+                    health_latency_ms INTEGER,
+                    health_checked_at REAL,
                     FOREIGN KEY (playlist_id) REFERENCES playlists (id) ON DELETE CASCADE,
                     FOREIGN KEY (group_id) REFERENCES groups (id) ON DELETE SET NULL
                 )
@@ -71,23 +121,146 @@ class Database:
                 )
             ''')
             
+            # Fuentes XMLTV (url-tvg de las listas y EPG_URLS) y estado de su refresco
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS epg_sources (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL UNIQUE,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT,
+                    channels_key TEXT,
+                    generation INTEGER DEFAULT 0,
+                    programmes INTEGER DEFAULT 0,
+                    status TEXT DEFAULT 'pending',
+                    error TEXT,
+                    refreshed_at REAL,
+                    duration REAL,
+                    next_refresh_at REAL DEFAULT 0,
+                    failures INTEGER DEFAULT 0
+                )
+            ''')
+            
+            # Programación; cada refresco escribe una generación nueva y borra la anterior al terminar
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS programmes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source_id INTEGER NOT NULL,
+                    generation INTEGER NOT NULL,
+                    tvg_id TEXT NOT NULL,
+                    start REAL NOT NULL,
+                    stop REAL NOT NULL,
+                    title TEXT,
+                    subtitle TEXT,
+                    description TEXT,
+                    category TEXT,
+                    FOREIGN KEY (source_id) REFERENCES epg_sources (id) ON DELETE CASCADE
+                )
+            ''')
+            
+            # Migraciones de columnas añadidas después de la versión inicial
+            self._add_missing_columns(conn, 'playlists', {
+                'version': 'INTEGER DEFAULT 1',
+                'health_version': 'INTEGER DEFAULT 0',
+                'health_updated_at': 'REAL',
+                'epg_url': 'TEXT',
+                'content_hash': 'TEXT',
+                'refresh_interval': 'INTEGER',
+                'next_refresh_at': 'REAL',
+                'last_refresh_at': 'REAL',
+                'last_refresh_duration': 'REAL',
+                'last_refresh_status': 'TEXT',
+                'last_refresh_error': 'TEXT',
+                'refresh_failures': 'INTEGER DEFAULT 0'
+            })
+            self._add_missing_columns(conn, 'channels', {
+                'name_key': 'TEXT',
+                'health_status': "TEXT DEFAULT 'unknown'",
+                'health_latency_ms': 'INTEGER',
+                'health_checked_at': 'REAL',
+                'timeshift_window': 'INTEGER'
+            })
+            
+            # Restos de listas borradas mientras las claves foráneas estaban desactivadas
+            conn.execute('DELETE FROM channels WHERE playlist_id NOT IN (SELECT id FROM playlists)')
+            conn.execute('DELETE FROM groups WHERE playlist_id NOT IN (SELECT id FROM playlists)')
+            conn.execute('DELETE FROM favorites WHERE channel_id NOT IN (SELECT id FROM channels)')
+            
+            # Clave de nombre normalizado para fuentes alternativas
+            conn.create_function('normalize_channel_name', 1, normalize_channel_name)
+            conn.execute('UPDATE channels SET name_key = normalize_channel_name(name) WHERE name_key IS NULL')
+            
             # Índices para mejorar rendimiento
             conn.execute('CREATE INDEX IF NOT EXISTS idx_channels_playlist ON channels(playlist_id)')
             conn.execute('CREATE INDEX IF NOT EXISTS idx_channels_group ON channels(group_id)')
             conn.execute('CREATE INDEX IF NOT EXISTS idx_channels_playlist_group ON channels(playlist_id, group_id)')
             conn.execute('CREATE INDEX IF NOT EXISTS idx_favorites_channel ON favorites(channel_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_channels_tvg_id ON channels(tvg_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_channels_name_key ON channels(name_key)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_channels_health_checked ON channels(health_checked_at)')
+            # Ahora/siguiente: los programas de un canal no se solapan, así que ordenar por fin equivale a por inicio
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_programmes_tvg_stop ON programmes(tvg_id, stop)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_programmes_source ON programmes(source_id, generation)')
+            # Borrado periódico de lo ya emitido (prune_programmes) sin recorrer toda la guía
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_programmes_stop ON programmes(stop)')
             
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
             conn.commit()
         finally:
             conn.close()
     
-    def add_playlist(self, name, url=None, file_content=None):
+    @staticmethod
+    def _add_missing_columns(conn, table, columns):
+        """Añade a `table` las columnas de `columns` ({nombre: definición}) que no existan"""
+        existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+        for name, definition in columns.items():
+            if name not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+    
+    @staticmethod
+    def _bump_versions(conn, playlist_ids):
+        """Incrementa la versión de las listas cuyos canales han cambiado (invalida cachés)"""
+        conn.executemany(
+            'UPDATE playlists SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            [(playlist_id,) for playlist_id in playlist_ids]
+        )
+    
+    def get_playlist_validators(self, playlist_id):
+        """Versión de canales, versión de salud y fechas de modificación de una lista (None si no existe)"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute(
+                'SELECT version, health_version, updated_at, health_updated_at FROM playlists WHERE id = ?',
+                (playlist_id,)
+            ).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+    
+    def get_playlist_versions(self):
+        """Versión de todas las listas: {id: versión}"""
+        conn = self.get_connection()
+        try:
+            return {row['id']: row['version'] for row in conn.execute('SELECT id, version FROM playlists')}
+        finally:
+            conn.close()
+    
+    def get_playlist_version(self, playlist_id):
+        """Versión actual de una lista (None si no existe)"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute('SELECT version FROM playlists WHERE id = ?', (playlist_id,)).fetchone()
+            return row['version'] if row else None
+        finally:
+            conn.close()
+    
+    def add_playlist(self, name, url=None, file_content=None, epg_url=None):
         """Agregar una nueva lista de reproducción"""
         conn = self.get_connection()
         try:
             cursor = conn.execute(
-                'INSERT INTO playlists (name, url, file_content) VALUES (?, ?, ?)',
-                (name, url, file_content)
+                'INSERT INTO playlists (name, url, file_content, epg_url) VALUES (?, ?, ?, ?)',
+                (name, url, file_content, epg_url)
             )
             playlist_id = cursor.lastrowid
             conn.commit()
@@ -146,40 +319,170 @@ class Database:
         try:
             cursor = conn.execute(
                 '''INSERT INTO channels 
-                   (playlist_id, group_id, name, url, logo, tvg_id, tvg_name, group_title) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                (playlist_id, group_id, name, url, logo, tvg_id, tvg_name, group_title)
+                   (playlist_id, group_id, name, url, logo, tvg_id, tvg_name, group_title, name_key) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (playlist_id, group_id, name, url, logo, tvg_id, tvg_name, group_title,
+                 normalize_channel_name(name))
             )
             channel_id = cursor.lastrowid
+            self._bump_versions(conn, [playlist_id])
             conn.commit()
             return channel_id
         finally:
             conn.close()
     
     def add_channels_batch(self, channels_data):
-        """Agregar múltiples canales en una sola transacción"""
+        """Agregar múltiples canales en una sola transacción.
+
+        Cada tupla: (playlist_id, group_id, name, url, logo, tvg_id, tvg_name, group_title, name_key)
+        """
         conn = self.get_connection()
         try:
             conn.executemany(
                 '''INSERT INTO channels 
-                   (playlist_id, group_id, name, url, logo, tvg_id, tvg_name, group_title) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                   (playlist_id, group_id, name, url, logo, tvg_id, tvg_name, group_title, name_key) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                 channels_data
             )
+            self._bump_versions(conn, {row[0] for row in channels_data})
             conn.commit()
         finally:
             conn.close()
     
-    def get_channels(self, playlist_id, group_id=None, limit=None, offset=0):
-        """Obtener canales de una lista o grupo con paginación opcional"""
+    def replace_playlist_channels(self, playlist_id, channels, file_content=None, epg_url=None, content_hash=None):
+        """Sustituye los canales de una lista por los de `channels` (dicts del parser).
+
+        Los canales que siguen (mismo nombre y URL) conservan su id, así que no se pierden
+        favoritos ni estado de salud; solo se insertan, actualizan o borran las diferencias.
+        Retorna {'added', 'updated', 'removed'}.
+        """
         conn = self.get_connection()
         try:
-            if group_id:
-                query = 'SELECT * FROM channels WHERE playlist_id = ? AND group_id = ? ORDER BY name'
-                params = [playlist_id, group_id]
+            groups = {row['name']: row['id'] for row in
+                      conn.execute('SELECT id, name FROM groups WHERE playlist_id = ?', (playlist_id,))}
+            new_groups = {channel.get('group_title') for channel in channels if channel.get('group_title')}
+            for group_name in sorted(new_groups - groups.keys()):
+                cursor = conn.execute('INSERT INTO groups (playlist_id, name) VALUES (?, ?)', (playlist_id, group_name))
+                groups[group_name] = cursor.lastrowid
+            
+            existing = defaultdict(list)
+            for row in conn.execute(
+                '''SELECT id, name, url, group_id, logo, tvg_id, tvg_name, group_title
+                   FROM channels WHERE playlist_id = ?''',
+                (playlist_id,)
+            ):
+                existing[(row['name'], row['url'])].append(row)
+            
+            inserts, updates = [], []
+            for channel in channels:
+                group_title = channel.get('group_title', '')
+                values = (groups.get(group_title) if group_title else None, channel.get('logo', ''),
+                          channel.get('tvg_id', ''), channel.get('tvg_name', ''), group_title)
+                matches = existing.get((channel['name'], channel['url']))
+                if matches:
+                    row = matches.pop()
+                    if (row['group_id'], row['logo'], row['tvg_id'], row['tvg_name'], row['group_title']) != values:
+                        updates.append(values + (row['id'],))
+                else:
+                    inserts.append((playlist_id, values[0], channel['name'], channel['url']) + values[1:]
+                                   + (normalize_channel_name(channel['name']),))
+            removed = [(row['id'],) for rows in existing.values() for row in rows]
+            
+            conn.executemany(
+                'UPDATE channels SET group_id = ?, logo = ?, tvg_id = ?, tvg_name = ?, group_title = ? WHERE id = ?',
+                updates
+            )
+            conn.executemany(
+                '''INSERT INTO channels 
+                   (playlist_id, group_id, name, url, logo, tvg_id, tvg_name, group_title, name_key) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                inserts
+            )
+            conn.executemany('DELETE FROM favorites WHERE channel_id = ?', removed)
+            conn.executemany('DELETE FROM channels WHERE id = ?', removed)
+            conn.execute(
+                '''DELETE FROM groups WHERE playlist_id = ? AND id NOT IN
+                   (SELECT DISTINCT group_id FROM channels WHERE playlist_id = ? AND group_id IS NOT NULL)''',
+                (playlist_id, playlist_id)
+            )
+            conn.execute(
+                'UPDATE playlists SET file_content = ?, epg_url = ?, content_hash = ? WHERE id = ?',
+                (file_content, epg_url, content_hash, playlist_id)
+            )
+            if inserts or updates or removed:
+                self._bump_versions(conn, [playlist_id])
+            conn.commit()
+            return {'added': len(inserts), 'updated': len(updates), 'removed': len(removed)}
+        finally:
+            conn.close()
+    
+    def get_playlists_to_refresh(self, now):
+        """Listas importadas por URL sin programar o cuyo refresco ya toca"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute(
+                '''SELECT id, name, url, content_hash, refresh_interval, next_refresh_at, refresh_failures
+                   FROM playlists
+                   WHERE url IS NOT NULL AND url != '' AND (next_refresh_at IS NULL OR next_refresh_at <= ?)
+                   ORDER BY next_refresh_at''',
+                (now,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    def update_playlist(self, playlist_id, **fields):
+        """Actualiza columnas de una lista (programación y resultado del refresco)"""
+        if not fields:
+            return
+        conn = self.get_connection()
+        try:
+            assignments = ', '.join(f'{name} = ?' for name in fields)
+            conn.execute(f'UPDATE playlists SET {assignments} WHERE id = ?', (*fields.values(), playlist_id))
+            conn.commit()
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _channel_filters(playlist_id, group_id=None, statuses=None):
+        """Cláusula WHERE y parámetros para filtrar canales"""
+        conditions = ['playlist_id = ?']
+        params = [playlist_id]
+        if group_id:
+            conditions.append('group_id = ?')
+            params.append(group_id)
+        if statuses:
+            conditions.append(f"COALESCE(health_status, 'unknown') IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        return ' AND '.join(conditions), params
+    
+    @staticmethod
+    def _select_columns(fields, prefix=''):
+        """Lista SELECT para `fields` (solo columnas conocidas de channels)"""
+        if not fields:
+            return f'{prefix}*'
+        unknown = set(fields) - set(CHANNEL_COLUMNS)
+        if unknown:
+            raise ValueError(f"Campos desconocidos: {', '.join(sorted(unknown))}")
+        return ', '.join(f'{prefix}{field}' for field in fields)
+    
+    def get_channels(self, playlist_id, group_id=None, limit=None, offset=0, statuses=None, sort='name',
+                     fields=None):
+        """Obtener canales de una lista o grupo con paginación opcional.
+
+        `statuses` filtra por estado de salud ('online', 'offline', 'unknown'),
+        `sort='latency'` ordena los canales vivos más rápidos primero y `fields`
+        limita las columnas devueltas.
+        """
+        conn = self.get_connection()
+        try:
+            where, params = self._channel_filters(playlist_id, group_id, statuses)
+            if sort == 'latency':
+                order_by = ("CASE health_status WHEN 'online' THEN 0 WHEN 'offline' THEN 2 ELSE 1 END, "
+                            "health_latency_ms, name")
             else:
-                query = 'SELECT * FROM channels WHERE playlist_id = ? ORDER BY name'
-                params = [playlist_id]
+                order_by = 'name'
+            query = f'SELECT {self._select_columns(fields)} FROM channels WHERE {where} ORDER BY {order_by}'
             
             if limit:
                 query += ' LIMIT ? OFFSET ?'
@@ -190,21 +493,104 @@ class Database:
         finally:
             conn.close()
     
-    def get_channels_count(self, playlist_id, group_id=None):
+    def iter_channel_index_rows(self, playlist_id, batch_size=5000):
+        """Recorre los canales de una lista ordenados por nombre, como tuplas, para el índice en memoria"""
+        conn = self.get_connection()
+        conn.row_factory = None
+        try:
+            cursor = conn.execute(
+                '''SELECT id, group_id, group_title, name, url, logo, tvg_id, health_status, health_latency_ms
+                   FROM channels WHERE playlist_id = ? ORDER BY name''',
+                (playlist_id,)
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+    
+    def get_channels_count(self, playlist_id, group_id=None, statuses=None):
         """Obtener el número total de canales"""
         conn = self.get_connection()
         try:
-            if group_id:
-                cursor = conn.execute(
-                    'SELECT COUNT(*) as count FROM channels WHERE playlist_id = ? AND group_id = ?',
-                    (playlist_id, group_id)
-                )
-            else:
+            where, params = self._channel_filters(playlist_id, group_id, statuses)
+            cursor = conn.execute(f'SELECT COUNT(*) as count FROM channels WHERE {where}', params)
+            return cursor.fetchone()['count']
+        finally:
+            conn.close()
+    
+    def get_channels_to_check(self, checked_before, limit):
+        """Canales sin comprobar o con la comprobación de salud más antigua"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute(
+                '''SELECT id, url FROM channels
+                   WHERE health_checked_at IS NULL OR health_checked_at < ?
+                   ORDER BY health_checked_at
+                   LIMIT ?''',
+                (checked_before, limit)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    def update_channels_health(self, results):
+        """Guardar resultados de salud: tuplas (status, latency_ms, checked_at, channel_id).
+
+        Retorna los ids de las listas afectadas; su versión de salud no cambia hasta
+        llamar a bump_health_versions.
+        """
+        conn = self.get_connection()
+        try:
+            conn.executemany(
+                '''UPDATE channels
+                   SET health_status = ?, health_latency_ms = ?, health_checked_at = ?
+                   WHERE id = ?''',
+                results
+            )
+            
+            channel_ids = [result[3] for result in results]
+            playlist_ids = set()
+            for start in range(0, len(channel_ids), 500):
+                chunk = channel_ids[start:start + 500]
                 cursor = conn.execute(
-                    'SELECT COUNT(*) as count FROM channels WHERE playlist_id = ?',
-                    (playlist_id,)
+                    f"SELECT DISTINCT playlist_id FROM channels WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk
                 )
-            return cursor.fetchone()['count']
+                playlist_ids.update(row['playlist_id'] for row in cursor)
+            conn.commit()
+            return playlist_ids
+        finally:
+            conn.close()
+    
+    def bump_health_versions(self, playlist_ids):
+        """Las listas cambian de versión de salud (invalida sus ETags)"""
+        if not playlist_ids:
+            return
+        conn = self.get_connection()
+        try:
+            conn.executemany(
+                'UPDATE playlists SET health_version = health_version + 1, health_updated_at = ? WHERE id = ?',
+                [(time.time(), playlist_id) for playlist_id in playlist_ids]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def get_health_summary(self, playlist_id):
+        """Conteo de canales por estado de salud"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute(
+                '''SELECT COALESCE(health_status, 'unknown') as status, COUNT(*) as count,
+                          AVG(health_latency_ms) as avg_latency_ms, MAX(health_checked_at) as last_checked_at
+                   FROM channels WHERE playlist_id = ?
+                   GROUP BY COALESCE(health_status, 'unknown')''',
+                (playlist_id,)
+            )
+            return {row['status']: dict(row) for row in cursor.fetchall()}
         finally:
             conn.close()
     
@@ -235,8 +621,42 @@ class Database:
         finally:
             conn.close()
     
+    def update_channel(self, channel_id, **fields):
+        """Actualiza columnas de un canal (ajustes propios como la ventana de timeshift)"""
+        if not fields:
+            return
+        conn = self.get_connection()
+        try:
+            assignments = ', '.join(f'{name} = ?' for name in fields)
+            conn.execute(f'UPDATE channels SET {assignments} WHERE id = ?', (*fields.values(), channel_id))
+            # Su lista cambia de versión para que los listados con ETag no sirvan el valor anterior
+            row = conn.execute('SELECT playlist_id FROM channels WHERE id = ?', (channel_id,)).fetchone()
+            if row:
+                self._bump_versions(conn, [row['playlist_id']])
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def get_alternative_sources(self, channel, limit=10):
+        """Obtener otras URLs del mismo canal (mismo tvg-id o nombre normalizado) en cualquier lista"""
+        conn = self.get_connection()
+        try:
+            name_key = channel.get('name_key') or normalize_channel_name(channel.get('name'))
+            cursor = conn.execute(
+                '''SELECT id, playlist_id, name, url FROM channels
+                   WHERE id != ? AND url != ?
+                     AND ((tvg_id = ? AND tvg_id != '') OR (name_key = ? AND name_key != ''))
+                   ORDER BY (playlist_id = ?) DESC, (health_status = 'offline'), id
+                   LIMIT ?''',
+                (channel['id'], channel['url'], channel.get('tvg_id') or '', name_key,
+                 channel['playlist_id'], limit)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
     def delete_playlist(self, playlist_id):
-        """Eliminar una lista de reproducción"""
+        """Eliminar una lista de reproducción (sus grupos, canales y favoritos se borran en cascada)"""
         conn = self.get_connection()
         try:
             conn.execute('DELETE FROM playlists WHERE id = ?', (playlist_id,))
@@ -244,6 +664,178 @@ class Database:
         finally:
             conn.close()
     
+    # === Guía de programación (EPG) ===
+    
+    def get_playlists_missing_epg_url(self, header_bytes=4096):
+        """Listas importadas antes de guardar url-tvg: (id, inicio del contenido M3U)"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute(
+                'SELECT id, substr(file_content, 1, ?) as header FROM playlists WHERE epg_url IS NULL',
+                (header_bytes,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    def set_playlist_epg_url(self, playlist_id, epg_url):
+        conn = self.get_connection()
+        try:
+            conn.execute('UPDATE playlists SET epg_url = ? WHERE id = ?', (epg_url, playlist_id))
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def get_playlist_epg_urls(self):
+        """Valores de url-tvg de todas las listas (pueden contener varias URLs separadas por comas)"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute("SELECT DISTINCT epg_url FROM playlists WHERE epg_url IS NOT NULL AND epg_url != ''")
+            return [row['epg_url'] for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    def sync_epg_sources(self, urls):
+        """Da de alta las fuentes nuevas y borra (con su programación) las que ya no usa nadie"""
+        conn = self.get_connection()
+        try:
+            urls = set(urls)
+            conn.executemany('INSERT OR IGNORE INTO epg_sources (url) VALUES (?)', [(url,) for url in urls])
+            stale = [row['id'] for row in conn.execute('SELECT id, url FROM epg_sources') if row['url'] not in urls]
+            for source_id in stale:
+                conn.execute('DELETE FROM programmes WHERE source_id = ?', (source_id,))
+                conn.execute('DELETE FROM epg_sources WHERE id = ?', (source_id,))
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def get_epg_sources(self):
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('SELECT * FROM epg_sources ORDER BY id')
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    def update_epg_source(self, source_id, **fields):
+        """Actualiza columnas de una fuente (estado, validadores HTTP, próximo refresco...)"""
+        if not fields:
+            return
+        conn = self.get_connection()
+        try:
+            assignments = ', '.join(f'{name} = ?' for name in fields)
+            conn.execute(f'UPDATE epg_sources SET {assignments} WHERE id = ?', (*fields.values(), source_id))
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def schedule_epg_refresh(self):
+        """Marca todas las fuentes para refrescarse en la próxima vuelta del refresco"""
+        conn = self.get_connection()
+        try:
+            conn.execute('UPDATE epg_sources SET next_refresh_at = 0')
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def get_channel_tvg_ids(self):
+        """tvg-id (en minúsculas) de todos los canales: solo se guarda la programación de estos"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute("SELECT DISTINCT lower(tvg_id) FROM channels WHERE tvg_id IS NOT NULL AND tvg_id != ''")
+            return {row[0] for row in cursor.fetchall()}
+        finally:
+            conn.close()
+    
+    def add_programmes(self, source_id, generation, programmes, batch_size=5000):
+        """Inserta programas (tvg_id, start, stop, title, subtitle, description, category).
+
+        Confirma cada `batch_size` filas para no bloquear a otros escritores durante
+        toda la importación; la generación nueva no es visible hasta activarla.
+        """
+        conn = self.get_connection()
+        try:
+            count = 0
+            batch = []
+            for programme in programmes:
+                batch.append((source_id, generation) + tuple(programme))
+                if len(batch) >= batch_size:
+                    self._insert_programmes(conn, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self._insert_programmes(conn, batch)
+                count += len(batch)
+            return count
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _insert_programmes(conn, rows):
+        conn.executemany(
+            '''INSERT INTO programmes (source_id, generation, tvg_id, start, stop, title, subtitle, description, category)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            rows
+        )
+        conn.commit()
+    
+    def activate_epg_generation(self, source_id, generation, **fields):
+        """Publica la generación nueva de una fuente y borra las anteriores"""
+        conn = self.get_connection()
+        try:
+            assignments = ''.join(f', {name} = ?' for name in fields)
+            conn.execute(
+                f'UPDATE epg_sources SET generation = ?{assignments} WHERE id = ?',
+                (generation, *fields.values(), source_id)
+            )
+            conn.execute('DELETE FROM programmes WHERE source_id = ? AND generation != ?', (source_id, generation))
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def discard_epg_generation(self, source_id, generation):
+        """Borra una generación que no llegó a activarse (importación fallida)"""
+        conn = self.get_connection()
+        try:
+            conn.execute('DELETE FROM programmes WHERE source_id = ? AND generation = ?', (source_id, generation))
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def prune_programmes(self, before):
+        """Borra los programas que terminaron antes de `before`"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('DELETE FROM programmes WHERE stop < ?', (before,))
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+    
+    def get_now_next(self, tvg_ids, now):
+        """Programa actual y siguiente de cada tvg-id: {tvg_id: {'now': ..., 'next': ...}}"""
+        conn = self.get_connection()
+        try:
+            result = {}
+            for tvg_id in tvg_ids:
+                # Una búsqueda en el índice (tvg_id, stop) por canal; varias fuentes pueden solaparse
+                rows = conn.execute(
+                    '''SELECT p.start, p.stop, p.title, p.subtitle, p.description, p.category
+                       FROM programmes p
+                       JOIN epg_sources s ON s.id = p.source_id AND s.generation = p.generation
+                       WHERE p.tvg_id = ? AND p.stop > ?
+                       ORDER BY p.stop
+                       LIMIT 4''',
+                    (tvg_id.lower(), now)
+                ).fetchall()
+                current = next((dict(row) for row in rows if row['start'] <= now), None)
+                after = current['stop'] if current else now
+                upcoming = next((dict(row) for row in rows if row['start'] >= after), None)
+                result[tvg_id] = {'now': current, 'next': upcoming}
+            return result
+        finally:
+            conn.close()
+    
     def add_favorite(self, channel_id):
         """Agregar canal a favoritos"""
         conn = self.get_connection()
@@ -262,12 +854,12 @@ class Database:
         finally:
             conn.close()
     
-    def get_favorites(self):
-        """Obtener canales favoritos"""
+    def get_favorites(self, fields=None):
+        """Obtener canales favoritos (con `fields` solo esas columnas de channels)"""
         conn = self.get_connection()
         try:
             cursor = conn.execute(
-                '''SELECT c.*, f.created_at as favorited_at 
+                f'''SELECT {self._select_columns(fields, 'c.')}, f.created_at as favorited_at 
                    FROM channels c 
                    JOIN favorites f ON c.id = f.channel_id 
                    ORDER BY f.created_at DESC'''
@@ -276,6 +868,61 @@ class Database:
         finally:
             conn.close()
     
+    def get_export_version(self):
+        """Estado de los datos que entran en una exportación M3U (versiones de las listas y favoritos)"""
+        conn = self.get_connection()
+        try:
+            playlists = conn.execute('SELECT id, version FROM playlists ORDER BY id').fetchall()
+            # favorites usa AUTOINCREMENT: cualquier alta o baja cambia el recuento o el id máximo
+            count, last_id = conn.execute('SELECT COUNT(*), COALESCE(MAX(id), 0) FROM favorites').fetchone()
+            versions = ','.join(f"{row['id']}:{row['version']}" for row in playlists)
+            return f'{versions}|{count}:{last_id}'
+        finally:
+            conn.close()
+    
+    def iter_export_channels(self, playlist_ids=None, group_ids=None, group_titles=None, favorites=False,
+                             batch_size=5000):
+        """Recorre los canales de una exportación M3U, favoritos primero.
+
+        `playlist_ids`, `group_ids` y `group_titles` acotan la selección; con
+        `favorites=True` se le añaden los favoritos (o son solo ellos si no hay otros filtros).
+        """
+        conditions, params = [], []
+        if playlist_ids:
+            conditions.append(f"c.playlist_id IN ({', '.join('?' * len(playlist_ids))})")
+            params.extend(playlist_ids)
+        group_conditions = []
+        if group_ids:
+            group_conditions.append(f"c.group_id IN ({', '.join('?' * len(group_ids))})")
+            params.extend(group_ids)
+        if group_titles:
+            group_conditions.append(f"c.group_title IN ({', '.join('?' * len(group_titles))})")
+            params.extend(group_titles)
+        if group_conditions:
+            conditions.append(f"({' OR '.join(group_conditions)})")
+        
+        where = ' AND '.join(conditions)
+        is_favorite = 'c.id IN (SELECT channel_id FROM favorites)'
+        if favorites:
+            where = f'{is_favorite} OR ({where})' if where else is_favorite
+        
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute(
+                f'''SELECT c.id, c.name, c.url, c.logo, c.tvg_id, c.tvg_name, c.group_title
+                   FROM channels c WHERE {where or '1'}
+                   ORDER BY {is_favorite} DESC, c.playlist_id, c.group_title, c.name''',
+                params
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.close()
+    
     def toggle_favorite(self, channel_id):
         """Toggle favorito de un canal. Retorna True si se agregó, False si se eliminó"""
         conn = self.get_connection()
@@ -304,4 +951,76 @@ class Database:
             cursor = conn.execute('SELECT id FROM favorites WHERE channel_id = ?', (channel_id,))
             return cursor.fetchone() is not None
         finally:
-            conn.close()
\ No newline at end of file
+            conn.close()
+    
+    # === Mantenimiento ===
+    
+    def get_storage_stats(self):
+        """Tamaño en disco de la base y el WAL, páginas libres y modo de auto_vacuum"""
+        conn = self.get_connection()
+        try:
+            stats = {
+                'page_size': conn.execute('PRAGMA page_size').fetchone()[0],
+                'page_count': conn.execute('PRAGMA page_count').fetchone()[0],
+                'freelist_count': conn.execute('PRAGMA freelist_count').fetchone()[0],
+                'auto_vacuum': ('none', 'full', 'incremental')[conn.execute('PRAGMA auto_vacuum').fetchone()[0]],
+                'analyzed': conn.execute(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'"
+                ).fetchone()[0] > 0
+            }
+        finally:
+            conn.close()
+        for key, suffix in (('db_bytes', ''), ('wal_bytes', '-wal')):
+            try:
+                stats[key] = os.path.getsize(self.db_path + suffix)
+            except OSError:
+                stats[key] = 0
+        return stats
+    
+    def checkpoint_wal(self, mode='TRUNCATE'):
+        """Vuelca el WAL a la base. Retorna (ocupada, páginas en el WAL, páginas volcadas)"""
+        conn = self.get_connection()
+        try:
+            return tuple(conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone())
+        finally:
+            conn.close()
+    
+    def analyze(self, analysis_limit=1000):
+        """Actualiza las estadísticas del planificador (muestreo de `analysis_limit` filas por índice)"""
+        conn = self.get_connection()
+        try:
+            conn.execute(f'PRAGMA analysis_limit = {int(analysis_limit)}')
+            conn.execute('ANALYZE')
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def optimize(self):
+        """PRAGMA optimize: vuelve a analizar solo las tablas que lo necesitan"""
+        conn = self.get_connection()
+        try:
+            conn.execute('PRAGMA analysis_limit = 1000')
+            conn.execute('PRAGMA optimize')
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def enable_incremental_vacuum(self):
+        """Pasa la base a auto_vacuum incremental (requiere un VACUUM completo, una sola vez)"""
+        conn = self.get_connection()
+        conn.isolation_level = None
+        try:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+    
+    def incremental_vacuum(self, pages):
+        """Devuelve al sistema hasta `pages` páginas libres. Retorna las que quedan libres"""
+        conn = self.get_connection()
+        try:
+            # Con execute() solo se ejecuta el primer paso (una página); executescript lo completa
+            conn.executescript(f'PRAGMA incremental_vacuum({int(pages)})')
+            return conn.execute('PRAGMA freelist_count').fetchone()[0]
+        finally:
+            conn.close()
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from .lifecycle import wait_for_leadership
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseMaintenance:
+    """Mantenimiento periódico de SQLite en segundo plano.
+
+    - Vuelca y trunca el WAL cuando pasa de `wal_max_bytes` (los lectores largos
+      pueden impedir que se recicle y el fichero crece sin límite).
+    - Tras importaciones o refrescos (cambia la versión de alguna lista) actualiza las
+      estadísticas del planificador, y además una vez cada `optimize_interval`.
+    - Cuando las páginas libres (las que deja el borrado en cascada de una lista, un
+      refresco o la poda de la guía) llegan a `min_free_pages` o a `free_ratio` del
+      fichero, las devuelve al sistema por tandas de `vacuum_step` páginas para no
+      bloquear las escrituras. Una base
+      creada antes del auto_vacuum incremental se convierte con un VACUUM completo
+      (bloquea la base y necesita el doble de disco) solo si ocupa hasta
+      `convert_max_bytes`; si no, esta tarea no hace nada.
+
+    Solo un worker del host lo ejecuta. El resultado de cada tarea se guarda en
+    `state_path` para poder consultarlo desde cualquier worker.
+    """
+
+    def __init__(self, db, lock_path, state_path, wal_max_bytes=64 * 1024 * 1024, free_ratio=0.1,
+                 min_free_pages=2048, vacuum_step=1000, optimize_interval=24 * 3600, idle_sleep=60,
+                 convert_max_bytes=256 * 1024 * 1024):
+        self.db = db
+        self.lock_path = lock_path
+        self.state_path = state_path
+        self.wal_max_bytes = wal_max_bytes
+        self.free_ratio = free_ratio
+        self.min_free_pages = min_free_pages
+        self.vacuum_step = vacuum_step
+        self.optimize_interval = optimize_interval
+        self.idle_sleep = idle_sleep
+        self.convert_max_bytes = convert_max_bytes
+        self._convert_skipped = False
+        self._lock_fd = None
+        self._playlist_versions = None
+        self._last_optimize = 0
+
+    def read_state(self):
+        """Última ejecución de cada tarea: {tarea: {'at', 'duration', ...}}"""
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _record(self, task, started, **details):
+        state = self.read_state()
+        state[task] = dict(details, at=started, duration=round(time.time() - started, 3))
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def checkpoint(self, stats):
+        if stats['wal_bytes'] < self.wal_max_bytes:
+            return False
+        started = time.time()
+        busy, log_pages, checkpointed = self.db.checkpoint_wal('TRUNCATE')
+        self._record('checkpoint', started, wal_bytes=stats['wal_bytes'], busy=bool(busy),
+                     log_pages=log_pages, checkpointed=checkpointed)
+        if busy:
+            logger.warning(f"WAL checkpoint incomplete ({checkpointed}/{log_pages} pages): readers still active")
+        return True
+
+    def analyze(self, stats):
+        now = time.time()
+        playlist_versions = self.db.get_playlist_versions()
+        imported = self._playlist_versions is not None and playlist_versions != self._playlist_versions
+        self._playlist_versions = playlist_versions
+
+        if not stats['analyzed'] or imported:
+            # Sin estadísticas o tras cambiar los datos: ANALYZE (muestreado) de todo
+            self.db.analyze()
+            self._record('analyze', now, reason='import' if imported else 'initial')
+        elif now - self._last_optimize >= self.optimize_interval:
+            self.db.optimize()
+            self._record('optimize', now)
+        else:
+            return False
+        self._last_optimize = now
+        return True
+
+    def vacuum(self, stats):
+        if stats['auto_vacuum'] != 'incremental':
+            size = stats['db_bytes'] + stats['wal_bytes']
+            free_disk = shutil.disk_usage(os.path.dirname(os.path.abspath(self.db.db_path))).free
+            if size > self.convert_max_bytes or free_disk < 2 * size:
+                if not self._convert_skipped:
+                    logger.info(f"Database of {size / 1024 / 1024:.0f} MB not converted to incremental vacuum "
+                                f"(limit {self.convert_max_bytes / 1024 / 1024:.0f} MB, {free_disk / 1024 / 1024:.0f} MB free)")
+                    self._convert_skipped = True
+                return False
+            # Solo una vez: a partir de aquí el espacio libre se recupera por tandas
+            started = time.time()
+            self.db.enable_incremental_vacuum()
+            self._record('enable_incremental_vacuum', started, db_bytes=stats['db_bytes'])
+            logger.info(f"Database switched to incremental vacuum in {time.time() - started:.1f}s")
+            return True
+
+        free = stats['freelist_count']
+        if free < min(self.min_free_pages, stats['page_count'] * self.free_ratio):
+            return False
+        started = time.time()
+        while free > 0:
+            remaining = self.db.incremental_vacuum(self.vacuum_step)
+            if remaining >= free:
+                break
+            free = remaining
+            # Pausa entre tandas para dejar pasar las escrituras de los workers
+            time.sleep(0.05)
+        self._record('incremental_vacuum', started, freed_pages=stats['freelist_count'] - free,
+                     page_size=stats['page_size'])
+        # Lo liberado queda en el WAL hasta el siguiente checkpoint
+        self.db.checkpoint_wal('TRUNCATE')
+        return True
+
+    def run_once(self):
+        """Ejecuta las tareas que tocan. Retorna las ejecutadas"""
+        done = []
+        for task in (self.analyze, self.vacuum, self.checkpoint):
+            # Estadísticas frescas antes de cada tarea: la anterior puede haberlas cambiado
+            if task(self.db.get_storage_stats()):
+                done.append(task.__name__)
+        return done
+
+    def run_forever(self):
+        self._lock_fd = wait_for_leadership(self.lock_path, self.idle_sleep)
+        logger.info('Database maintenance started')
+
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error in database maintenance: {e}")
+            time.sleep(self.idle_sleep)
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,216 @@
+import calendar
+import gzip
+import hashlib
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+
+from .lifecycle import wait_for_leadership
+from .m3u_parser import M3UParser
+
+logger = logging.getLogger(__name__)
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+
+def parse_xmltv_time(value):
+    """Convierte una hora XMLTV ('20240101120000 +0100') a timestamp UTC. None si no es válida"""
+    if not value:
+        return None
+    parts = value.split()
+    digits = parts[0]
+    offset = parts[1] if len(parts) > 1 else ''
+    if len(digits) > 14 and digits[14] in '+-':
+        digits, offset = digits[:14], digits[14:]
+    try:
+        seconds = calendar.timegm((
+            int(digits[0:4]), int(digits[4:6]), int(digits[6:8]),
+            int(digits[8:10] or 0), int(digits[10:12] or 0), int(digits[12:14] or 0), 0, 0, 0
+        ))
+        if offset:
+            sign = -1 if offset[0] == '-' else 1
+            offset = offset.lstrip('+-')
+            seconds -= sign * (int(offset[0:2]) * 3600 + int(offset[2:4] or 0) * 60)
+    except (ValueError, IndexError):
+        return None
+    return seconds
+
+
+def open_xmltv(path):
+    """Abre un fichero XMLTV, descomprimiéndolo si es gzip"""
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    return gzip.open(path, 'rb') if magic == b'\x1f\x8b' else open(path, 'rb')
+
+
+def iter_programmes(fileobj, tvg_ids=None, since=None):
+    """Recorre un XMLTV en streaming y genera (tvg_id, start, stop, title, subtitle, description, category).
+
+    Con iterparse y vaciando la raíz tras cada elemento la memoria no crece con el
+    tamaño de la guía. Se descartan los canales fuera de `tvg_ids` y los programas
+    que terminaron antes de `since`.
+    """
+    context = ET.iterparse(fileobj, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event != 'end' or elem.tag not in ('programme', 'channel'):
+            continue
+        if elem.tag == 'programme':
+            tvg_id = (elem.get('channel') or '').lower()
+            if tvg_id and (tvg_ids is None or tvg_id in tvg_ids):
+                start = parse_xmltv_time(elem.get('start'))
+                stop = parse_xmltv_time(elem.get('stop'))
+                if start is not None and stop is not None and stop > start and (since is None or stop >= since):
+                    yield (
+                        tvg_id, start, stop,
+                        elem.findtext('title'), elem.findtext('sub-title'),
+                        elem.findtext('desc'), elem.findtext('category')
+                    )
+        root.clear()
+
+
+class EPGRefresher:
+    """Refresco periódico en segundo plano de las guías XMLTV.
+
+    Cada fuente se descarga con GET condicional (ETag/Last-Modified) a un fichero
+    local; si no ha cambiado ni el contenido ni el conjunto de tvg-id de los canales,
+    no se vuelve a procesar. Si cambia, la programación se importa como una
+    generación nueva que sustituye a la anterior al terminar. Los fallos reintentan
+    con espera exponencial. Solo un worker del host lo ejecuta (lock en `lock_path`).
+    """
+
+    def __init__(self, db, cache_dir, lock_path, interval=12 * 3600, keep_past=6 * 3600,
+                 extra_urls=(), timeout=60, retry_base=900, idle_sleep=60):
+        self.db = db
+        self.cache_dir = cache_dir
+        self.lock_path = lock_path
+        self.interval = interval
+        self.keep_past = keep_past
+        self.extra_urls = list(extra_urls)
+        self.timeout = timeout
+        self.retry_base = retry_base
+        self.idle_sleep = idle_sleep
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self._lock_fd = None
+        self._playlist_versions = None
+
+    def init_dirs(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _backfill_playlist_urls(self):
+        """Lee url-tvg de las listas importadas antes de que se guardara"""
+        parser = M3UParser()
+        for playlist in self.db.get_playlists_missing_epg_url():
+            urls = parser.get_playlist_info(playlist['header'] or '')['epg_urls']
+            self.db.set_playlist_epg_url(playlist['id'], ','.join(urls))
+
+    def sync_sources(self):
+        self._backfill_playlist_urls()
+        urls = set(self.extra_urls)
+        for value in self.db.get_playlist_epg_urls():
+            urls.update(url.strip() for url in value.split(',') if url.strip())
+        self.db.sync_epg_sources(urls)
+
+    def _download(self, source, path):
+        """Descarga la fuente a `path`. Retorna (cambiado, etag, last_modified, hash)"""
+        headers = {}
+        if os.path.exists(path):
+            if source['etag']:
+                headers['If-None-Match'] = source['etag']
+            if source['last_modified']:
+                headers['If-Modified-Since'] = source['last_modified']
+
+        with self.session.get(source['url'], headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304:
+                return False, source['etag'], source['last_modified'], source['content_hash']
+            response.raise_for_status()
+            digest = hashlib.sha256()
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    digest.update(chunk)
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+            content_hash = digest.hexdigest()
+            return (content_hash != source['content_hash'], response.headers.get('ETag'),
+                    response.headers.get('Last-Modified'), content_hash)
+
+    def refresh_source(self, source, tvg_ids, channels_key):
+        """Refresca una fuente y guarda el resultado. Retorna el estado ('ok', 'not_modified', 'error')"""
+        started = time.time()
+        path = os.path.join(self.cache_dir, f"source_{source['id']}.xml")
+        generation = source['generation'] + 1
+        try:
+            changed, etag, last_modified, content_hash = self._download(source, path)
+            if not changed and channels_key == source['channels_key']:
+                self.db.update_epg_source(
+                    source['id'], status='not_modified', error=None, refreshed_at=started,
+                    duration=time.time() - started, next_refresh_at=started + self.interval, failures=0,
+                    etag=etag, last_modified=last_modified
+                )
+                return 'not_modified'
+
+            with open_xmltv(path) as f:
+                count = self.db.add_programmes(
+                    source['id'], generation, iter_programmes(f, tvg_ids, since=started - self.keep_past)
+                )
+            self.db.activate_epg_generation(
+                source['id'], generation, programmes=count, status='ok', error=None,
+                refreshed_at=started, duration=time.time() - started, next_refresh_at=started + self.interval,
+                failures=0, etag=etag, last_modified=last_modified, content_hash=content_hash,
+                channels_key=channels_key
+            )
+            logger.info(f"EPG {source['url']}: {count} programas en {time.time() - started:.1f}s")
+            return 'ok'
+        except Exception as e:
+            logger.error(f"Error refreshing EPG {source['url']}: {e}")
+            self.db.discard_epg_generation(source['id'], generation)
+            failures = source['failures'] + 1
+            self.db.update_epg_source(
+                source['id'], status='error', error=str(e), refreshed_at=started,
+                duration=time.time() - started, failures=failures,
+                next_refresh_at=started + min(self.interval, self.retry_base * 2 ** (failures - 1))
+            )
+            return 'error'
+
+    def run_once(self):
+        """Sincroniza las fuentes, refresca las que tocan y borra la programación pasada"""
+        self.sync_sources()
+        now = time.time()
+        # Si se han importado canales, todas las fuentes se revisan (solo se reprocesan
+        # las que tengan tvg-id nuevos; la descarga sigue siendo condicional)
+        playlist_versions = self.db.get_playlist_versions()
+        channels_changed = self._playlist_versions is not None and playlist_versions != self._playlist_versions
+        self._playlist_versions = playlist_versions
+        due = [source for source in self.db.get_epg_sources()
+               if channels_changed or source['next_refresh_at'] <= now]
+        if due:
+            tvg_ids = self.db.get_channel_tvg_ids()
+            channels_key = hashlib.sha1('\n'.join(sorted(tvg_ids)).encode('utf-8')).hexdigest()
+            for source in due:
+                self.refresh_source(source, tvg_ids, channels_key)
+        self.db.prune_programmes(time.time() - self.keep_past)
+        return len(due)
+
+    def run_forever(self):
+        self._lock_fd = wait_for_leadership(self.lock_path, self.idle_sleep)
+        logger.info('EPG refresher started')
+
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error refreshing EPG: {e}")
+            time.sleep(self.idle_sleep)
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, daemon=True)
+        thread.start()
+        return thread
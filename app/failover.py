@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class SourceHealth:
+    """Salud de cada URL de origen con backoff exponencial tras fallos.
+
+    Una fuente que falla queda en cuarentena `base_cooldown * 2^(fallos-1)`
+    segundos (hasta `max_cooldown`) y se evita al elegir fuente.
+    """
+
+    def __init__(self, base_cooldown=30, max_cooldown=600):
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    def record_failure(self, url, reason=None):
+        with self._lock:
+            info = self._sources.setdefault(url, {'failures': 0, 'successes': 0})
+            info['failures'] += 1
+            cooldown = min(self.base_cooldown * 2 ** (info['failures'] - 1), self.max_cooldown)
+            info['cooldown_until'] = time.time() + cooldown
+            info['last_failure'] = time.time()
+            info['last_reason'] = reason
+
+    def record_success(self, url):
+        with self._lock:
+            info = self._sources.setdefault(url, {'failures': 0, 'successes': 0})
+            info['failures'] = 0
+            info['successes'] += 1
+            info['cooldown_until'] = 0
+            info['last_success'] = time.time()
+
+    def is_available(self, url):
+        with self._lock:
+            info = self._sources.get(url)
+            return not info or info.get('cooldown_until', 0) <= time.time()
+
+    def order(self, urls):
+        """Ordena las URLs dejando primero las disponibles (orden original dentro de cada bloque)"""
+        available = [url for url in urls if self.is_available(url)]
+        return available + [url for url in urls if url not in available]
+
+    def snapshot(self, urls):
+        with self._lock:
+            return {url: dict(self._sources.get(url, {})) for url in urls}
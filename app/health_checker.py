@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+from .lifecycle import wait_for_leadership
+
+logger = logging.getLogger(__name__)
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+
+class RateLimiter:
+    """Limita el número de peticiones por segundo (token bucket compartido entre hilos)"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def probe_url(url, timeout=5):
+    """Comprueba si una URL de canal responde. Retorna (status, latencia_ms)"""
+    start = time.perf_counter()
+    try:
+        if urlparse(url).path.lower().endswith('.m3u8'):
+            # Manifest HLS: descargar el inicio y verificar la cabecera
+            with requests.get(url, headers=HEADERS, timeout=timeout, stream=True) as response:
+                head = next(response.iter_content(chunk_size=1024), b'')
+                alive = response.status_code < 400 and b'#EXTM3U' in head
+        else:
+            response = requests.head(url, headers=HEADERS, timeout=timeout, allow_redirects=True)
+            if response.status_code in (403, 405, 501):
+                # Muchos servidores IPTV no soportan HEAD: abrir el stream y cerrarlo
+                with requests.get(url, headers=HEADERS, timeout=timeout, stream=True) as response:
+                    pass
+            alive = response.status_code < 400
+    except requests.RequestException:
+        alive = False
+
+    latency_ms = int((time.perf_counter() - start) * 1000)
+    return ('online' if alive else 'offline'), latency_ms
+
+
+class ChannelHealthChecker:
+    """Comprobador en segundo plano del estado de los canales.
+
+    Procesa en lotes los canales con la comprobación más antigua, con un pool
+    de hilos acotado, un límite global de peticiones por segundo y un límite
+    de conexiones simultáneas por proveedor. Solo un worker del host lo ejecuta
+    (lock de fichero en `lock_path`).
+
+    Con `scheduler` cada comprobación ocupa además uno de sus slots por proveedor,
+    así no se supera el límite de conexiones que comparte con los streams; si el
+    proveedor está lleno el canal se deja para un lote posterior.
+
+    La versión de salud de las listas (sus ETags) cambia al terminar cada pasada, o
+    cada `version_interval` segundos durante una pasada larga, no con cada lote.
+    """
+
+    def __init__(self, db, lock_path, concurrency=16, per_host=2, rate=20,
+                 max_age=6 * 3600, batch_size=500, timeout=5, idle_sleep=60, version_interval=300,
+                 scheduler=None):
+        self.db = db
+        self.lock_path = lock_path
+        self.scheduler = scheduler
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.idle_sleep = idle_sleep
+        self.version_interval = version_interval
+        self._changed_playlists = set()
+        self._last_version_bump = time.time()
+        self.rate_limiter = RateLimiter(rate)
+        self.host_semaphores = defaultdict(lambda: threading.BoundedSemaphore(per_host))
+        self.host_semaphores_lock = threading.Lock()
+        self._lock_fd = None
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).hostname or ''
+        with self.host_semaphores_lock:
+            return self.host_semaphores[host]
+
+    def _check(self, url):
+        """Comprueba una URL. Retorna None si su proveedor no tiene conexiones libres"""
+        with self._host_semaphore(url):
+            lease = self.scheduler.try_acquire_host(url) if self.scheduler else None
+            if self.scheduler and lease is None:
+                return None
+            try:
+                self.rate_limiter.wait()
+                return probe_url(url, timeout=self.timeout)
+            finally:
+                if lease:
+                    lease.release()
+
+    @staticmethod
+    def _interleave_hosts(urls):
+        """Alterna proveedores para que un host lento no bloquee todo el pool"""
+        by_host = defaultdict(list)
+        for url in urls:
+            by_host[urlparse(url).hostname or ''].append(url)
+        queues = list(by_host.values())
+        ordered = []
+        while queues:
+            for queue in list(queues):
+                ordered.append(queue.pop())
+                if not queue:
+                    queues.remove(queue)
+        return ordered
+
+    def check_batch(self, executor):
+        """Comprueba un lote de canales. Retorna el número de canales actualizados"""
+        channels = self.db.get_channels_to_check(time.time() - self.max_age, self.batch_size)
+        if not channels:
+            self._bump_versions()
+            return 0
+
+        urls = self._interleave_hosts({channel['url'] for channel in channels})
+        results = dict(zip(urls, executor.map(self._check, urls)))
+
+        checked_at = time.time()
+        checked = [channel for channel in channels if results[channel['url']] is not None]
+        self._changed_playlists.update(self.db.update_channels_health([
+            (results[channel['url']][0], results[channel['url']][1], checked_at, channel['id'])
+            for channel in checked
+        ]))
+        # Último lote de la pasada o pasada larga: publicar los cambios
+        if len(channels) < self.batch_size or time.time() - self._last_version_bump >= self.version_interval:
+            self._bump_versions()
+        # Sin ninguno comprobado (proveedores llenos) se espera antes de reintentar
+        return len(checked)
+
+    def _bump_versions(self):
+        self.db.bump_health_versions(self._changed_playlists)
+        self._changed_playlists = set()
+        self._last_version_bump = time.time()
+
+    def run_forever(self):
+        self._lock_fd = wait_for_leadership(self.lock_path, self.idle_sleep)
+        logger.info('Channel health checker started')
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                try:
+                    if not self.check_batch(executor):
+                        time.sleep(self.idle_sleep)
+                except Exception as e:
+                    logger.error(f"Error checking channel health: {e}")
+                    time.sleep(self.idle_sleep)
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, daemon=True)
+        thread.start()
+        return thread
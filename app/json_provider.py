@@ -0,0 +1,34 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa el json de Flask
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask basado en orjson (serialización en C, salida compacta)"""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(obj)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def install_json_provider(app):
+    """Usa orjson para jsonify si está instalado. Retorna True si se activó"""
+    if orjson is None:
+        return False
+    app.json = OrjsonProvider(app)
+    return True
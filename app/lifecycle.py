@@ -0,0 +1,182 @@
+import fcntl
+import logging
+import os
+import shutil
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def acquire_leadership(lock_path):
+    """Intenta tomar el lock de fichero que elige a un único worker del host para una tarea.
+
+    Retorna el fd, que debe seguir abierto mientras el proceso sea el líder (el lock se
+    libera solo si el proceso muere), o None si otro proceso ya lo tiene.
+    """
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def wait_for_leadership(lock_path, interval):
+    """Reintenta cada `interval` segundos hasta ser el líder. Retorna el fd del lock"""
+    while True:
+        fd = acquire_leadership(lock_path)
+        if fd is not None:
+            return fd
+        time.sleep(interval)
+
+
+def _read_ppid(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # El nombre del proceso puede contener espacios: partir tras el último ')'
+            return int(f.read().rsplit(')', 1)[1].split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _read_process(pid):
+    """(ppid, argv) de un proceso desde /proc; None si ya no existe"""
+    ppid = _read_ppid(pid)
+    if ppid is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            argv = f.read().decode('utf-8', errors='ignore').split('\0')
+    except OSError:
+        return None
+    return ppid, argv
+
+
+def find_ffmpeg_processes(hls_dir, parents=None):
+    """FFmpeg del host que escriben en `hls_dir`: [(pid, ppid, directorio del stream)]
+
+    Con `parents` solo se miran los procesos hijos de esos pids (sin leer la línea de
+    comandos del resto).
+    """
+    if not os.path.isdir('/proc'):
+        return []
+    prefix = os.path.join(os.path.abspath(hls_dir), '')
+    processes = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        if parents is not None and _read_ppid(int(name)) not in parents:
+            continue
+        info = _read_process(int(name))
+        if not info or 'ffmpeg' not in os.path.basename(info[1][0]):
+            continue
+        ppid, argv = info
+        for arg in argv:
+            if arg.startswith(prefix):
+                stream_id = arg[len(prefix):].split(os.sep, 1)[0]
+                processes.append((int(name), ppid, os.path.join(prefix, stream_id)))
+                break
+    return processes
+
+
+def _terminate(pids, timeout=5):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+    deadline = time.time() + timeout
+    remaining = set(pids)
+    while remaining and time.time() < deadline:
+        remaining = {pid for pid in remaining if _read_process(pid)}
+        if remaining:
+            time.sleep(0.1)
+    for pid in remaining:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+# Huérfanos a los que ya se mandó SIGTERM sin esperar: {pid: (plazo para SIGKILL, directorio)}
+_terminating = {}
+
+
+def _kill_pending(timeout):
+    """Sin bloquear: SIGTERM a los huérfanos nuevos, SIGKILL a los que siguen vivos pasado
+    `timeout`. Retorna los directorios de los que ya han terminado."""
+    now = time.time()
+    finished = set()
+    for pid, (deadline, stream_dir) in list(_terminating.items()):
+        if not _read_process(pid):
+            finished.add(stream_dir)
+            del _terminating[pid]
+        elif now >= deadline:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+    return finished
+
+
+def sweep_orphans(hls_dir, clear_unused=False, wait=True, timeout=5):
+    """Termina los FFmpeg huérfanos de `hls_dir` y borra sus directorios.
+
+    Un FFmpeg es huérfano si su worker murió: el kernel lo reasigna a init (o al
+    master de gunicorn cuando es el PID 1 del contenedor). Con `clear_unused=True`
+    (al arrancar, sin workers) también se borran los directorios de streams que ningún
+    FFmpeg usa y los informes de recursos de workers anteriores.
+
+    Con `wait=False` (desde el master al morir un worker) no se espera: se manda SIGTERM
+    y el SIGKILL y el borrado de sus directorios quedan para la siguiente pasada.
+    Retorna (procesos terminados, directorios borrados).
+    """
+    if not os.path.isdir(hls_dir):
+        return 0, 0
+    reparented_to = {1, os.getpid()}
+    if clear_unused:
+        processes = find_ffmpeg_processes(hls_dir)
+    else:
+        processes = find_ffmpeg_processes(hls_dir, parents=reparented_to)
+    orphans = [(pid, stream_dir) for pid, ppid, stream_dir in processes if ppid in reparented_to]
+
+    if wait:
+        _terminate([pid for pid, _ in orphans], timeout)
+        stale_dirs = {stream_dir for _, stream_dir in orphans}
+    else:
+        for pid, stream_dir in orphans:
+            if pid in _terminating:
+                continue
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+            _terminating[pid] = (time.time() + timeout, stream_dir)
+        stale_dirs = _kill_pending(timeout)
+
+    if clear_unused:
+        in_use = {stream_dir for pid, ppid, stream_dir in processes if ppid not in reparented_to}
+        for name in os.listdir(hls_dir):
+            path = os.path.join(os.path.abspath(hls_dir), name)
+            # Los directorios ocultos (.locks, .resources) son del propio servidor
+            if not name.startswith('.') and os.path.isdir(path) and path not in in_use:
+                stale_dirs.add(path)
+        resources_dir = os.path.join(hls_dir, '.resources')
+        if os.path.isdir(resources_dir):
+            for name in os.listdir(resources_dir):
+                try:
+                    os.remove(os.path.join(resources_dir, name))
+                except OSError:
+                    pass
+
+    if stale_dirs and not clear_unused:
+        # Otro worker puede haber relanzado ya el stream en el mismo directorio
+        stale_dirs -= {stream_dir for pid, ppid, stream_dir in find_ffmpeg_processes(hls_dir)
+                       if ppid not in reparented_to}
+    for path in stale_dirs:
+        shutil.rmtree(path, ignore_errors=True)
+    if orphans or stale_dirs:
+        logger.info(f"Swept {len(orphans)} orphaned FFmpeg processes and {len(stale_dirs)} stream dirs")
+    return len(orphans), len(stale_dirs)
@@ -0,0 +1,191 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+import requests
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow es opcional: sin él se guarda la imagen original
+    Image = None
+
+THUMBNAIL_MIMETYPE = 'image/webp'
+# Tipos que se guardan tal cual si no se pueden reducir
+PASSTHROUGH_MIMETYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/svg+xml'}
+
+
+class LogoCache:
+    """Caché en disco de logos de canales reducidos a miniatura.
+
+    Las miniaturas se guardan por el hash de su contenido en `objects/` (logos
+    repetidos entre canales o listas ocupan una sola vez) y cada URL de origen
+    apunta a su objeto con un pequeño JSON en `urls/`. Los fallos también se
+    recuerdan durante `failure_ttl` para no reintentar enlaces muertos en cada página.
+    La mtime de los objetos hace de marca LRU para la expulsión por tamaño.
+    """
+
+    def __init__(self, cache_dir, max_bytes=100 * 1024 * 1024, size=128, fetch_timeout=5,
+                 max_source_bytes=5 * 1024 * 1024, failure_ttl=3600):
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.urls_dir = os.path.join(cache_dir, 'urls')
+        self.max_bytes = max_bytes
+        self.size = size
+        self.fetch_timeout = fetch_timeout
+        self.max_source_bytes = max_source_bytes
+        self.failure_ttl = failure_ttl
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'Mozilla/5.0 (IPTV Web Client)'
+        self._url_locks = {}
+        self._locks_lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._bytes = None
+
+    def init_dirs(self):
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.urls_dir, exist_ok=True)
+
+    @staticmethod
+    def _write_atomic(path, data):
+        # Renombrar es atómico: otros workers nunca ven un fichero a medias
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _url_path(self, url):
+        return os.path.join(self.urls_dir, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def _lookup(self, url):
+        """Entrada guardada para la URL: {'digest', 'mimetype'} o {'failed_at'}; None si no hay"""
+        try:
+            with open(self._url_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if 'failed_at' in entry:
+            return entry if time.time() - entry['failed_at'] < self.failure_ttl else None
+        return entry if os.path.exists(self._object_path(entry['digest'])) else None
+
+    def _touch(self, path):
+        # Actualizar la mtime como mucho una vez por hora evita escrituras en cada acierto
+        try:
+            if time.time() - os.path.getmtime(path) > 3600:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def _download(self, url):
+        """Descarga la imagen con límite de tamaño. Retorna (bytes, mimetype)"""
+        with self.session.get(url, timeout=self.fetch_timeout, stream=True) as response:
+            response.raise_for_status()
+            mimetype = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            data = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                data += chunk
+                if len(data) > self.max_source_bytes:
+                    raise ValueError(f'Logo demasiado grande (> {self.max_source_bytes} bytes)')
+        return bytes(data), mimetype
+
+    def _thumbnail(self, data, mimetype):
+        """Reduce la imagen a `size` píxeles de lado. Retorna (bytes, mimetype)"""
+        if Image is not None and mimetype != 'image/svg+xml':
+            with Image.open(io.BytesIO(data)) as image:
+                # draft() decodifica los JPEG grandes directamente a escala reducida
+                image.draft('RGB', (self.size * 2, self.size * 2))
+                image.thumbnail((self.size, self.size))
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA')
+                output = io.BytesIO()
+                image.save(output, format='WEBP', quality=80, method=4)
+                return output.getvalue(), THUMBNAIL_MIMETYPE
+        if mimetype not in PASSTHROUGH_MIMETYPES:
+            raise ValueError(f'Tipo de imagen no soportado: {mimetype or "desconocido"}')
+        return data, mimetype
+
+    def _store(self, url):
+        try:
+            thumbnail, mimetype = self._thumbnail(*self._download(url))
+        except Exception as e:
+            self._write_atomic(self._url_path(url), json.dumps({'failed_at': time.time(), 'error': str(e)}).encode())
+            return None
+
+        digest = hashlib.sha256(thumbnail).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write_atomic(path, thumbnail)
+            self._account(len(thumbnail))
+        entry = {'digest': digest, 'mimetype': mimetype}
+        self._write_atomic(self._url_path(url), json.dumps(entry).encode())
+        return entry
+
+    def get(self, url):
+        """Retorna (ruta, mimetype, digest, acierto); ruta None si el logo no está disponible"""
+        entry = self._lookup(url)
+        hit = entry is not None
+        if not hit:
+            # Un solo hilo descarga cada URL; los demás esperan y leen su resultado
+            with self._locks_lock:
+                url_lock = self._url_locks.setdefault(url, threading.Lock())
+            with url_lock:
+                entry = self._lookup(url) or self._store(url)
+            with self._locks_lock:
+                self._url_locks.pop(url, None)
+
+        if not entry or 'digest' not in entry:
+            return None, None, None, hit
+        path = self._object_path(entry['digest'])
+        self._touch(path)
+        return path, entry['mimetype'], entry['digest'], hit
+
+    def _scan(self):
+        objects = []
+        for root, _, files in os.walk(self.objects_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                objects.append((stat.st_mtime, stat.st_size, path))
+        return objects
+
+    def _account(self, added):
+        with self._evict_lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._scan())
+            self._bytes += added
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Borra los objetos usados hace más tiempo hasta quedar en el 90% del límite"""
+        objects = sorted(self._scan())
+        total = sum(size for _, size, _ in objects)
+        target = self.max_bytes * 0.9
+        for _, size, path in objects:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        # Las entradas de urls/ que apuntan a objetos borrados se descartan al leerlas
+        self._bytes = total
+
+    def stats(self):
+        objects = self._scan()
+        return {
+            'objects': len(objects),
+            'bytes': sum(size for _, size, _ in objects),
+            'max_bytes': self.max_bytes,
+            'thumbnail_size': self.size,
+            'pillow': Image is not None
+        }
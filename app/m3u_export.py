@@ -0,0 +1,115 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+
+# Tamaño aproximado de cada trozo enviado al cliente
+CHUNK_SIZE = 64 * 1024
+# Atributos de #EXTINF y la columna de channels de la que salen
+EXTINF_ATTRIBUTES = (
+    ('tvg-id', 'tvg_id'), ('tvg-name', 'tvg_name'), ('tvg-logo', 'logo'), ('group-title', 'group_title')
+)
+
+
+def _attribute(value):
+    # Las comillas y saltos de línea romperían la línea #EXTINF
+    return (value or '').replace('"', "'").replace('\r', ' ').replace('\n', ' ')
+
+
+def format_entry(channel, url):
+    """Entrada #EXTINF + URL de un canal (los atributos vacíos se omiten)"""
+    attributes = ''.join(
+        f' {attribute}="{_attribute(channel[column])}"'
+        for attribute, column in EXTINF_ATTRIBUTES if channel[column]
+    )
+    name = (channel['name'] or '').replace('\r', ' ').replace('\n', ' ')
+    return f'#EXTINF:-1{attributes},{name}\n{url}\n'
+
+
+class M3UExporter:
+    """Exportación M3U filtrada, generada en streaming desde la base de datos.
+
+    Cada combinación de filtros se guarda en disco (compartido entre workers) con el
+    estado de los datos en el nombre: mientras no cambien las listas ni los favoritos
+    las peticiones se sirven del fichero, y la primera tras un cambio lo regenera
+    mientras lo envía. Solo se guarda la última versión de cada combinación.
+    """
+
+    def __init__(self, db, cache_dir, max_files=256):
+        self.db = db
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+
+    def init_dirs(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def filters_key(filters):
+        return hashlib.sha1(json.dumps(filters, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def etag(filters_key, version):
+        return hashlib.sha1(f'{filters_key}:{version}'.encode('utf-8')).hexdigest()[:20]
+
+    def path(self, filters_key, version):
+        return os.path.join(self.cache_dir, f'{filters_key}-{self.etag(filters_key, version)}.m3u')
+
+    def cached(self, filters_key, version):
+        """Ruta del fichero ya generado para estos filtros y datos (None si no existe)"""
+        path = self.path(filters_key, version)
+        return path if os.path.exists(path) else None
+
+    def generate(self, filters, filters_key, version, stream_url=None):
+        """Genera la lista por trozos y la guarda en caché al terminar.
+
+        `stream_url` ('.../api/stream/{id}/playlist.m3u8') sustituye la URL original de
+        cada canal. Si el cliente corta antes de terminar no se guarda nada.
+        """
+        path = self.path(filters_key, version)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        completed = False
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                parts = ['#EXTM3U\n']
+                size = len(parts[0])
+                for channel in self.db.iter_export_channels(**filters):
+                    url = stream_url.format(id=channel['id']) if stream_url else channel['url']
+                    entry = format_entry(channel, url)
+                    parts.append(entry)
+                    size += len(entry)
+                    if size >= CHUNK_SIZE:
+                        chunk = ''.join(parts)
+                        f.write(chunk)
+                        yield chunk
+                        parts, size = [], 0
+                chunk = ''.join(parts)
+                f.write(chunk)
+                yield chunk
+            os.replace(tmp_path, path)
+            completed = True
+            self._prune(filters_key, path)
+        finally:
+            if not completed:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def _prune(self, filters_key, current):
+        """Borra las versiones anteriores de estos filtros y, si hay demasiados, los más antiguos"""
+        for path in glob.glob(os.path.join(self.cache_dir, f'{filters_key}-*.m3u')):
+            if path != current:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        files = glob.glob(os.path.join(self.cache_dir, '*.m3u'))
+        if len(files) > self.max_files:
+            files.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+            for path in files[:len(files) - self.max_files]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -1,48 +1,140 @@
+import logging
+import multiprocessing
+import os
 import re
 import requests
-import re
-import requests
+import threading
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from urllib.parse import urlparse
 
+logger = logging.getLogger(__name__)
+
+# Por encima de este tamaño el parseo se reparte entre procesos
+DEFAULT_PARALLEL_THRESHOLD = 8 * 1024 * 1024
+
+# Marcas de calidad que no identifican al canal (p.ej. "La 1 HD" == "La 1")
+QUALITY_TOKENS = {'hd', 'fhd', 'uhd', 'sd', '4k', '8k', 'hevc', 'h264', 'h265',
+                  '1080p', '720p', '576p', '480p', 'backup'}
+
+def normalize_channel_name(name):
+    """Clave normalizada para detectar el mismo canal en distintas listas"""
+    if not name:
+        return ''
+    text = unicodedata.normalize('NFKD', name)
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    tokens = re.findall(r'[a-z0-9]+', text)
+    return ' '.join(t for t in tokens if t not in QUALITY_TOKENS)
+
+# Pool de procesos compartido, creado al primer parseo grande
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver: los hijos no heredan hilos ni conexiones del worker de gunicorn
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('forkserver'))
+        return _pool
+
+def shutdown_pool(wait=True):
+    """Cierra el pool de parseo (necesario antes de salir de un proceso hijo de multiprocessing)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=True)
+        _pool = None
+
+def _parse_chunk(chunk):
+    """Parseo de un trozo de la lista en un proceso del pool"""
+    return M3UParser(workers=1)._parse_lines(chunk.split('\n'))
+
+def split_at_extinf(content, count):
+    """Divide el contenido en hasta `count` trozos que empiezan en una línea #EXTINF"""
+    size = len(content) // count
+    chunks = []
+    start = 0
+    for _ in range(count - 1):
+        position = content.find('\n#EXTINF:', start + size)
+        if position == -1:
+            break
+        chunks.append(content[start:position + 1])
+        start = position + 1
+    chunks.append(content[start:])
+    return chunks
+
 class M3UParser:
-    def __init__(self):
+    def __init__(self, workers=None, parallel_threshold=DEFAULT_PARALLEL_THRESHOLD):
         self.channel_pattern = re.compile(r'#EXTINF:(.*?),(.*?)$', re.MULTILINE)
         self.attribute_pattern = re.compile(r'([a-zA-Z-]+)="([^"]*)"')
+        # Procesos para listas grandes (1 = siempre en el proceso actual)
+        self.workers = workers if workers is not None else min(os.cpu_count() or 1, 8)
+        self.parallel_threshold = parallel_threshold
     
     def parse_m3u_content(self, content):
         """Parse M3U content and return structured data"""
+        if self.workers > 1 and len(content) >= self.parallel_threshold:
+            try:
+                return self._parse_parallel(content)
+            except BrokenProcessPool as e:
+                logger.error(f"Parallel M3U parse failed, falling back to serial: {e}")
+                shutdown_pool(wait=False)
+        
+        channels, groups = self._parse_lines(content.strip().split('\n'))
+        return {
+            'channels': channels,
+            'groups': sorted(groups)
+        }
+    
+    def _parse_parallel(self, content):
+        """Reparte el parseo entre procesos en trozos cortados en #EXTINF, manteniendo el orden"""
+        # Más trozos que procesos para repartir bien la carga si unos trozos son más lentos
+        chunks = split_at_extinf(content, self.workers * 4)
         channels = []
         groups = set()
-        
-        lines = content.strip().split('\n')
+        for chunk_channels, chunk_groups in _get_pool(self.workers).map(_parse_chunk, chunks):
+            channels.extend(chunk_channels)
+            groups.update(chunk_groups)
+        return {
+            'channels': channels,
+            'groups': sorted(groups)
+        }
+    
+    def _parse_lines(self, lines):
+        """Parsea líneas M3U. Retorna (canales, conjunto de grupos)"""
+        channels = []
+        groups = set()
+        count = len(lines)
         i = 0
         
-        while i < len(lines):
+        while i < count:
             line = lines[i].strip()
+            i += 1
             
             if line.startswith('#EXTINF:'):
                 # Obtener información del canal
                 channel_info = self._parse_extinf_line(line)
                 
-                # Siguiente línea debería ser la URL
-                if i + 1 < len(lines):
-                    url = lines[i + 1].strip()
+                # La URL es la siguiente línea que no sea una directiva (#EXTVLCOPT, #EXTGRP...) ni esté vacía
+                while i < count:
+                    url = lines[i].strip()
                     if url and not url.startswith('#'):
+                        i += 1
                         channel_info['url'] = url
                         channels.append(channel_info)
                         
                         # Agregar grupo al set
                         if channel_info.get('group_title'):
                             groups.add(channel_info['group_title'])
-                
-                i += 2
-            else:
-                i += 1
+                        break
+                    if url.startswith('#EXTINF:'):
+                        # Entrada sin URL: la siguiente se procesa en la vuelta principal
+                        break
+                    i += 1
         
-        return {
-            'channels': channels,
-            'groups': sorted(list(groups))
-        }
+        return channels, groups
     
     def _parse_extinf_line(self, line):
         """Parse a single EXTINF line"""
@@ -113,7 +205,8 @@ class M3UParser:
         info = {
             'title': 'Lista IPTV',
             'description': '',
-            'total_channels': 0
+            'total_channels': 0,
+            'epg_urls': []
         }
         
         # Buscar información en las primeras líneas
@@ -131,6 +224,10 @@ class M3UParser:
                     info['title'] = attrs['x-tvg-name']
                 elif 'tvg-name' in attrs:
                     info['title'] = attrs['tvg-name']
+                
+                # Guía XMLTV: url-tvg o x-tvg-url, con una o varias URLs separadas por comas
+                epg_value = attrs.get('url-tvg') or attrs.get('x-tvg-url') or ''
+                info['epg_urls'] = [url.strip() for url in epg_value.split(',') if url.strip()]
         
         # Contar canales
         extinf_count = sum(1 for line in lines if line.strip().startswith('#EXTINF:'))
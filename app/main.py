@@ -1,7 +1,28 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, send_from_directory
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, send_from_directory, send_file, g
 from flask_cors import CORS
-from .database import Database
-from .m3u_parser import M3UParser
+from .database import Database, CHANNEL_COLUMNS
+from .m3u_parser import M3UParser, normalize_channel_name
+from .stream_scheduler import StreamScheduler, AdmissionRejected
+from .abr import parse_ladder, build_abr_output_args, probe_has_audio
+from .failover import SourceHealth
+from .health_checker import ChannelHealthChecker
+from .metrics import (
+    ACTIVE_TRANSCODERS, ADMISSION_REJECTIONS, CLUSTER_FORWARDS, FFMPEG_RESTARTS, FFMPEG_SPAWNS, HTTP_REQUEST_DURATION,
+    HTTP_REQUESTS, PROXY_BYTES, TIME_TO_FIRST_SEGMENT, TRANSCODER_CPU_PERCENT, TRANSCODER_RSS_BYTES,
+    generate_metrics, instrument_database, record_cache
+)
+from .stream_stats import ProgressReader, ResourceReport, sample_stream, summarize
+from .channel_index import ChannelIndexCache, INDEX_FIELDS
+from .json_provider import install_json_provider
+from .compression import install_compression
+from .logo_cache import LogoCache
+from .m3u_export import M3UExporter
+from .epg import EPGRefresher
+from .playlist_refresher import PlaylistRefresher, parse_window
+from .lifecycle import sweep_orphans
+from .db_maintenance import DatabaseMaintenance
+from .cluster import Cluster, FORWARD_RESPONSE_HEADERS, HOP_HEADER, NODE_HEADER, parse_nodes
+from .timeshift import TimeshiftArchive
 import os
 import logging
 import requests
@@ -10,12 +31,17 @@ import threading
 import time
 import shutil
 import hashlib
+from collections import deque
+from datetime import datetime, timezone
 from pathlib import Path
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 CORS(app)
 
+# Serialización JSON rápida con orjson si está disponible
+install_json_provider(app)
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,21 +50,182 @@ logger = logging.getLogger(__name__)
 DATA_DIR = os.environ.get('DATA_DIR', '/app/data')
 HLS_DIR = os.environ.get('HLS_DIR', '/tmp/hls')
 FFMPEG_PATH = os.environ.get('FFMPEG_PATH', '/usr/bin/ffmpeg')
+# ffprobe se instala junto a ffmpeg
+FFPROBE_PATH = os.path.join(os.path.dirname(FFMPEG_PATH), 'ffprobe')
+
+# Límites de admisión (0 = sin límite)
+MAX_TRANSCODERS = int(os.environ.get('MAX_TRANSCODERS', '10'))
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get('MAX_CONNECTIONS_PER_HOST', '0'))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '5'))
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', '10'))
+
+# Transcoding adaptativo (ABR): activado por defecto o por petición con ?abr=1
+ABR_ENABLED = os.environ.get('ABR_ENABLED', '0') == '1'
+ABR_RENDITIONS = parse_ladder(os.environ.get('ABR_LADDER'))
+
+# Failover entre fuentes duplicadas del mismo canal
+FAILOVER_STARTUP_TIMEOUT = float(os.environ.get('FAILOVER_STARTUP_TIMEOUT', '8'))
+FAILOVER_CHECK_INTERVAL = float(os.environ.get('FAILOVER_CHECK_INTERVAL', '1'))
+SOURCE_COOLDOWN = int(os.environ.get('SOURCE_COOLDOWN', '30'))
+
+# Watchdog: segundos sin segmentos nuevos antes de considerar un stream congelado
+STALL_TIMEOUT = float(os.environ.get('STALL_TIMEOUT', '6'))
+
+# Índice en memoria de canales para el listado (por worker)
+CHANNEL_INDEX_ENABLED = os.environ.get('CHANNEL_INDEX_ENABLED', '1') == '1'
+CHANNEL_INDEX_MAX_PLAYLISTS = int(os.environ.get('CHANNEL_INDEX_MAX_PLAYLISTS', '4'))
+
+# Compresión brotli/gzip de respuestas JSON y HTML a partir de este tamaño
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', '1') == '1'
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+if COMPRESSION_ENABLED:
+    install_compression(app, min_size=COMPRESSION_MIN_SIZE)
+
+# Caché de miniaturas de logos (en DATA_DIR para que sobreviva a reinicios)
+LOGO_CACHE_MAX_MB = int(os.environ.get('LOGO_CACHE_MAX_MB', '100'))
+LOGO_SIZE = int(os.environ.get('LOGO_SIZE', '128'))
+LOGO_MAX_AGE = int(os.environ.get('LOGO_MAX_AGE', '604800'))
+
+# Guía de programación XMLTV (url-tvg de las listas y URLs adicionales)
+EPG_ENABLED = os.environ.get('EPG_ENABLED', '1') == '1'
+EPG_URLS = [url.strip() for url in os.environ.get('EPG_URLS', '').split(',') if url.strip()]
+EPG_REFRESH_INTERVAL = int(os.environ.get('EPG_REFRESH_INTERVAL', '43200'))
+EPG_KEEP_PAST = int(os.environ.get('EPG_KEEP_PAST', '21600'))
+
+# Refresco programado de las listas importadas por URL
+PLAYLIST_REFRESH_ENABLED = os.environ.get('PLAYLIST_REFRESH_ENABLED', '1') == '1'
+PLAYLIST_REFRESH_INTERVAL = int(os.environ.get('PLAYLIST_REFRESH_INTERVAL', '86400'))
+PLAYLIST_REFRESH_CONCURRENCY = int(os.environ.get('PLAYLIST_REFRESH_CONCURRENCY', '2'))
+PLAYLIST_REFRESH_WINDOW = parse_window(os.environ.get('PLAYLIST_REFRESH_WINDOW'))
+
+# Parseo de listas M3U grandes en varios procesos (1 = desactivado)
+M3U_PARSE_WORKERS = int(os.environ['M3U_PARSE_WORKERS']) if os.environ.get('M3U_PARSE_WORKERS') else None
+M3U_PARALLEL_THRESHOLD = int(os.environ.get('M3U_PARALLEL_THRESHOLD', str(8 * 1024 * 1024)))
 
-# Asegurar que los directorios existen
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(HLS_DIR, exist_ok=True)
+# Proxy de /api/proxy/url: tamaño de cada lectura del proveedor y conexiones reutilizables por host
+PROXY_CHUNK_SIZE = int(os.environ.get('PROXY_CHUNK_SIZE', '65536'))
+PROXY_POOL_SIZE = int(os.environ.get('PROXY_POOL_SIZE', '32'))
+
+# Intervalo de muestreo de CPU/memoria/bitrate de cada FFmpeg
+RESOURCE_SAMPLE_INTERVAL = float(os.environ.get('RESOURCE_SAMPLE_INTERVAL', '5'))
+
+# Comprobación de salud de canales en segundo plano
+HEALTH_CHECK_ENABLED = os.environ.get('HEALTH_CHECK_ENABLED', '1') == '1'
+HEALTH_CHECK_CONCURRENCY = int(os.environ.get('HEALTH_CHECK_CONCURRENCY', '16'))
+HEALTH_CHECK_PER_HOST = int(os.environ.get('HEALTH_CHECK_PER_HOST', '2'))
+HEALTH_CHECK_RATE = float(os.environ.get('HEALTH_CHECK_RATE', '20'))
+HEALTH_CHECK_MAX_AGE = int(os.environ.get('HEALTH_CHECK_MAX_AGE', str(6 * 3600)))
+
+# Nodos transcodificadores (URLs base separadas por comas) y URL de este nodo en la lista
+CLUSTER_NODES = parse_nodes(os.environ.get('CLUSTER_NODES'))
+CLUSTER_SELF = os.environ.get('CLUSTER_SELF')
+CLUSTER_NODE_COOLDOWN = int(os.environ.get('CLUSTER_NODE_COOLDOWN', '10'))
+
+# Mantenimiento de SQLite: checkpoint del WAL a partir de este tamaño, ANALYZE y vacuum incremental
+DB_MAINTENANCE_ENABLED = os.environ.get('DB_MAINTENANCE_ENABLED', '1') == '1'
+DB_WAL_MAX_MB = int(os.environ.get('DB_WAL_MAX_MB', '64'))
+DB_VACUUM_CONVERT_MAX_MB = int(os.environ.get('DB_VACUUM_CONVERT_MAX_MB', '256'))
+
+# Timeshift: ventana por defecto en segundos (0 = solo los canales con ventana propia) y disco máximo
+TIMESHIFT_WINDOW = int(os.environ.get('TIMESHIFT_WINDOW', '0'))
+TIMESHIFT_MAX_MB = int(os.environ.get('TIMESHIFT_MAX_MB', '2048'))
 
 # Diccionario para tracking de procesos FFmpeg activos
-# {stream_id: {'process': subprocess, 'last_access': timestamp, 'url': original_url}}
+# {stream_id: {'process': subprocess, 'last_access': timestamp, 'url': original_url, 'lease': StreamLease}}
 active_streams = {}
-streams_lock = threading.Lock()
+streams_lock = threading.RLock()
 
-# Inicializar base de datos
-db = Database(os.path.join(DATA_DIR, 'iptv.db'))
+# Últimos eventos de congelación detectados por el watchdog
+stall_events = deque(maxlen=200)
+
+# Muestras de recursos compartidas entre workers (un JSON por worker)
+resource_report = ResourceReport(os.path.join(HLS_DIR, '.resources'))
+
+# Control de admisión compartido entre workers (locks en HLS_DIR)
+stream_scheduler = StreamScheduler(
+    os.path.join(HLS_DIR, '.locks'),
+    max_transcoders=MAX_TRANSCODERS,
+    max_per_host=MAX_CONNECTIONS_PER_HOST,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    retry_after=ADMISSION_RETRY_AFTER
+)
+
+# Salud de las URLs de origen (por worker)
+source_health = SourceHealth(base_cooldown=SOURCE_COOLDOWN)
+
+# Base de datos (con métricas de duración por operación); el esquema se crea en prepare_deployment
+db = instrument_database(Database(os.path.join(DATA_DIR, 'iptv.db'), init_schema=False))
 
 # Inicializar parser
-parser = M3UParser()
+parser = M3UParser(workers=M3U_PARSE_WORKERS, parallel_threshold=M3U_PARALLEL_THRESHOLD)
+
+# Sesión HTTP del proxy (conexiones keep-alive con los proveedores)
+proxy_session = requests.Session()
+proxy_session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+proxy_session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=PROXY_POOL_SIZE))
+proxy_session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=PROXY_POOL_SIZE))
+
+# Índices columnares de canales de las listas más consultadas
+channel_index_cache = ChannelIndexCache(db, max_playlists=CHANNEL_INDEX_MAX_PLAYLISTS)
+
+# Miniaturas de logos compartidas entre workers
+logo_cache = LogoCache(
+    os.path.join(DATA_DIR, 'logos'),
+    max_bytes=LOGO_CACHE_MAX_MB * 1024 * 1024,
+    size=LOGO_SIZE
+)
+
+# Exportaciones M3U filtradas, cacheadas en disco por filtros y estado de los datos
+m3u_exporter = M3UExporter(db, os.path.join(DATA_DIR, 'exports'))
+
+# Refresco de la guía XMLTV (un solo worker por host)
+epg_refresher = EPGRefresher(
+    db,
+    os.path.join(DATA_DIR, 'epg'),
+    os.path.join(DATA_DIR, 'epg_refresher.lock'),
+    interval=EPG_REFRESH_INTERVAL,
+    keep_past=EPG_KEEP_PAST,
+    extra_urls=EPG_URLS
+)
+
+# Refresco de listas por URL (un solo worker por host)
+playlist_refresher = PlaylistRefresher(
+    db,
+    parser,
+    os.path.join(DATA_DIR, 'playlist_refresher.lock'),
+    default_interval=PLAYLIST_REFRESH_INTERVAL,
+    concurrency=PLAYLIST_REFRESH_CONCURRENCY,
+    window=PLAYLIST_REFRESH_WINDOW
+)
+
+# Comprobador de salud de canales (un solo worker por host)
+health_checker = ChannelHealthChecker(
+    db,
+    os.path.join(DATA_DIR, 'health_checker.lock'),
+    concurrency=HEALTH_CHECK_CONCURRENCY,
+    per_host=HEALTH_CHECK_PER_HOST,
+    rate=HEALTH_CHECK_RATE,
+    max_age=HEALTH_CHECK_MAX_AGE,
+    scheduler=stream_scheduler
+)
+
+# Reparto de streams entre nodos (desactivado con un solo nodo)
+cluster = Cluster(CLUSTER_SELF, CLUSTER_NODES, cooldown=CLUSTER_NODE_COOLDOWN, pool_size=PROXY_POOL_SIZE)
+
+# Mantenimiento de la base de datos (un solo worker por host)
+db_maintenance = DatabaseMaintenance(
+    db,
+    os.path.join(DATA_DIR, 'db_maintenance.lock'),
+    os.path.join(DATA_DIR, 'db_maintenance.json'),
+    wal_max_bytes=DB_WAL_MAX_MB * 1024 * 1024,
+    convert_max_bytes=DB_VACUUM_CONVERT_MAX_MB * 1024 * 1024
+)
+
+# Archivo de timeshift en HLS_DIR: en el mismo disco que los segmentos para enlazarlos sin copiar
+timeshift_archive = TimeshiftArchive(
+    os.path.join(HLS_DIR, '.timeshift'),
+    max_bytes=TIMESHIFT_MAX_MB * 1024 * 1024
+)
 
 def cleanup_old_streams():
     """Limpia streams que no han sido accedidos en los últimos 5 minutos"""
@@ -56,35 +243,301 @@ def cleanup_old_streams():
         for stream_id in streams_to_remove:
             stop_stream(stream_id)
 
+def terminate_process(process):
+    """Termina un proceso FFmpeg, forzando si no responde"""
+    if process and process.poll() is None:
+        try:
+            process.terminate()
+            process.wait(timeout=5)
+        except:
+            process.kill()
+
 def stop_stream(stream_id):
     """Detiene un stream y limpia sus archivos"""
     with streams_lock:
         if stream_id in active_streams:
             stream_info = active_streams[stream_id]
-            process = stream_info.get('process')
             
             # Terminar proceso FFmpeg
-            if process and process.poll() is None:
-                try:
-                    process.terminate()
-                    process.wait(timeout=5)
-                except:
-                    process.kill()
+            terminate_process(stream_info.get('process'))
             
-            # Eliminar directorio de HLS
-            stream_dir = os.path.join(HLS_DIR, stream_id)
-            if os.path.exists(stream_dir):
-                try:
-                    shutil.rmtree(stream_dir)
-                except Exception as e:
-                    logger.error(f"Error removing stream dir {stream_dir}: {e}")
+            # Liberar slots de admisión
+            lease = stream_info.get('lease')
+            if lease:
+                lease.release()
             
+            remove_stream_files(stream_id)
             del active_streams[stream_id]
+            ACTIVE_TRANSCODERS.set(len(active_streams))
             logger.info(f"Stream {stream_id} stopped and cleaned up")
 
-# Iniciar thread de limpieza
-cleanup_thread = threading.Thread(target=cleanup_old_streams, daemon=True)
-cleanup_thread.start()
+def remove_stream_files(stream_id):
+    """Borra el directorio HLS de un stream que ya no tiene FFmpeg (llamar con streams_lock)"""
+    stream_dir = os.path.join(HLS_DIR, stream_id)
+    if os.path.exists(stream_dir):
+        try:
+            shutil.rmtree(stream_dir)
+        except Exception as e:
+            logger.error(f"Error removing stream dir {stream_dir}: {e}")
+    # Lo ya archivado para timeshift se conserva hasta que salga de la ventana
+    timeshift_archive.forget(stream_id)
+
+def get_stream_playlist_path(stream_info):
+    """Playlist que FFmpeg reescribe con cada segmento (la primera variante en ABR)"""
+    if stream_info.get('abr'):
+        return os.path.join(stream_info['dir'], '0', 'playlist.m3u8')
+    return os.path.join(stream_info['dir'], 'playlist.m3u8')
+
+def stream_is_producing(stream_info):
+    """True si FFmpeg ha escrito segmentos desde que arrancó con la fuente actual"""
+    playlist_path = get_stream_playlist_path(stream_info)
+    try:
+        if os.path.getmtime(playlist_path) < stream_info['started_at']:
+            return False
+        with open(playlist_path, 'r') as f:
+            return '.ts' in f.read()
+    except OSError:
+        return False
+
+def failover_stream(stream_id, reason, restart_same=False):
+    """Marca la fuente actual como caída y relanza FFmpeg con la siguiente fuente sana.
+
+    El directorio HLS se conserva para que los espectadores sigan con el mismo playlist.
+    Con `restart_same=True` se reinicia la misma fuente si no hay alternativas.
+    FFmpeg se termina fuera de streams_lock para no bloquear al resto de peticiones.
+    """
+    with streams_lock:
+        stream_info = active_streams.get(stream_id)
+        if not stream_info or stream_info.get('failing_over'):
+            return False
+        
+        failed_url = stream_info['url']
+        source_health.record_failure(failed_url, reason)
+        candidates = [url for url in source_health.order(stream_info['sources']) if url != failed_url]
+        if not candidates and restart_same:
+            candidates = [failed_url]
+        # ensure_stream no toca el stream mientras se termina su FFmpeg
+        stream_info['failing_over'] = True
+    
+    terminate_process(stream_info.get('process'))
+    
+    with streams_lock:
+        if active_streams.get(stream_id) is not stream_info:
+            # Detenido mientras se terminaba FFmpeg
+            return False
+        stream_info['failing_over'] = False
+        if stream_info.get('lease'):
+            stream_info['lease'].release()
+            stream_info['lease'] = None
+        
+        if not candidates:
+            # ensure_stream lo reintenta cuando un espectador vuelva a pedir el playlist
+            logger.warning(f"Stream {stream_id}: {reason}, no alternative sources")
+            stream_info['failed'] = True
+            return False
+        
+        # Sin cola: se acaba de liberar un slot, si no hay hueco para el nuevo host se prueba el siguiente
+        for next_url in candidates:
+            lease, rejection = stream_scheduler.try_acquire(next_url)
+            if lease:
+                break
+        else:
+            logger.warning(f"Stream {stream_id}: failover rejected: {rejection}")
+            remove_stream_files(stream_id)
+            del active_streams[stream_id]
+            ACTIVE_TRANSCODERS.set(len(active_streams))
+            return False
+        
+        logger.warning(f"Stream {stream_id}: {reason}, failing over to {next_url}")
+        try:
+            start_ffmpeg_stream(stream_id, next_url, lease=lease, abr=stream_info.get('abr'),
+                                sources=stream_info['sources'], timeshift=stream_info.get('timeshift', 0),
+                                audio=stream_info.get('audio', True))
+        except Exception:
+            lease.release()
+            remove_stream_files(stream_id)
+            del active_streams[stream_id]
+            ACTIVE_TRANSCODERS.set(len(active_streams))
+            raise
+        new_info = active_streams[stream_id]
+        new_info['last_access'] = stream_info['last_access']
+        new_info['failovers'] = stream_info.get('failovers', 0) + 1
+        new_info['stalls'] = stream_info.get('stalls', 0)
+        return True
+
+def track_segment_production(stream_info, now):
+    """Actualiza el ritmo de segmentos del stream. Retorna los segundos que lleva sin producir"""
+    try:
+        mtime = os.path.getmtime(get_stream_playlist_path(stream_info))
+    except OSError:
+        return now - stream_info['started_at']
+    
+    if mtime > stream_info.get('last_segment_at', 0):
+        stream_info['last_segment_at'] = mtime
+        stream_info['segments_seen'] = stream_info.get('segments_seen', 0) + 1
+    elapsed = now - stream_info['started_at']
+    if elapsed > 0:
+        stream_info['segment_rate'] = stream_info.get('segments_seen', 0) / elapsed
+    return now - stream_info['last_segment_at']
+
+def record_stall(stream_id, stream_info, stalled_for):
+    """Guarda un evento de congelación para diagnóstico"""
+    stream_info['stalls'] = stream_info.get('stalls', 0) + 1
+    event = {
+        'stream_id': stream_id,
+        'source': stream_info['url'],
+        'timestamp': time.time(),
+        'stalled_for': round(stalled_for, 1),
+        'segments_seen': stream_info.get('segments_seen', 0),
+        'pid': stream_info['process'].pid if stream_info.get('process') else None
+    }
+    stall_events.append(event)
+    logger.warning(f"Stream {stream_id} stalled for {stalled_for:.1f}s on {stream_info['url']}")
+
+def monitor_streams():
+    """Watchdog: detecta FFmpeg caídos, que no arrancan o congelados y hace failover sin esperar al espectador"""
+    while True:
+        time.sleep(FAILOVER_CHECK_INTERVAL)
+        to_failover = []
+        recordings = []
+        now = time.time()
+        
+        with streams_lock:
+            for stream_id, stream_info in active_streams.items():
+                if stream_info.get('failed'):
+                    continue
+                if stream_info.get('timeshift'):
+                    recordings.append((stream_id, get_stream_playlist_path(stream_info),
+                                       stream_info['timeshift'], stream_info['started_at']))
+                process = stream_info.get('process')
+                if process and process.poll() is not None:
+                    to_failover.append((stream_id, f'FFmpeg exited with code {process.returncode}', 'exit'))
+                elif not stream_info.get('ready'):
+                    if stream_is_producing(stream_info):
+                        stream_info['ready'] = True
+                        track_segment_production(stream_info, now)
+                        source_health.record_success(stream_info['url'])
+                    elif now - stream_info['started_at'] > FAILOVER_STARTUP_TIMEOUT:
+                        to_failover.append((stream_id, 'no segments after startup timeout', 'startup_timeout'))
+                else:
+                    # FFmpeg vivo pero sin segmentos nuevos (upstream parado, TCP medio abierto...)
+                    stalled_for = track_segment_production(stream_info, now)
+                    if stalled_for > STALL_TIMEOUT:
+                        record_stall(stream_id, stream_info, stalled_for)
+                        to_failover.append((stream_id, f'stalled for {stalled_for:.1f}s', 'stall'))
+            ACTIVE_TRANSCODERS.set(len(active_streams))
+        
+        # Archivar los segmentos nuevos antes de que FFmpeg los borre
+        for stream_id, playlist_path, window, started_at in recordings:
+            try:
+                timeshift_archive.ingest(stream_id, playlist_path, window, generation=started_at)
+            except Exception as e:
+                logger.error(f"Error archiving timeshift segments of {stream_id}: {e}")
+        
+        for stream_id, reason, kind in to_failover:
+            try:
+                # Un stream congelado se reinicia aunque no haya fuentes alternativas
+                if failover_stream(stream_id, reason, restart_same=(kind == 'stall')):
+                    FFMPEG_RESTARTS.labels(reason=kind).inc()
+            except Exception as e:
+                logger.error(f"Error failing over stream {stream_id}: {e}")
+
+def sample_stream_resources():
+    """Muestrea periódicamente los recursos de cada FFmpeg de este worker"""
+    while True:
+        time.sleep(RESOURCE_SAMPLE_INTERVAL)
+        try:
+            now = time.time()
+            streams = []
+            with streams_lock:
+                for stream_id, stream_info in active_streams.items():
+                    sample = sample_stream(stream_info, now)
+                    if sample:
+                        streams.append(dict(
+                            sample,
+                            stream_id=stream_id,
+                            url=stream_info['url'],
+                            upstream_host=stream_scheduler.get_host(stream_info['url']),
+                            abr=stream_info.get('abr', False)
+                        ))
+            
+            TRANSCODER_CPU_PERCENT.set(sum(st.get('cpu_percent') or 0 for st in streams))
+            TRANSCODER_RSS_BYTES.set(sum(st.get('rss_bytes') or 0 for st in streams))
+            resource_report.write(streams)
+        except Exception as e:
+            logger.error(f"Error sampling stream resources: {e}")
+
+def prepare_deployment():
+    """Preparación única al arrancar el servidor, antes de crear los workers.
+
+    Crea los directorios y el esquema, y limpia los FFmpeg y directorios HLS que
+    dejaron workers caídos en la ejecución anterior. Desde gunicorn se llama en
+    el hook on_starting del master.
+    """
+    init_dirs()
+    db.init_db()
+    sweep_orphans(HLS_DIR, clear_unused=True)
+
+def init_dirs():
+    """Directorios de datos, cachés y locks (importar el módulo no crea ninguno)"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(HLS_DIR, exist_ok=True)
+    for component in (stream_scheduler, resource_report, logo_cache, m3u_exporter, epg_refresher):
+        component.init_dirs()
+
+# Proceso en el que se han arrancado los hilos de fondo (no sobreviven a un fork)
+_services_pid = None
+_services_lock = threading.Lock()
+
+def start_services():
+    """Arranca los hilos de fondo de este proceso. Idempotente por proceso.
+
+    Los de streams son de cada worker; salud, EPG, refresco de listas y mantenimiento
+    de la base arrancan en todos pero solo trabaja el que obtiene su lock (uno por host).
+    """
+    global _services_pid
+    with _services_lock:
+        if _services_pid == os.getpid():
+            return
+        # Sin gunicorn nadie ha llamado a prepare_deployment (si ya está todo creado no hace nada)
+        init_dirs()
+        db.init_db()
+        
+        threading.Thread(target=cleanup_old_streams, daemon=True).start()
+        threading.Thread(target=monitor_streams, daemon=True).start()
+        threading.Thread(target=sample_stream_resources, daemon=True).start()
+        
+        if HEALTH_CHECK_ENABLED:
+            health_checker.start()
+        if EPG_ENABLED:
+            epg_refresher.start()
+        if PLAYLIST_REFRESH_ENABLED:
+            playlist_refresher.start()
+        if DB_MAINTENANCE_ENABLED:
+            db_maintenance.start()
+        timeshift_archive.start()
+        _services_pid = os.getpid()
+
+@app.before_request
+def ensure_services():
+    # gunicorn los arranca en post_worker_init; esto cubre el servidor de desarrollo y los tests
+    if _services_pid != os.getpid():
+        start_services()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Latencia y código por endpoint (la ruta de Flask, no la URL concreta)"""
+    if hasattr(g, 'request_start'):
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_DURATION.labels(endpoint=endpoint, method=request.method).observe(
+            time.perf_counter() - g.request_start
+        )
+        HTTP_REQUESTS.labels(endpoint=endpoint, method=request.method, status=response.status_code).inc()
+    return response
 
 @app.route('/')
 def index():
@@ -166,8 +619,9 @@ def add_playlist():
         # Parsear M3U
         parsed_data = parser.parse_m3u_content(content)
         
-        # Crear lista en la base de datos
-        playlist_id = db.add_playlist(name, url, content)
+        # Crear lista en la base de datos (con la guía XMLTV de la cabecera, si la hay)
+        epg_urls = parser.get_playlist_info(content)['epg_urls']
+        playlist_id = db.add_playlist(name, url, content, epg_url=','.join(epg_urls))
         
         # Crear grupos
         group_map = {}
@@ -191,12 +645,17 @@ def add_playlist():
                 channel.get('logo', ''),
                 channel.get('tvg_id', ''),
                 channel.get('tvg_name', ''),
-                channel.get('group_title', '')
+                channel.get('group_title', ''),
+                normalize_channel_name(channel['name'])
             ))
         
         # Insertar todos los canales en una sola transacción
         db.add_channels_batch(channels_data)
         
+        if url:
+            # El refresco programado compara con este hash para no reimportar si no hay cambios
+            db.update_playlist(playlist_id, content_hash=hashlib.sha256(content.encode('utf-8')).hexdigest())
+        
         return jsonify({
             'success': True,
             'message': f'Lista "{name}" agregada exitosamente',
@@ -208,24 +667,121 @@ def add_playlist():
         logger.error(f"Error adding playlist: {e}")
         return jsonify({'error': str(e)}), 500
 
+def playlist_etag(validators, *parts):
+    """ETag de una respuesta de lista: versión de canales, versión de salud y la URL pedida"""
+    key = f"{request.path}?{request.query_string.decode()}:{':'.join(str(part) for part in parts)}"
+    return hashlib.md5(f"{validators['version']}:{key}".encode()).hexdigest()[:20]
+
+def playlist_last_modified(validators):
+    """Última modificación de los canales o de su salud"""
+    timestamps = []
+    if validators.get('updated_at'):
+        updated = datetime.strptime(validators['updated_at'], '%Y-%m-%d %H:%M:%S')
+        timestamps.append(updated.replace(tzinfo=timezone.utc).timestamp())
+    if validators.get('health_updated_at'):
+        timestamps.append(validators['health_updated_at'])
+    if not timestamps:
+        return None
+    return datetime.fromtimestamp(int(max(timestamps)), timezone.utc)
+
+def not_modified(etag, last_modified=None):
+    """Respuesta 304 si el cliente ya tiene esta versión, None si hay que generarla"""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        fresh = bool(last_modified and request.if_modified_since and last_modified <= request.if_modified_since)
+    if not fresh:
+        return None
+    return with_validators(app.response_class(status=304), etag, last_modified)
+
+def with_validators(response, etag, last_modified=None):
+    """Añade ETag/Last-Modified; no-cache obliga al navegador a revalidar en cada uso"""
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+def parse_fields_arg():
+    """Campos pedidos con ?fields=id,name,... (None = todos). Lanza ValueError si alguno no existe"""
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    unknown = set(fields) - set(CHANNEL_COLUMNS)
+    if unknown:
+        raise ValueError(f"Campos desconocidos: {', '.join(sorted(unknown))}")
+    return fields or None
+
+def to_rows(items, fields):
+    """Convierte una lista de dicts al formato compacto (lista de listas en el orden de `fields`)"""
+    return [[item.get(field) for field in fields] for item in items]
+
 @app.route('/api/playlists/<int:playlist_id>/channels')
 def get_channels(playlist_id):
+    """Canales paginados.
+
+    `?fields=id,name,logo` limita los campos (por defecto los del índice en memoria)
+    y `?format=compact` devuelve `{'fields': [...], 'rows': [[...], ...]}` en lugar
+    de una lista de objetos.
+    """
     try:
+        try:
+            fields = parse_fields_arg() or list(INDEX_FIELDS)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        compact = request.args.get('format') == 'compact'
+        
         # Parámetros de paginación
         limit = request.args.get('limit', type=int)
         offset = request.args.get('offset', 0, type=int)
         group_id = request.args.get('group_id', type=int)
+        if offset < 0 or (limit is not None and limit < 0):
+            return jsonify({'error': 'offset y limit no pueden ser negativos'}), 400
         
-        channels = db.get_channels(playlist_id, group_id=group_id, limit=limit, offset=offset)
-        total = db.get_channels_count(playlist_id, group_id=group_id)
+        # Filtro por estado de salud: ?status=online,unknown o ?hide_offline=1
+        statuses = [st for st in request.args.get('status', '').split(',') if st]
+        if not statuses and request.args.get('hide_offline') == '1':
+            statuses = ['online', 'unknown']
+        sort = request.args.get('sort', 'name')
         
-        return jsonify({
-            'channels': channels,
+        # El índice en memoria cubre el listado por nombre sin filtros de salud
+        index = None
+        if (CHANNEL_INDEX_ENABLED and not statuses and sort == 'name'
+                and set(fields) <= set(INDEX_FIELDS)):
+            index, hit = channel_index_cache.get(playlist_id)
+            record_cache('channel_index', hit)
+        
+        # Validadores de lo que se va a servir: el índice refleja el estado de cuando se construyó
+        validators = index.validators if index else db.get_playlist_validators(playlist_id)
+        if validators:
+            etag = playlist_etag(validators, validators.get('health_version'))
+            last_modified = playlist_last_modified(validators)
+            cached = not_modified(etag, last_modified)
+            if cached:
+                return cached
+        
+        if index:
+            channels = index.page(group_id=group_id, limit=limit, offset=offset, fields=fields, as_rows=compact)
+            total = index.count(group_id=group_id)
+        else:
+            channels = db.get_channels(playlist_id, group_id=group_id, limit=limit, offset=offset,
+                                       statuses=statuses, sort=sort, fields=fields)
+            total = db.get_channels_count(playlist_id, group_id=group_id, statuses=statuses)
+            if compact:
+                channels = to_rows(channels, fields)
+        
+        result = {
             'total': total,
             'limit': limit,
             'offset': offset,
             'has_more': (offset + len(channels)) < total if limit else False
-        })
+        }
+        if compact:
+            result['fields'] = fields
+            result['rows'] = channels
+        else:
+            result['channels'] = channels
+        if not validators:
+            return jsonify(result)
+        return with_validators(jsonify(result), etag, last_modified)
     except Exception as e:
         logger.error(f"Error getting channels: {e}")
         return jsonify({'error': str(e)}), 500
@@ -233,25 +789,94 @@ def get_channels(playlist_id):
 @app.route('/api/playlists/<int:playlist_id>/group-counts')
 def get_group_counts(playlist_id):
     try:
+        validators = db.get_playlist_validators(playlist_id)
+        if validators:
+            etag = playlist_etag(validators)
+            cached = not_modified(etag)
+            if cached:
+                return cached
+        
         groups = db.get_group_counts(playlist_id)
         total_channels = db.get_channels_count(playlist_id)
-        return jsonify({
+        response = jsonify({
             'groups': groups,
             'total_channels': total_channels
         })
+        return with_validators(response, etag) if validators else response
     except Exception as e:
         logger.error(f"Error getting group counts: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/playlists/<int:playlist_id>/health')
+def get_playlist_health(playlist_id):
+    """Resumen del estado de salud de los canales de una lista"""
+    try:
+        validators = db.get_playlist_validators(playlist_id)
+        if validators:
+            etag = playlist_etag(validators, validators['health_version'])
+            last_modified = playlist_last_modified(validators)
+            cached = not_modified(etag, last_modified)
+            if cached:
+                return cached
+        
+        response = jsonify({'health': db.get_health_summary(playlist_id)})
+        return with_validators(response, etag, last_modified) if validators else response
+    except Exception as e:
+        logger.error(f"Error getting playlist health: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/playlists/<int:playlist_id>/groups')
 def get_groups(playlist_id):
     try:
-        groups = db.get_groups(playlist_id)
-        return jsonify({'groups': groups})
+        validators = db.get_playlist_validators(playlist_id)
+        if validators:
+            etag = playlist_etag(validators)
+            cached = not_modified(etag)
+            if cached:
+                return cached
+        
+        response = jsonify({'groups': db.get_groups(playlist_id)})
+        return with_validators(response, etag) if validators else response
     except Exception as e:
         logger.error(f"Error getting groups: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/playlists/<int:playlist_id>/refresh', methods=['POST'])
+def refresh_playlist(playlist_id):
+    """Pide el refresco de una lista por URL; lo hace el refresco en segundo plano"""
+    try:
+        playlist = db.get_playlist(playlist_id)
+        if not playlist:
+            return jsonify({'error': 'Lista no encontrada'}), 404
+        if not playlist.get('url'):
+            return jsonify({'error': 'La lista no se importó desde una URL'}), 400
+        
+        db.update_playlist(playlist_id, next_refresh_at=0)
+        return jsonify({'success': True, 'message': 'Actualización programada'}), 202
+    except Exception as e:
+        logger.error(f"Error scheduling playlist refresh: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/playlists/<int:playlist_id>', methods=['PATCH'])
+def update_playlist_settings(playlist_id):
+    """Cambia el intervalo de refresco: {"refresh_interval": segundos} (0 = nunca, null = por defecto)"""
+    try:
+        data = request.get_json() or {}
+        if 'refresh_interval' not in data:
+            return jsonify({'error': 'refresh_interval es requerido'}), 400
+        interval = data['refresh_interval']
+        if interval is not None and (not isinstance(interval, int) or interval < 0):
+            return jsonify({'error': 'refresh_interval debe ser un número de segundos'}), 400
+        if not db.get_playlist(playlist_id):
+            return jsonify({'error': 'Lista no encontrada'}), 404
+        
+        # Sin próxima fecha el refresco la vuelve a programar con el intervalo nuevo
+        db.update_playlist(playlist_id, refresh_interval=interval, next_refresh_at=None)
+        return jsonify({'success': True, 'message': 'Intervalo de refresco actualizado'})
+    except Exception as e:
+        logger.error(f"Error updating playlist: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/playlists/<int:playlist_id>', methods=['DELETE'])
 def delete_playlist(playlist_id):
     try:
@@ -353,13 +978,74 @@ def toggle_favorite(channel_id):
 
 @app.route('/api/favorites')
 def get_favorites():
+    """Favoritos; acepta ?fields= y ?format=compact como el listado de canales"""
     try:
-        favorites = db.get_favorites()
-        return jsonify({'favorites': favorites})
+        try:
+            fields = parse_fields_arg()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        favorites = db.get_favorites(fields=fields)
+        if request.args.get('format') == 'compact':
+            fields = (fields or list(CHANNEL_COLUMNS)) + ['favorited_at']
+            response = jsonify({'fields': fields, 'rows': to_rows(favorites, fields)})
+        else:
+            response = jsonify({'favorites': favorites})
+        
+        # Los favoritos no tienen contador de versión: ETag por contenido (ahorra la transferencia)
+        response.add_etag(weak=True)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"Error getting favorites: {e}")
         return jsonify({'error': str(e)}), 500
 
+def parse_id_list(name):
+    """Ids de un parámetro '1,2,3'. Lanza ValueError si alguno no es un entero"""
+    return [int(value) for value in request.args.get(name, '').split(',') if value.strip()]
+
+@app.route('/api/export.m3u')
+def export_m3u():
+    """Lista M3U con los canales filtrados de todas las listas.
+
+    Filtros: ?playlist=1,2, ?group_id=3,4, ?group=Deportes&group=Noticias (por título,
+    en cualquier lista) y ?favorites=1 (se suman al resto). Con ?stream=1 las URLs
+    apuntan a /api/stream/<id>/playlist.m3u8 de este servidor.
+    """
+    try:
+        try:
+            filters = {
+                'playlist_ids': parse_id_list('playlist'),
+                'group_ids': parse_id_list('group_id'),
+                'group_titles': request.args.getlist('group'),
+                'favorites': request.args.get('favorites') == '1'
+            }
+        except ValueError:
+            return jsonify({'error': 'Los ids deben ser números separados por comas'}), 400
+
+        stream_url = None
+        if request.args.get('stream') == '1':
+            stream_url = request.host_url + 'api/stream/{id}/playlist.m3u8'
+        filters_key = m3u_exporter.filters_key({**filters, 'stream_url': stream_url})
+        version = db.get_export_version()
+        etag = m3u_exporter.etag(filters_key, version)
+
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        path = m3u_exporter.cached(filters_key, version)
+        if path:
+            response = send_file(path, mimetype='audio/x-mpegurl', conditional=False, etag=False)
+        else:
+            response = Response(m3u_exporter.generate(filters, filters_key, version, stream_url),
+                                mimetype='audio/x-mpegurl')
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        return with_validators(response, etag)
+    except Exception as e:
+        logger.error(f"Error exporting M3U: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/favorites')
 def favorites():
     try:
@@ -369,11 +1055,101 @@ def favorites():
         logger.error(f"Error getting favorites: {e}")
         return render_template('favorites.html', channels=[])
 
+@app.route('/api/logo/<int:channel_id>')
+def channel_logo(channel_id):
+    """Miniatura del logo del canal, descargada una vez y servida desde la caché en disco"""
+    try:
+        channel = db.get_channel(channel_id)
+        if not channel or not channel.get('logo'):
+            return jsonify({'error': 'Canal sin logo'}), 404
+        
+        path, mimetype, digest, hit = logo_cache.get(channel['logo'])
+        record_cache('logo', hit)
+        if not path:
+            # Enlace muerto o imagen inválida: el navegador muestra el icono por defecto
+            response = jsonify({'error': 'Logo no disponible'})
+            response.status_code = 404
+            response.cache_control.max_age = logo_cache.failure_ttl
+            return response
+        
+        response = send_file(path, mimetype=mimetype, etag=digest, max_age=LOGO_MAX_AGE, conditional=True)
+        response.cache_control.public = True
+        if mimetype == 'image/svg+xml':
+            # Los SVG pueden llevar scripts si se abren directamente
+            response.headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'"
+        return response
+    except Exception as e:
+        logger.error(f"Error getting logo: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/epg/now', methods=['GET', 'POST'])
+def epg_now_next():
+    """Programa actual y siguiente de varios canales: ?tvg_id=a,b,c o POST {"tvg_ids": [...]}"""
+    try:
+        if request.method == 'POST':
+            tvg_ids = (request.get_json(silent=True) or {}).get('tvg_ids') or []
+        else:
+            tvg_ids = request.args.get('tvg_id', '').split(',')
+        tvg_ids = list(dict.fromkeys(str(tvg_id).strip() for tvg_id in tvg_ids if str(tvg_id).strip()))
+        if len(tvg_ids) > 500:
+            return jsonify({'error': 'Máximo 500 canales por petición'}), 400
+        
+        now = time.time()
+        guide = db.get_now_next(tvg_ids, now)
+        response = jsonify({'now': now, 'programmes': guide})
+        
+        # Cacheable hasta que termine el primer programa en emisión
+        stops = [entry['now']['stop'] for entry in guide.values() if entry['now']]
+        response.cache_control.max_age = max(0, min(300, int(min(stops, default=now + 300) - now)))
+        return response
+    except Exception as e:
+        logger.error(f"Error getting EPG: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/epg/sources')
+def epg_sources():
+    """Fuentes XMLTV con el resultado y la duración de su último refresco"""
+    try:
+        return jsonify({'sources': db.get_epg_sources()})
+    except Exception as e:
+        logger.error(f"Error getting EPG sources: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/epg/refresh', methods=['POST'])
+def epg_refresh():
+    """Adelanta el refresco de todas las fuentes a la próxima vuelta del refresco"""
+    try:
+        db.schedule_epg_refresh()
+        return jsonify({'success': True, 'message': 'Refresco de la guía programado'})
+    except Exception as e:
+        logger.error(f"Error scheduling EPG refresh: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/logo/stats')
+def logo_stats():
+    """Tamaño y ocupación de la caché de logos"""
+    return jsonify(logo_cache.stats())
+
+@app.route('/api/db/stats')
+def db_stats():
+    """Tamaño de la base de datos y del WAL, y última ejecución de cada tarea de mantenimiento"""
+    try:
+        return jsonify({
+            'storage': db.get_storage_stats(),
+            'maintenance': db_maintenance.read_state(),
+            'wal_max_bytes': db_maintenance.wal_max_bytes
+        })
+    except Exception as e:
+        logger.error(f"Error getting database stats: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # === Sistema de Streaming HLS con FFmpeg ===
 
-def get_stream_id(channel_id, url):
-    """Genera un ID único para el stream basado en channel_id y URL"""
+def get_stream_id(channel_id, url, mode=None):
+    """Genera un ID único para el stream basado en channel_id, URL y modo (p.ej. 'abr')"""
     hash_input = f"{channel_id}:{url}"
+    if mode:
+        hash_input += f":{mode}"
     return hashlib.md5(hash_input.encode()).hexdigest()[:16]
 
 def is_native_hls(url):
@@ -381,12 +1157,70 @@ def is_native_hls(url):
     clean_url = url.split('?')[0].lower()
     return clean_url.endswith('.m3u8')
 
-def start_ffmpeg_stream(stream_id, source_url):
-    """Inicia transcoding FFmpeg para el stream"""
+def forward_request(stream_id):
+    """Reenvía la petición al nodo dueño del stream y retorna su respuesta de requests
+    (en streaming, hay que cerrarla). None si se sirve en este nodo.
+
+    Las peticiones que ya vienen de otro nodo se sirven aquí sin volver a enrutar.
+    Si el dueño no responde queda en cuarentena y se prueba el siguiente del anillo.
+    """
+    if not cluster.enabled or request.headers.get(HOP_HEADER):
+        return None
+    for node in cluster.candidates(stream_id):
+        if node == cluster.self_node:
+            return None
+        try:
+            remote_response = cluster.forward(node, request.method, request.full_path, request.headers)
+        except requests.RequestException as e:
+            logger.warning(f"Cluster node {node} unavailable for stream {stream_id}: {e}")
+            cluster.health.record_failure(node, str(e))
+            CLUSTER_FORWARDS.labels(result='error').inc()
+            continue
+        cluster.health.record_success(node)
+        CLUSTER_FORWARDS.labels(result='ok').inc()
+        return remote_response
+    return None
+
+def forward_to_owner(stream_id):
+    """Respuesta del nodo dueño del stream para devolverla al cliente. None si se sirve en este nodo"""
+    remote_response = forward_request(stream_id)
+    if remote_response is None:
+        return None
+    
+    def generate():
+        try:
+            yield from remote_response.raw.stream(PROXY_CHUNK_SIZE, decode_content=False)
+        finally:
+            remote_response.close()
+    
+    headers = {
+        name: remote_response.headers[name]
+        for name in FORWARD_RESPONSE_HEADERS if name in remote_response.headers
+    }
+    headers['Access-Control-Allow-Origin'] = '*'
+    response = Response(generate(), status=remote_response.status_code, headers=headers)
+    response.direct_passthrough = True
+    return response
+
+@app.after_request
+def add_node_header(response):
+    # Qué nodo ha servido el stream (las respuestas reenviadas ya traen el del dueño)
+    if cluster.enabled and request.path.startswith('/api/stream/'):
+        response.headers.setdefault(NODE_HEADER, cluster.self_node)
+    return response
+
+def start_ffmpeg_stream(stream_id, source_url, lease=None, abr=False, sources=None, timeshift=0, audio=True):
+    """Inicia transcoding FFmpeg para el stream.
+
+    Con `abr=True` genera la escalera ABR_RENDITIONS desde una única decodificación
+    y retorna la ruta del master playlist. Con `timeshift` (segundos, sin ABR) los
+    segmentos se archivan para poder retroceder esa ventana.
+    """
+    if abr:
+        timeshift = 0
     stream_dir = os.path.join(HLS_DIR, stream_id)
     os.makedirs(stream_dir, exist_ok=True)
     
-    playlist_path = os.path.join(stream_dir, 'playlist.m3u8')
     error_log_path = os.path.join(stream_dir, 'ffmpeg_error.log')
     
     # Comando FFmpeg optimizado - intentar copiar streams cuando sea posible
@@ -395,27 +1229,40 @@ def start_ffmpeg_stream(stream_id, source_url):
         '-y',
         '-loglevel', 'info',
         '-hide_banner',
+        # Estadísticas de progreso (frames, bitrate, descartes) por stdout
+        '-progress', 'pipe:1',
         # Opciones de entrada con timeout
         '-timeout', '10000000',  # 10 segundos en microsegundos
         '-reconnect', '1',
         '-reconnect_streamed', '1', 
         '-reconnect_delay_max', '5',
         '-i', source_url,
-        # Intentar copiar video, si falla re-codificar
-        '-c:v', 'copy',
-        # Audio: convertir a AAC para compatibilidad
-        '-c:a', 'aac',
-        '-b:a', '128k',
-        '-ac', '2',
-        # Formato HLS
-        '-f', 'hls',
-        '-hls_time', '2',  # Segmentos más cortos para inicio más rápido
-        '-hls_list_size', '10',
-        '-hls_flags', 'delete_segments+append_list+omit_endlist',
-        '-hls_segment_filename', os.path.join(stream_dir, 'segment_%03d.ts'),
-        playlist_path
     ]
     
+    if abr:
+        for index in range(len(ABR_RENDITIONS)):
+            os.makedirs(os.path.join(stream_dir, str(index)), exist_ok=True)
+        playlist_path = os.path.join(stream_dir, 'master.m3u8')
+        cmd += build_abr_output_args(ABR_RENDITIONS, stream_dir, audio=audio)
+    else:
+        playlist_path = os.path.join(stream_dir, 'playlist.m3u8')
+        cmd += [
+            # Intentar copiar video, si falla re-codificar
+            '-c:v', 'copy',
+            # Audio: convertir a AAC para compatibilidad
+            '-c:a', 'aac',
+            '-b:a', '128k',
+            '-ac', '2',
+            # Formato HLS
+            '-f', 'hls',
+            '-hls_time', '2',  # Segmentos más cortos para inicio más rápido
+            '-hls_list_size', '10',
+            # Con timeshift cada segmento lleva su hora de emisión para el índice del archivo
+            '-hls_flags', 'delete_segments+append_list+omit_endlist' + ('+program_date_time' if timeshift else ''),
+            '-hls_segment_filename', os.path.join(stream_dir, 'segment_%03d.ts'),
+            playlist_path
+        ]
+    
     logger.info(f"Starting FFmpeg for stream {stream_id}")
     logger.info(f"Source URL: {source_url}")
     logger.info(f"Command: {' '.join(cmd)}")
@@ -431,6 +1278,8 @@ def start_ffmpeg_stream(stream_id, source_url):
         stdin=subprocess.DEVNULL
     )
     
+    FFMPEG_SPAWNS.labels(mode='abr' if abr else 'hls').inc()
+    
     # Registrar en active_streams
     with streams_lock:
         active_streams[stream_id] = {
@@ -438,11 +1287,92 @@ def start_ffmpeg_stream(stream_id, source_url):
             'last_access': time.time(),
             'url': source_url,
             'dir': stream_dir,
-            'error_log': error_log_path
+            'error_log': error_log_path,
+            'lease': lease,
+            'abr': abr,
+            'timeshift': timeshift,
+            'audio': audio,
+            'sources': sources or [source_url],
+            'started_at': time.time(),
+            'ready': False,
+            'failovers': 0,
+            'progress': ProgressReader(process.stdout)
         }
+        ACTIVE_TRANSCODERS.set(len(active_streams))
     
     return playlist_path
 
+def get_channel_sources(channel):
+    """URLs candidatas para un canal: la propia primero y después las duplicadas en otras listas"""
+    sources = [channel['url']]
+    try:
+        for alternative in db.get_alternative_sources(channel):
+            if alternative['url'] not in sources:
+                sources.append(alternative['url'])
+    except Exception as e:
+        logger.error(f"Error getting alternative sources: {e}")
+    return sources
+
+def get_timeshift_window(channel):
+    """Segundos de timeshift del canal: su ventana propia o TIMESHIFT_WINDOW (0 = sin timeshift)"""
+    window = channel.get('timeshift_window')
+    return TIMESHIFT_WINDOW if window is None else window
+
+def ensure_stream(stream_id, sources, abr=False, timeshift=0):
+    """Garantiza que hay un FFmpeg vivo para el stream, respetando los límites de admisión.
+
+    Se usa la primera fuente sana de `sources`. Retorna True si se lanzó un FFmpeg
+    nuevo. Lanza AdmissionRejected si no hay capacidad tras esperar en cola.
+    """
+    with streams_lock:
+        stream_info = active_streams.get(stream_id)
+        if stream_info:
+            # Actualizar timestamp de acceso
+            stream_info['last_access'] = time.time()
+            if not abr:
+                # Un cambio de ventana se aplica sin reiniciar FFmpeg
+                stream_info['timeshift'] = timeshift
+            process = stream_info.get('process')
+            if stream_info.get('failing_over'):
+                # El watchdog está relanzando FFmpeg: se sigue sirviendo el playlist actual
+                return False
+            if stream_info.get('failed'):
+                # El failover se quedó sin fuentes y paró FFmpeg: reintentar ahora que vuelven a pedirlo
+                logger.warning(f"Stream {stream_id} failed without alternative sources, retrying...")
+            elif not process or process.poll() is None:
+                return False
+            else:
+                # Si el proceso murió, liberar su slot y reiniciarlo con la siguiente fuente sana
+                logger.warning(f"Stream {stream_id} died, restarting...")
+                FFMPEG_RESTARTS.labels(reason='exit').inc()
+                source_health.record_failure(stream_info['url'], 'FFmpeg exited')
+            if stream_info.get('lease'):
+                stream_info['lease'].release()
+            del active_streams[stream_id]
+    
+    source_url = source_health.order(sources)[0]
+    
+    # Esperar capacidad fuera del lock para no bloquear al resto de streams
+    lease = stream_scheduler.acquire(source_url)
+    
+    # La escalera ABR mapea el audio de cada variante: comprobar antes si la fuente lo tiene
+    # (con el slot ya reservado, la sonda también es una conexión al proveedor)
+    audio = not abr or probe_has_audio(FFPROBE_PATH, source_url) is not False
+    
+    with streams_lock:
+        if stream_id in active_streams:
+            # Otra petición lo inició mientras esperábamos
+            lease.release()
+            active_streams[stream_id]['last_access'] = time.time()
+            return False
+        try:
+            start_ffmpeg_stream(stream_id, source_url, lease=lease, abr=abr, sources=sources,
+                                timeshift=timeshift, audio=audio)
+        except Exception:
+            lease.release()
+            raise
+    return True
+
 def get_ffmpeg_error(stream_id):
     """Obtiene el error de FFmpeg si existe"""
     with streams_lock:
@@ -498,6 +1428,22 @@ def wait_for_playlist(playlist_path, timeout=30):
         time.sleep(0.5)
     return False
 
+def wait_for_abr_playlists(stream_dir, timeout=30):
+    """Espera a que el master y todas las variantes ABR tengan al menos un segmento"""
+    start_time = time.time()
+    master_path = os.path.join(stream_dir, 'master.m3u8')
+    while time.time() - start_time < timeout:
+        if os.path.exists(master_path):
+            remaining = timeout - (time.time() - start_time)
+            variants_ready = all(
+                wait_for_playlist(os.path.join(stream_dir, str(index), 'playlist.m3u8'),
+                                  timeout=max(remaining, 0.5))
+                for index in range(len(ABR_RENDITIONS))
+            )
+            return variants_ready
+        time.sleep(0.5)
+    return False
+
 @app.route('/api/stream/<int:channel_id>/playlist.m3u8')
 def hls_playlist(channel_id):
     """Sirve el playlist HLS para un canal"""
@@ -512,29 +1458,45 @@ def hls_playlist(channel_id):
         if is_native_hls(source_url):
             return proxy_m3u8(source_url)
         
+        # Modo ABR compartido por todos los espectadores que lo pidan
+        abr = request.args.get('abr', '1' if ABR_ENABLED else '0') == '1'
+        
         # Generar stream_id único
-        stream_id = get_stream_id(channel_id, source_url)
+        stream_id = get_stream_id(channel_id, source_url, 'abr' if abr else None)
+        forwarded = forward_to_owner(stream_id)
+        if forwarded:
+            return forwarded
         stream_dir = os.path.join(HLS_DIR, stream_id)
-        playlist_path = os.path.join(stream_dir, 'playlist.m3u8')
+        playlist_path = os.path.join(stream_dir, 'master.m3u8' if abr else 'playlist.m3u8')
         
-        # Verificar si el stream ya está activo
-        with streams_lock:
-            if stream_id in active_streams:
-                # Actualizar timestamp de acceso
-                active_streams[stream_id]['last_access'] = time.time()
-                
-                # Si el proceso murió, reiniciarlo
-                process = active_streams[stream_id].get('process')
-                if process and process.poll() is not None:
-                    logger.warning(f"Stream {stream_id} died, restarting...")
-                    del active_streams[stream_id]
-                    start_ffmpeg_stream(stream_id, source_url)
-            else:
-                # Iniciar nuevo stream
-                start_ffmpeg_stream(stream_id, source_url)
+        # Iniciar o reutilizar el stream (con control de admisión)
+        try:
+            started = ensure_stream(stream_id, get_channel_sources(channel), abr=abr,
+                                    timeshift=get_timeshift_window(channel))
+        except AdmissionRejected as e:
+            logger.warning(f"Stream {stream_id} rejected: {e}")
+            ADMISSION_REJECTIONS.inc()
+            response = jsonify({
+                'error': 'Servidor saturado, inténtalo más tarde',
+                'reason': str(e),
+                'retry_after': e.retry_after
+            })
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 503
+        
+        record_cache('transcoder', hit=not started)
         
         # Esperar a que el playlist esté disponible
-        if not wait_for_playlist(playlist_path, timeout=20):
+        wait_start = time.perf_counter()
+        if abr:
+            ready = wait_for_abr_playlists(stream_dir, timeout=20)
+        else:
+            ready = wait_for_playlist(playlist_path, timeout=20)
+        if started:
+            TIME_TO_FIRST_SEGMENT.labels(result='ready' if ready else 'timeout').observe(
+                time.perf_counter() - wait_start
+            )
+        if not ready:
             # Verificar qué pasó con FFmpeg
             ffmpeg_status = check_ffmpeg_status(stream_id)
             error_msg = f"Timeout esperando transcoding. FFmpeg status: {ffmpeg_status.get('status')}"
@@ -551,6 +1513,18 @@ def hls_playlist(channel_id):
             with open(playlist_path, 'r') as f:
                 content = f.read()
             
+            if abr:
+                # Las variantes se sirven desde /api/stream/<id>/abr/<variante>/
+                content = '\n'.join(
+                    line if not line.strip() or line.startswith('#')
+                    else f'/api/stream/{channel_id}/abr/{line.strip()}'
+                    for line in content.split('\n')
+                )
+                response = Response(content, mimetype='application/vnd.apple.mpegurl')
+                response.headers['Access-Control-Allow-Origin'] = '*'
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+            
             # Reemplazar rutas de segmentos para que usen nuestra API
             content = content.replace(
                 stream_dir + '/',
@@ -584,6 +1558,9 @@ def hls_segment(channel_id, segment):
         
         source_url = channel['url']
         stream_id = get_stream_id(channel_id, source_url)
+        forwarded = forward_to_owner(stream_id)
+        if forwarded:
+            return forwarded
         stream_dir = os.path.join(HLS_DIR, stream_id)
         
         # Actualizar timestamp de acceso
@@ -604,13 +1581,126 @@ def hls_segment(channel_id, segment):
         logger.error(f"Error serving segment: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/stream/<int:channel_id>/abr/<path:filename>')
+def hls_abr_file(channel_id, filename):
+    """Sirve playlists de variante y segmentos de un stream ABR"""
+    try:
+        channel = db.get_channel(channel_id)
+        if not channel:
+            return jsonify({'error': 'Canal no encontrado'}), 404
+        
+        stream_id = get_stream_id(channel_id, channel['url'], 'abr')
+        forwarded = forward_to_owner(stream_id)
+        if forwarded:
+            return forwarded
+        stream_dir = os.path.join(HLS_DIR, stream_id)
+        
+        # Actualizar timestamp de acceso
+        with streams_lock:
+            if stream_id in active_streams:
+                active_streams[stream_id]['last_access'] = time.time()
+        
+        if os.path.exists(os.path.join(stream_dir, filename)):
+            response = send_from_directory(stream_dir, filename)
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        else:
+            return jsonify({'error': 'Archivo no encontrado'}), 404
+            
+    except Exception as e:
+        logger.error(f"Error serving ABR file: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stream/<int:channel_id>/timeshift.m3u8')
+def timeshift_playlist(channel_id):
+    """Playlist del archivo de timeshift de un canal desde un punto del pasado.
+
+    `?offset=<segundos>` retrocede desde el directo y redirige a `?start=<epoch>` para
+    que el playlist EVENT no cambie de inicio al refrescarlo. Con `?duration=<segundos>`
+    se sirve como VOD cerrado (p.ej. un programa ya emitido).
+    """
+    try:
+        channel = db.get_channel(channel_id)
+        if not channel:
+            return jsonify({'error': 'Canal no encontrado'}), 404
+        
+        stream_id = get_stream_id(channel_id, channel['url'])
+        forwarded = forward_to_owner(stream_id)
+        if forwarded:
+            return forwarded
+        
+        records = timeshift_archive.segments(stream_id)
+        if not records:
+            return jsonify({'error': 'No hay grabación de timeshift para este canal'}), 404
+        
+        # Mientras se vea el timeshift el directo sigue grabando
+        with streams_lock:
+            stream_info = active_streams.get(stream_id)
+            recording = bool(stream_info and stream_info.get('timeshift'))
+            if stream_info:
+                stream_info['last_access'] = time.time()
+        
+        start = request.args.get('start', type=float)
+        if start is None:
+            offset = request.args.get('offset', 0, type=float)
+            live_edge = records[-1][1] + records[-1][2]
+            first = records[timeshift_archive.find(records, live_edge - offset)]
+            args = {key: value for key, value in request.args.items() if key != 'offset'}
+            args['start'] = f'{first[1]:.3f}'
+            return redirect(url_for('timeshift_playlist', channel_id=channel_id, **args))
+        
+        selected = records[timeshift_archive.find(records, start):]
+        duration = request.args.get('duration', type=float)
+        ended = not recording
+        if duration:
+            end = start + duration
+            selected = selected[:timeshift_archive.find_end(selected, end)]
+            ended = ended or records[-1][1] + records[-1][2] >= end
+        
+        content = timeshift_archive.build_playlist(
+            selected, lambda seq: f'/api/stream/{channel_id}/timeshift/{seq}.ts', ended
+        )
+        response = Response(content, mimetype='application/vnd.apple.mpegurl')
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        logger.error(f"Error in timeshift playlist: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stream/<int:channel_id>/timeshift/<int:seq>.ts')
+def timeshift_segment(channel_id, seq):
+    """Sirve un segmento del archivo de timeshift"""
+    try:
+        channel = db.get_channel(channel_id)
+        if not channel:
+            return jsonify({'error': 'Canal no encontrado'}), 404
+        
+        stream_id = get_stream_id(channel_id, channel['url'])
+        forwarded = forward_to_owner(stream_id)
+        if forwarded:
+            return forwarded
+        
+        with streams_lock:
+            if stream_id in active_streams:
+                active_streams[stream_id]['last_access'] = time.time()
+        
+        path = timeshift_archive.segment_path(stream_id, seq)
+        if not os.path.exists(path):
+            return jsonify({'error': 'Segmento no encontrado'}), 404
+        response = send_from_directory(os.path.dirname(path), os.path.basename(path), mimetype='video/mp2t')
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        logger.error(f"Error serving timeshift segment: {e}")
+        return jsonify({'error': str(e)}), 500
+
 def proxy_m3u8(url):
     """Proxy para playlists M3U8 nativos"""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
+        response = proxy_session.get(url, timeout=10)
         
         # Modificar URLs relativas en el playlist
         content = response.text
@@ -629,6 +1719,8 @@ def proxy_m3u8(url):
             modified_lines.append(line)
         
         modified_content = '\n'.join(modified_lines)
+        PROXY_BYTES.labels(direction='in').inc(len(response.content))
+        PROXY_BYTES.labels(direction='out').inc(len(modified_content.encode()))
         
         resp = Response(modified_content, mimetype='application/vnd.apple.mpegurl')
         resp.headers['Access-Control-Allow-Origin'] = '*'
@@ -638,32 +1730,63 @@ def proxy_m3u8(url):
         logger.error(f"Error proxying m3u8: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/proxy/url')
+# Cabeceras de la petición del cliente que se reenvían al proveedor
+PROXY_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since', 'Accept-Encoding')
+# Cabeceras de la respuesta del proveedor que se devuelven al cliente
+PROXY_RESPONSE_HEADERS = (
+    'Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges', 'Content-Encoding',
+    'ETag', 'Last-Modified', 'Cache-Control', 'Expires'
+)
+
+@app.route('/api/proxy/url', methods=['GET', 'HEAD'])
 def proxy_url():
-    """Proxy simple para URLs (usado para segmentos de HLS nativo)"""
+    """Proxy de URLs (segmentos de HLS nativo y contenido VOD/catch-up).
+
+    Reenvía Range y las cabeceras condicionales, y devuelve el estado del proveedor
+    (206, 304, 416...) con sus cabeceras de longitud, así que buscar en una película
+    solo pide el rango necesario. El cuerpo se copia sin descomprimir, en lecturas de
+    `PROXY_CHUNK_SIZE`: no se lee más del proveedor de lo que el cliente va consumiendo.
+    """
     try:
         stream_url = request.args.get('url')
         if not stream_url:
             return jsonify({'error': 'URL requerida'}), 400
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-        }
-        
-        remote_response = requests.get(stream_url, headers=headers, stream=True, timeout=(10, 60))
-        
-        def generate():
-            for chunk in remote_response.iter_content(chunk_size=65536):
-                if chunk:
-                    yield chunk
-        
+
+        headers = {name: request.headers[name] for name in PROXY_REQUEST_HEADERS if name in request.headers}
+        # Sin Accept-Encoding del cliente se pide el contenido tal cual (requests pediría gzip)
+        headers.setdefault('Accept-Encoding', 'identity')
+
+        remote_response = proxy_session.request(
+            request.method, stream_url, headers=headers, stream=True, timeout=(10, 60)
+        )
+
         response_headers = {
-            'Content-Type': remote_response.headers.get('Content-Type', 'video/mp2t'),
-            'Access-Control-Allow-Origin': '*',
+            name: remote_response.headers[name]
+            for name in PROXY_RESPONSE_HEADERS if name in remote_response.headers
         }
-        
-        return Response(generate(), headers=response_headers)
-        
+        response_headers.setdefault('Content-Type', 'video/mp2t')
+        response_headers['Access-Control-Allow-Origin'] = '*'
+        response_headers['Access-Control-Expose-Headers'] = 'Content-Length, Content-Range, Accept-Ranges'
+
+        if request.method == 'HEAD':
+            remote_response.close()
+            return Response(status=remote_response.status_code, headers=response_headers)
+
+        def generate():
+            try:
+                for chunk in remote_response.raw.stream(PROXY_CHUNK_SIZE, decode_content=False):
+                    if chunk:
+                        PROXY_BYTES.labels(direction='out').inc(len(chunk))
+                        yield chunk
+            finally:
+                PROXY_BYTES.labels(direction='in').inc(remote_response.raw.tell())
+                remote_response.close()
+
+        response = Response(generate(), status=remote_response.status_code, headers=response_headers)
+        # Ya viene codificado (o no) del proveedor: no se vuelve a comprimir ni a recalcular
+        response.direct_passthrough = True
+        return response
+
     except Exception as e:
         logger.error(f"Error in proxy url: {e}")
         return jsonify({'error': str(e)}), 500
@@ -676,8 +1799,17 @@ def stop_channel_stream(channel_id):
         if not channel:
             return jsonify({'error': 'Canal no encontrado'}), 404
         
-        stream_id = get_stream_id(channel_id, channel['url'])
-        stop_stream(stream_id)
+        for mode in (None, 'abr'):
+            stream_id = get_stream_id(channel_id, channel['url'], mode)
+            # Las dos variantes pueden vivir en nodos distintos
+            remote_response = forward_request(stream_id)
+            if remote_response is not None:
+                # Solo importa que el dueño lo haya detenido: no se reenvía su cuerpo
+                if remote_response.status_code != 200:
+                    logger.warning(f"Stop of stream {stream_id} on its owner returned {remote_response.status_code}")
+                remote_response.close()
+            else:
+                stop_stream(stream_id)
         
         return jsonify({'success': True, 'message': 'Stream detenido'})
     except Exception as e:
@@ -693,6 +1825,9 @@ def debug_stream(channel_id):
             return jsonify({'error': 'Canal no encontrado'}), 404
         
         stream_id = get_stream_id(channel_id, channel['url'])
+        forwarded = forward_to_owner(stream_id)
+        if forwarded:
+            return forwarded
         stream_dir = os.path.join(HLS_DIR, stream_id)
         
         # Información de diagnóstico
@@ -714,6 +1849,18 @@ def debug_stream(channel_id):
         # Estado de FFmpeg
         debug_info['ffmpeg_status'] = check_ffmpeg_status(stream_id)
         
+        # Fuentes (propia + alternativas) y su salud
+        with streams_lock:
+            stream_info = active_streams.get(stream_id, {})
+            sources = stream_info.get('sources') or get_channel_sources(channel)
+            debug_info['current_source'] = stream_info.get('url')
+            debug_info['failovers'] = stream_info.get('failovers', 0)
+            debug_info['stalls'] = stream_info.get('stalls', 0)
+            debug_info['segment_rate'] = stream_info.get('segment_rate')
+            debug_info['last_segment_at'] = stream_info.get('last_segment_at')
+            debug_info['resources'] = stream_info.get('resources')
+        debug_info['sources'] = source_health.snapshot(sources)
+        
         # Streams activos
         with streams_lock:
             debug_info['active_streams'] = list(active_streams.keys())
@@ -724,9 +1871,96 @@ def debug_stream(channel_id):
         logger.error(f"Error in debug: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/streams/utilization')
+def streams_utilization():
+    """Uso actual de transcoders y conexiones por proveedor"""
+    try:
+        utilization = stream_scheduler.utilization()
+        with streams_lock:
+            utilization['worker_streams'] = len(active_streams)
+        return jsonify(utilization)
+    except Exception as e:
+        logger.error(f"Error getting utilization: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/streams/resources')
+def streams_resources():
+    """Consumo de recursos de cada FFmpeg del host y totales por host y proveedor"""
+    try:
+        streams = resource_report.read_all()
+        return jsonify({
+            'streams': streams,
+            'totals': summarize(streams),
+            'sample_interval': RESOURCE_SAMPLE_INTERVAL
+        })
+    except Exception as e:
+        logger.error(f"Error getting stream resources: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/streams/stalls')
+def streams_stalls():
+    """Últimos streams congelados detectados por el watchdog de este worker"""
+    return jsonify({'stalls': list(stall_events), 'stall_timeout': STALL_TIMEOUT})
+
+@app.route('/api/channels/<int:channel_id>', methods=['PATCH'])
+def update_channel_settings(channel_id):
+    """Cambia la ventana de timeshift: {"timeshift_window": segundos} (0 = sin timeshift, null = por defecto)"""
+    try:
+        data = request.get_json() or {}
+        if 'timeshift_window' not in data:
+            return jsonify({'error': 'timeshift_window es requerido'}), 400
+        window = data['timeshift_window']
+        if window is not None and (not isinstance(window, int) or isinstance(window, bool) or window < 0):
+            return jsonify({'error': 'timeshift_window debe ser un número de segundos'}), 400
+        if not db.get_channel(channel_id):
+            return jsonify({'error': 'Canal no encontrado'}), 404
+        
+        # Se aplica al stream en marcha con la siguiente petición del playlist
+        db.update_channel(channel_id, timeshift_window=window)
+        return jsonify({'success': True, 'message': 'Ventana de timeshift actualizada'})
+    except Exception as e:
+        logger.error(f"Error updating channel: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/timeshift')
+def timeshift_status():
+    """Uso del archivo de timeshift de este nodo: bytes por stream, primer y último instante"""
+    try:
+        return jsonify(timeshift_archive.stats())
+    except Exception as e:
+        logger.error(f"Error getting timeshift status: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cluster')
+def cluster_status():
+    """Nodos del clúster y su disponibilidad; con ?channel=<id> el nodo dueño de sus streams"""
+    try:
+        status = cluster.status()
+        channel_id = request.args.get('channel', type=int)
+        if channel_id:
+            channel = db.get_channel(channel_id)
+            if not channel:
+                return jsonify({'error': 'Canal no encontrado'}), 404
+            status['owners'] = {
+                mode or 'hls': cluster.owner(get_stream_id(channel_id, channel['url'], mode))
+                for mode in (None, 'abr')
+            }
+        return jsonify(status)
+    except Exception as e:
+        logger.error(f"Error getting cluster status: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics')
+def metrics():
+    """Métricas en formato Prometheus"""
+    data, content_type = generate_metrics()
+    return Response(data, mimetype=content_type)
+
 @app.route('/health')
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'IPTV WebClient is running'})
 
 if __name__ == '__main__':
+    prepare_deployment()
+    start_services()
     app.run(host='0.0.0.0', port=80, debug=False)
\ No newline at end of file
@@ -0,0 +1,100 @@
+import functools
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+
+# Con PROMETHEUS_MULTIPROC_DIR definido cada worker de gunicorn escribe sus valores
+# en ese directorio y /metrics los agrega; sin él se usa el registro del proceso.
+
+ACTIVE_TRANSCODERS = Gauge(
+    'iptv_active_transcoders', 'Procesos FFmpeg activos',
+    multiprocess_mode='livesum'
+)
+TRANSCODER_CPU_PERCENT = Gauge(
+    'iptv_transcoder_cpu_percent', 'CPU total de los procesos FFmpeg (100 = un núcleo)',
+    multiprocess_mode='livesum'
+)
+TRANSCODER_RSS_BYTES = Gauge(
+    'iptv_transcoder_rss_bytes', 'Memoria residente total de los procesos FFmpeg',
+    multiprocess_mode='livesum'
+)
+FFMPEG_SPAWNS = Counter(
+    'iptv_ffmpeg_spawns_total', 'Procesos FFmpeg lanzados', ['mode']
+)
+FFMPEG_RESTARTS = Counter(
+    'iptv_ffmpeg_restarts_total', 'Reinicios de FFmpeg (failover, congelación, caída)', ['reason']
+)
+ADMISSION_REJECTIONS = Counter(
+    'iptv_admission_rejections_total', 'Streams rechazados por falta de capacidad'
+)
+TIME_TO_FIRST_SEGMENT = Histogram(
+    'iptv_time_to_first_segment_seconds', 'Espera hasta que el playlist HLS tiene segmentos',
+    ['result'], buckets=(0.5, 1, 2, 3, 5, 8, 13, 20, 30)
+)
+HTTP_REQUEST_DURATION = Histogram(
+    'iptv_http_request_duration_seconds', 'Latencia por endpoint', ['endpoint', 'method']
+)
+HTTP_REQUESTS = Counter(
+    'iptv_http_requests_total', 'Peticiones por endpoint y código', ['endpoint', 'method', 'status']
+)
+PROXY_BYTES = Counter(
+    'iptv_proxy_bytes_total', 'Bytes del proxy (in: desde el proveedor, out: hacia el cliente)',
+    ['direction']
+)
+PLAYLIST_REFRESHES = Counter(
+    'iptv_playlist_refreshes_total', 'Refrescos programados de listas por URL', ['result']
+)
+CLUSTER_FORWARDS = Counter(
+    'iptv_cluster_forwards_total', 'Peticiones de streams reenviadas al nodo dueño', ['result']
+)
+TIMESHIFT_SEGMENTS = Counter(
+    'iptv_timeshift_segments_total', 'Segmentos del archivo de timeshift (archived, evicted)', ['result']
+)
+CACHE_REQUESTS = Counter(
+    'iptv_cache_requests_total', 'Consultas a cachés', ['cache', 'result']
+)
+DB_QUERY_DURATION = Histogram(
+    'iptv_db_query_duration_seconds', 'Duración de las operaciones de Database', ['method'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def instrument_database(db):
+    """Envuelve los métodos públicos de una instancia de Database para medir su duración"""
+    for name in dir(db):
+        if name.startswith('_') or name in ('get_connection', 'init_db'):
+            continue
+        method = getattr(db, name)
+        if not callable(method):
+            continue
+
+        def timed(method=method, name=name):
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    DB_QUERY_DURATION.labels(method=name).observe(time.perf_counter() - start)
+            return wrapper
+
+        setattr(db, name, timed())
+    return db
+
+
+def generate_metrics():
+    """Texto en formato Prometheus, agregado entre workers si hay directorio multiproceso"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .lifecycle import wait_for_leadership
+from .metrics import PLAYLIST_REFRESHES
+
+logger = logging.getLogger(__name__)
+
+
+def parse_window(value):
+    """Franja horaria '2-6' (hora local de inicio y fin) -> (2, 6). None si no hay franja"""
+    if not value:
+        return None
+    start, end = (int(hour) % 24 for hour in value.split('-', 1))
+    return start, end
+
+
+class PlaylistRefresher:
+    """Refresco programado en segundo plano de las listas importadas por URL.
+
+    Cada lista se refresca cada `refresh_interval` segundos (o `default_interval`;
+    0 la desactiva) con un margen aleatorio de ±`jitter` para que no coincidan, y con
+    `concurrency` descargas a la vez como máximo. Si hay franja (`window`), los
+    refrescos programados esperan a ella; los pedidos a mano no. Los fallos se
+    reintentan con espera exponencial. Solo un worker del host lo ejecuta.
+    """
+
+    def __init__(self, db, parser, lock_path, default_interval=86400, concurrency=2, jitter=0.1,
+                 window=None, retry_base=600, max_backoff=86400, idle_sleep=60):
+        self.db = db
+        self.parser = parser
+        self.lock_path = lock_path
+        self.default_interval = default_interval
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.window = window
+        self.retry_base = retry_base
+        self.max_backoff = max_backoff
+        self.idle_sleep = idle_sleep
+        self._lock_fd = None
+
+    def _interval(self, playlist):
+        if playlist['refresh_interval'] is None:
+            return self.default_interval
+        return playlist['refresh_interval']
+
+    def _jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def in_window(self, now):
+        if not self.window:
+            return True
+        start, end = self.window
+        hour = time.localtime(now).tm_hour
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def refresh(self, playlist):
+        """Descarga y aplica una lista. Retorna el estado ('ok', 'not_modified', 'error')"""
+        started = time.time()
+        interval = self._interval(playlist)
+        try:
+            content = self.parser.fetch_m3u_from_url(playlist['url'])
+            content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+            if content_hash == playlist['content_hash']:
+                status, error = 'not_modified', None
+            else:
+                if not self.parser.validate_m3u_content(content):
+                    raise ValueError('El contenido no es un archivo M3U válido')
+                parsed = self.parser.parse_m3u_content(content)
+                epg_urls = self.parser.get_playlist_info(content)['epg_urls']
+                changes = self.db.replace_playlist_channels(
+                    playlist['id'], parsed['channels'], file_content=content,
+                    epg_url=','.join(epg_urls), content_hash=content_hash
+                )
+                logger.info(f"Playlist {playlist['id']} refreshed in {time.time() - started:.1f}s: {changes}")
+                status, error = 'ok', None
+            failures = 0
+            next_refresh_at = started + self._jittered(interval) if interval else None
+        except Exception as e:
+            logger.error(f"Error refreshing playlist {playlist['id']}: {e}")
+            status, error = 'error', str(e)
+            failures = (playlist['refresh_failures'] or 0) + 1
+            backoff = min(self.max_backoff, self.retry_base * 2 ** (failures - 1))
+            next_refresh_at = started + self._jittered(backoff) if interval else None
+
+        PLAYLIST_REFRESHES.labels(result=status).inc()
+        self.db.update_playlist(
+            playlist['id'], last_refresh_at=started, last_refresh_duration=time.time() - started,
+            last_refresh_status=status, last_refresh_error=error, refresh_failures=failures,
+            next_refresh_at=next_refresh_at
+        )
+        return status
+
+    def run_once(self, executor):
+        """Programa las listas nuevas y refresca las que tocan. Retorna cuántas se refrescaron"""
+        now = time.time()
+        due = []
+        for playlist in self.db.get_playlists_to_refresh(now):
+            interval = self._interval(playlist)
+            if playlist['next_refresh_at'] is None:
+                # Primera programación repartida en todo el intervalo (evita picos tras un despliegue)
+                if interval:
+                    self.db.update_playlist(playlist['id'], next_refresh_at=now + random.uniform(0, interval))
+            elif playlist['next_refresh_at'] == 0 or (interval and self.in_window(now)):
+                # next_refresh_at == 0: refresco pedido a mano, sin esperar a la franja
+                due.append(playlist)
+        list(executor.map(self.refresh, due))
+        return len(due)
+
+    def run_forever(self):
+        self._lock_fd = wait_for_leadership(self.lock_path, self.idle_sleep)
+        logger.info('Playlist refresher started')
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                try:
+                    self.run_once(executor)
+                except Exception as e:
+                    logger.error(f"Error refreshing playlists: {e}")
+                time.sleep(self.idle_sleep)
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, daemon=True)
+        thread.start()
+        return thread
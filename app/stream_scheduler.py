@@ -0,0 +1,175 @@
+import fcntl
+import os
+import re
+import time
+from urllib.parse import urlparse
+
+
+class AdmissionRejected(Exception):
+    """Se lanza cuando no hay capacidad para iniciar un nuevo stream"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class StreamLease:
+    """Slots reservados para un proceso FFmpeg (transcoder + conexión upstream)"""
+
+    def __init__(self, host, transcoder_fd=None, host_fd=None):
+        self.host = host
+        self.transcoder_fd = transcoder_fd
+        self.host_fd = host_fd
+
+    def release(self):
+        for fd in (self.transcoder_fd, self.host_fd):
+            if fd is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                finally:
+                    os.close(fd)
+        self.transcoder_fd = None
+        self.host_fd = None
+
+
+class StreamScheduler:
+    """Control de admisión para procesos FFmpeg y conexiones a proveedores.
+
+    Cada slot es un fichero de lock (flock) en un directorio compartido, así el
+    límite se aplica a todos los workers de gunicorn del host y un slot se libera
+    solo si el worker que lo tenía muere.
+    """
+
+    def __init__(self, lock_dir, max_transcoders=10, max_per_host=0,
+                 queue_timeout=5.0, retry_after=10, poll_interval=0.25):
+        self.lock_dir = lock_dir
+        self.max_transcoders = max_transcoders
+        self.max_per_host = max_per_host
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.poll_interval = poll_interval
+
+    def init_dirs(self):
+        os.makedirs(os.path.join(self.lock_dir, 'hosts'), exist_ok=True)
+
+    @staticmethod
+    def get_host(url):
+        """Host upstream normalizado de una URL"""
+        host = (urlparse(url).hostname or 'unknown').lower()
+        return re.sub(r'[^a-z0-9.-]', '_', host)
+
+    def _transcoder_slot_path(self, index):
+        return os.path.join(self.lock_dir, f'transcoder_{index}.lock')
+
+    def _host_slot_path(self, host, index):
+        return os.path.join(self.lock_dir, 'hosts', f'{host}_{index}.lock')
+
+    def _try_lock(self, path):
+        """Intenta tomar un slot sin bloquear. Retorna el fd o None"""
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except OSError:
+            os.close(fd)
+            return None
+
+    def _try_acquire_any(self, paths):
+        for path in paths:
+            fd = self._try_lock(path)
+            if fd is not None:
+                return fd
+        return None
+
+    def try_acquire(self, source_url):
+        """Intenta reservar capacidad sin esperar. Retorna (lease, motivo)"""
+        host = self.get_host(source_url)
+
+        transcoder_fd = None
+        if self.max_transcoders > 0:
+            transcoder_fd = self._try_acquire_any(
+                self._transcoder_slot_path(i) for i in range(self.max_transcoders)
+            )
+            if transcoder_fd is None:
+                return None, 'Límite de transcoders alcanzado'
+
+        host_fd = None
+        if self.max_per_host > 0:
+            host_fd = self._try_acquire_any(
+                self._host_slot_path(host, i) for i in range(self.max_per_host)
+            )
+            if host_fd is None:
+                StreamLease(host, transcoder_fd=transcoder_fd).release()
+                return None, f'Límite de conexiones para {host} alcanzado'
+
+        return StreamLease(host, transcoder_fd, host_fd), None
+
+    def try_acquire_host(self, source_url):
+        """Reserva solo una conexión al proveedor, sin transcoder (comprobaciones de salud).
+
+        Retorna el lease, o None si el proveedor ya está en su límite.
+        """
+        host = self.get_host(source_url)
+        if self.max_per_host <= 0:
+            return StreamLease(host)
+        host_fd = self._try_acquire_any(
+            self._host_slot_path(host, i) for i in range(self.max_per_host)
+        )
+        if host_fd is None:
+            return None
+        return StreamLease(host, host_fd=host_fd)
+
+    def acquire(self, source_url, timeout=None):
+        """Reserva capacidad esperando en cola hasta `timeout` segundos"""
+        if timeout is None:
+            timeout = self.queue_timeout
+        deadline = time.time() + timeout
+
+        while True:
+            lease, reason = self.try_acquire(source_url)
+            if lease:
+                return lease
+            if time.time() >= deadline:
+                raise AdmissionRejected(reason, self.retry_after)
+            time.sleep(self.poll_interval)
+
+    def _count_in_use(self, paths):
+        in_use = 0
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            fd = self._try_lock(path)
+            if fd is None:
+                in_use += 1
+            else:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        return in_use
+
+    def utilization(self):
+        """Uso actual de slots en todo el host"""
+        transcoders_in_use = self._count_in_use(
+            self._transcoder_slot_path(i) for i in range(self.max_transcoders)
+        )
+
+        hosts = {}
+        if self.max_per_host > 0:
+            host_names = set()
+            for filename in os.listdir(os.path.join(self.lock_dir, 'hosts')):
+                if filename.endswith('.lock'):
+                    host_names.add(filename.rsplit('_', 1)[0])
+            for host in sorted(host_names):
+                in_use = self._count_in_use(
+                    self._host_slot_path(host, i) for i in range(self.max_per_host)
+                )
+                if in_use:
+                    hosts[host] = {'in_use': in_use, 'limit': self.max_per_host}
+
+        return {
+            'transcoders': {
+                'in_use': transcoders_in_use,
+                'limit': self.max_transcoders,
+            },
+            'hosts': hosts,
+            'queue_timeout': self.queue_timeout,
+        }
@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+import time
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def parse_bitrate_kbps(value):
+    """Convierte '1234.5kbits/s' (formato de -progress) a kbps"""
+    try:
+        return float(value.replace('kbits/s', ''))
+    except (AttributeError, ValueError):
+        return None
+
+
+class ProgressReader:
+    """Lee la salida `-progress pipe:1` de FFmpeg y guarda el último bloque completo.
+
+    Además de recoger los datos, vaciar la tubería evita que FFmpeg se bloquee
+    al llenarse el buffer de stdout.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.latest = {}
+        self._current = {}
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            for raw_line in self.stream:
+                line = raw_line.decode('utf-8', errors='ignore').strip()
+                key, sep, value = line.partition('=')
+                if not sep:
+                    continue
+                self._current[key] = value
+                # Cada bloque termina con progress=continue|end
+                if key == 'progress':
+                    self.latest = dict(self._current, updated_at=time.time())
+                    self._current = {}
+        except (OSError, ValueError):
+            pass
+
+    def snapshot(self):
+        progress = self.latest
+        if not progress:
+            return {}
+        return {
+            'frames': int(progress.get('frame', 0) or 0),
+            'fps': float(progress.get('fps', 0) or 0),
+            'output_bitrate_kbps': parse_bitrate_kbps(progress.get('bitrate')),
+            'output_bytes': int(progress.get('total_size', 0) or 0),
+            'dropped_frames': int(progress.get('drop_frames', 0) or 0),
+            'duplicated_frames': int(progress.get('dup_frames', 0) or 0),
+            'speed': progress.get('speed', '').rstrip('x') or None,
+            'progress_updated_at': progress.get('updated_at')
+        }
+
+
+def read_process_stats(pid):
+    """CPU, memoria y bytes leídos (incluye sockets) de un proceso desde /proc"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # El nombre del proceso puede contener espacios: partir tras el último ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            rss_pages = int(f.read().split()[1])
+        read_bytes = None
+        try:
+            with open(f'/proc/{pid}/io') as f:
+                for line in f:
+                    if line.startswith('rchar:'):
+                        read_bytes = int(line.split()[1])
+        except OSError:
+            pass
+    except (OSError, IndexError, ValueError):
+        return None
+
+    return {
+        # utime y stime son los campos 14 y 15 de /proc/<pid>/stat
+        'cpu_seconds': (int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+        'rss_bytes': rss_pages * PAGE_SIZE,
+        'read_bytes': read_bytes
+    }
+
+
+def sample_stream(stream_info, now):
+    """Actualiza stream_info['resources'] con una nueva muestra y deriva tasas"""
+    process = stream_info.get('process')
+    if not process or process.poll() is not None:
+        return None
+
+    stats = read_process_stats(process.pid) or {}
+    progress = stream_info['progress'].snapshot() if stream_info.get('progress') else {}
+    previous = stream_info.get('resources') or {}
+
+    sample = dict(stats, **progress)
+    sample['pid'] = process.pid
+    sample['sampled_at'] = now
+
+    elapsed = now - previous.get('sampled_at', now)
+    if elapsed > 0:
+        if stats.get('cpu_seconds') is not None and previous.get('cpu_seconds') is not None:
+            sample['cpu_percent'] = round(100 * (stats['cpu_seconds'] - previous['cpu_seconds']) / elapsed, 1)
+        if stats.get('read_bytes') is not None and previous.get('read_bytes') is not None:
+            sample['upstream_kbps'] = round(8 * (stats['read_bytes'] - previous['read_bytes']) / elapsed / 1000, 1)
+    stream_info['resources'] = sample
+    return sample
+
+
+class ResourceReport:
+    """Comparte entre workers las muestras de cada uno mediante ficheros JSON por pid"""
+
+    def __init__(self, report_dir):
+        self.report_dir = report_dir
+
+    def init_dirs(self):
+        os.makedirs(self.report_dir, exist_ok=True)
+
+    def write(self, streams):
+        path = os.path.join(self.report_dir, f'{os.getpid()}.json')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'pid': os.getpid(), 'updated_at': time.time(), 'streams': streams}, f)
+        os.replace(tmp_path, path)
+
+    def read_all(self):
+        """Muestras de todos los workers vivos del host"""
+        streams = []
+        for filename in os.listdir(self.report_dir):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.report_dir, filename)
+            try:
+                with open(path) as f:
+                    report = json.load(f)
+                os.kill(report['pid'], 0)
+            except ProcessLookupError:
+                # Worker muerto: su informe ya no es válido
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except (OSError, ValueError, KeyError):
+                continue
+            for stream in report['streams']:
+                stream['worker_pid'] = report['pid']
+                streams.append(stream)
+        return streams
+
+
+def summarize(streams):
+    """Totales del host y por proveedor"""
+    fields = ('cpu_percent', 'rss_bytes', 'output_bitrate_kbps', 'upstream_kbps', 'dropped_frames')
+
+    def total(items):
+        result = {'streams': len(items)}
+        for field in fields:
+            result[field] = round(sum(item.get(field) or 0 for item in items), 1)
+        return result
+
+    by_upstream = {}
+    for stream in streams:
+        by_upstream.setdefault(stream.get('upstream_host', 'unknown'), []).append(stream)
+
+    return {
+        'host': total(streams),
+        'by_upstream_host': {host: total(items) for host, items in sorted(by_upstream.items())}
+    }
@@ -0,0 +1,393 @@
+import bisect
+import fcntl
+import heapq
+import json
+import logging
+import math
+import os
+import shutil
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from .lifecycle import wait_for_leadership
+from .metrics import TIMESHIFT_SEGMENTS
+
+logger = logging.getLogger(__name__)
+
+# Registro del índice: secuencia, inicio (epoch), duración, bytes y flags
+RECORD = struct.Struct('<QdfIB')
+FLAG_DISCONTINUITY = 1
+
+# Segmentos recientes recordados por stream para no archivar dos veces el mismo
+RECENT_SEGMENTS = 64
+
+# Segundos sin segmentos nuevos tras los que se borra el directorio de un stream vacío
+IDLE_REMOVE_AFTER = 300
+
+
+def parse_program_date_time(value):
+    """'2024-01-01T12:00:00.000+0000' -> epoch; None si no se entiende"""
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z'):
+        try:
+            return datetime.strptime(value.strip(), fmt).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_media_playlist(content):
+    """Segmentos de un playlist HLS de medios: [(uri, duración, program_date_time, discontinuidad)]"""
+    segments = []
+    duration = program_date_time = None
+    discontinuity = False
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXTINF:'):
+            try:
+                duration = float(line[8:].split(',', 1)[0])
+            except ValueError:
+                duration = None
+        elif line.startswith('#EXT-X-PROGRAM-DATE-TIME:'):
+            program_date_time = parse_program_date_time(line[25:])
+        elif line.startswith('#EXT-X-DISCONTINUITY') and not line.startswith('#EXT-X-DISCONTINUITY-'):
+            discontinuity = True
+        elif not line.startswith('#'):
+            if duration is not None:
+                segments.append((line, duration, program_date_time, discontinuity))
+            duration = program_date_time = None
+            discontinuity = False
+    return segments
+
+
+class TimeshiftArchive:
+    """Archivo en disco de los segmentos HLS de los streams con timeshift.
+
+    Los segmentos que escribe FFmpeg se enlazan (hardlink, sin copiar ni recodificar)
+    en `root_dir/<stream_id>/<seq>.ts` antes de que `delete_segments` los borre, y
+    cada uno se añade al final de un índice binario con su hora de inicio y duración.
+    Los playlists de timeshift se generan desde el índice con una búsqueda binaria.
+
+    La retención está acotada por la ventana de cada stream y por `max_bytes` en
+    total: un único worker del host borra primero los segmentos más antiguos.
+    """
+
+    def __init__(self, root_dir, max_bytes=2 * 1024 * 1024 * 1024, evict_interval=10):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self._streams = {}
+        self._index_cache = {}
+        self._lock = threading.Lock()
+        self._leader_fd = None
+
+    def _stream_dir(self, stream_id):
+        return os.path.join(self.root_dir, stream_id)
+
+    def _index_path(self, stream_id):
+        return os.path.join(self._stream_dir(stream_id), 'index.bin')
+
+    def segment_path(self, stream_id, seq):
+        return os.path.join(self._stream_dir(stream_id), f'{seq}.ts')
+
+    @contextmanager
+    def _locked(self):
+        """Excluye entre workers (e hilos) las escrituras del índice"""
+        os.makedirs(self.root_dir, exist_ok=True)
+        fd = os.open(os.path.join(self.root_dir, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    # === Lectura del índice ===
+
+    def _read_index(self, stream_id):
+        try:
+            with open(self._index_path(stream_id), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        # Un registro a medio escribir al final se ignora
+        usable = len(data) - len(data) % RECORD.size
+        return list(RECORD.iter_unpack(data[:usable]))
+
+    def segments(self, stream_id):
+        """Registros (seq, inicio, duración, bytes, flags) archivados del stream, del más antiguo al último"""
+        try:
+            st = os.stat(self._index_path(stream_id))
+        except FileNotFoundError:
+            return []
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._index_cache.get(stream_id)
+            if cached and cached[0] == key:
+                return cached[1]
+        records = self._read_index(stream_id)
+        with self._lock:
+            self._index_cache[stream_id] = (key, records)
+        return records
+
+    def read_meta(self, stream_id):
+        try:
+            with open(os.path.join(self._stream_dir(stream_id), 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # === Archivado ===
+
+    def _write_meta(self, stream_id, window):
+        path = os.path.join(self._stream_dir(stream_id), 'meta.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'window': window}, f)
+        os.replace(tmp_path, path)
+
+    def _link(self, source, target):
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            os.remove(target)
+            os.link(source, target)
+        except OSError:
+            # Otro sistema de ficheros: no queda más remedio que copiar
+            shutil.copyfile(source, target)
+
+    def ingest(self, stream_id, playlist_path, window, generation=None):
+        """Archiva los segmentos nuevos del playlist en vivo de un stream. Retorna cuántos.
+
+        `generation` identifica el proceso FFmpeg (p.ej. su hora de arranque): al cambiar
+        (failover, reinicio) el siguiente segmento se marca como discontinuidad.
+        """
+        try:
+            mtime = os.stat(playlist_path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+        state = self._streams.get(stream_id)
+        if state and state['mtime'] == mtime and state['generation'] == generation:
+            return 0
+        try:
+            with open(playlist_path) as f:
+                content = f.read()
+        except OSError:
+            return 0
+
+        source_dir = os.path.dirname(playlist_path)
+        added = 0
+        with self._locked():
+            os.makedirs(self._stream_dir(stream_id), exist_ok=True)
+            if not state:
+                last = self._read_index(stream_id)[-1:]
+                state = {
+                    'next_seq': last[0][0] + 1 if last else 0,
+                    'last_end': last[0][1] + last[0][2] if last else None,
+                    'recent': [],
+                    'generation': None,
+                    'mtime': None,
+                    'window': None
+                }
+                self._streams[stream_id] = state
+            if state['window'] != window:
+                self._write_meta(stream_id, window)
+                state['window'] = window
+            # Primer segmento de otro FFmpeg (o tras reiniciar el worker): los tiempos no siguen
+            discontinuity = state['generation'] != generation
+
+            records = []
+            for uri, duration, program_date_time, marked in parse_media_playlist(content):
+                source = os.path.join(source_dir, os.path.basename(uri))
+                try:
+                    st = os.stat(source)
+                except FileNotFoundError:
+                    continue
+                identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+                if identity in state['recent']:
+                    continue
+                seq = state['next_seq']
+                try:
+                    self._link(source, self.segment_path(stream_id, seq))
+                except OSError as e:
+                    logger.warning(f"Timeshift: cannot archive {source}: {e}")
+                    continue
+
+                if program_date_time is not None:
+                    start = program_date_time
+                elif state['last_end'] is not None and not discontinuity:
+                    start = state['last_end']
+                else:
+                    start = time.time() - duration
+                flags = FLAG_DISCONTINUITY if (discontinuity or marked) else 0
+                records.append(RECORD.pack(seq, start, duration, st.st_size, flags))
+
+                state['recent'] = (state['recent'] + [identity])[-RECENT_SEGMENTS:]
+                state['next_seq'] = seq + 1
+                state['last_end'] = start + duration
+                discontinuity = False
+                added += 1
+
+            if records:
+                with open(self._index_path(stream_id), 'ab') as f:
+                    f.write(b''.join(records))
+                TIMESHIFT_SEGMENTS.labels(result='archived').inc(len(records))
+        state['generation'] = generation
+        state['mtime'] = mtime
+        return added
+
+    # === Playlists ===
+
+    def find(self, records, start):
+        """Posición del segmento que contiene `start` (el primero si es anterior al archivo)"""
+        starts = [record[1] for record in records]
+        # Margen para los inicios redondeados a milisegundos en las URLs
+        return max(bisect.bisect_right(starts, start + 0.001) - 1, 0)
+
+    def find_end(self, records, end):
+        """Posición tras el último segmento que empieza antes de `end` (al menos uno)"""
+        starts = [record[1] for record in records]
+        return max(bisect.bisect_left(starts, end - 0.001), 1)
+
+    def build_playlist(self, records, segment_url, ended):
+        """Playlist EVENT (o VOD cerrado si `ended`) con los registros dados"""
+        target = max(math.ceil(record[2]) for record in records)
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{target}',
+            f'#EXT-X-MEDIA-SEQUENCE:{records[0][0]}',
+            f"#EXT-X-PLAYLIST-TYPE:{'VOD' if ended else 'EVENT'}"
+        ]
+        for index, (seq, start, duration, _, flags) in enumerate(records):
+            if index and flags & FLAG_DISCONTINUITY:
+                lines.append('#EXT-X-DISCONTINUITY')
+            if index == 0 or flags & FLAG_DISCONTINUITY:
+                stamp = datetime.fromtimestamp(start, timezone.utc).isoformat(timespec='milliseconds')
+                lines.append(f'#EXT-X-PROGRAM-DATE-TIME:{stamp}')
+            lines.append(f'#EXTINF:{duration:.3f},')
+            lines.append(segment_url(seq))
+        if ended:
+            lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    # === Retención ===
+
+    def _stream_ids(self):
+        try:
+            names = os.listdir(self.root_dir)
+        except FileNotFoundError:
+            return []
+        return [name for name in names if not name.startswith('.')
+                and os.path.isdir(os.path.join(self.root_dir, name))]
+
+    def _rewrite_index(self, stream_id, records):
+        path = self._index_path(stream_id)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(RECORD.pack(*record) for record in records))
+        os.replace(tmp_path, path)
+
+    def evict(self, now=None):
+        """Borra lo que sale de la ventana de cada stream y, si se supera `max_bytes`,
+        los segmentos más antiguos de todo el archivo. Retorna los segmentos borrados.
+        """
+        now = now or time.time()
+        removed = 0
+        with self._locked():
+            kept, original = {}, {}
+            for stream_id in self._stream_ids():
+                records = self._read_index(stream_id)
+                original[stream_id] = len(records)
+                window = self.read_meta(stream_id).get('window') or 0
+                first = bisect.bisect_left([record[1] + record[2] for record in records], now - window)
+                for record in records[:first]:
+                    self._remove_segment(stream_id, record[0])
+                removed += first
+                kept[stream_id] = records[first:]
+
+            # Presupuesto global: fusión por hora de inicio de las colas de todos los streams
+            total = sum(record[3] for records in kept.values() for record in records)
+            if total > self.max_bytes:
+                heads = {stream_id: 0 for stream_id in kept}
+                queue = [(records[0][1], stream_id) for stream_id, records in kept.items() if records]
+                heapq.heapify(queue)
+                while queue and total > self.max_bytes:
+                    _, stream_id = heapq.heappop(queue)
+                    records = kept[stream_id]
+                    record = records[heads[stream_id]]
+                    self._remove_segment(stream_id, record[0])
+                    total -= record[3]
+                    removed += 1
+                    heads[stream_id] += 1
+                    if heads[stream_id] < len(records):
+                        heapq.heappush(queue, (records[heads[stream_id]][1], stream_id))
+                for stream_id, head in heads.items():
+                    kept[stream_id] = kept[stream_id][head:]
+
+            for stream_id, records in kept.items():
+                if records or not self._idle(stream_id, now):
+                    if len(records) != original[stream_id]:
+                        self._rewrite_index(stream_id, records)
+                else:
+                    # Vacío y sin grabar desde hace rato: fuera el directorio
+                    shutil.rmtree(self._stream_dir(stream_id), ignore_errors=True)
+        return removed
+
+    def _idle(self, stream_id, now):
+        try:
+            return now - os.path.getmtime(self._index_path(stream_id)) > IDLE_REMOVE_AFTER
+        except OSError:
+            return True
+
+    def _remove_segment(self, stream_id, seq):
+        try:
+            os.remove(self.segment_path(stream_id, seq))
+        except FileNotFoundError:
+            pass
+
+    def forget(self, stream_id):
+        """Deja de seguir un stream detenido (lo archivado se conserva hasta salir de la ventana)"""
+        self._streams.pop(stream_id, None)
+
+    def stats(self):
+        streams = {}
+        for stream_id in self._stream_ids():
+            records = self.segments(stream_id)
+            streams[stream_id] = {
+                'window': self.read_meta(stream_id).get('window'),
+                'segments': len(records),
+                'bytes': sum(record[3] for record in records),
+                'first': records[0][1] if records else None,
+                'last': records[-1][1] + records[-1][2] if records else None
+            }
+        return {
+            'max_bytes': self.max_bytes,
+            'bytes': sum(stream['bytes'] for stream in streams.values()),
+            'streams': streams
+        }
+
+    # === Hilo de retención ===
+
+    def run_forever(self):
+        os.makedirs(self.root_dir, exist_ok=True)
+        self._leader_fd = wait_for_leadership(os.path.join(self.root_dir, '.evictor.lock'), self.evict_interval * 6)
+        logger.info('Timeshift retention started')
+
+        while True:
+            try:
+                removed = self.evict()
+                if removed:
+                    TIMESHIFT_SEGMENTS.labels(result='evicted').inc(removed)
+                    logger.info(f"Timeshift: evicted {removed} segments")
+            except Exception as e:
+                logger.error(f"Error in timeshift retention: {e}")
+            time.sleep(self.evict_interval)
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,99 @@
+"""Mide el coste de CPU por variante de la escalera ABR.
+
+Genera una fuente H.264 sintética con FFmpeg y la transcodifica, sin `-re`,
+con cada variante por separado y con la escalera completa. El resultado es
+segundos de CPU por segundo de vídeo (≈ núcleos ocupados por canal).
+
+Uso:
+    python benchmarks/abr_cpu.py --ladder "source,720p:2800k,480p:1200k" --output abr_cpu.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.abr import parse_ladder, build_abr_output_args  # noqa: E402
+
+
+def children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def generate_source(ffmpeg, path, duration, size, rate):
+    """Crea un MPEG-TS H.264/AAC similar a un canal real"""
+    subprocess.run([
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}',
+        '-f', 'lavfi', '-i', 'sine=frequency=1000:sample_rate=48000',
+        '-t', str(duration),
+        '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', '6000k',
+        '-c:a', 'aac', '-b:a', '128k',
+        '-f', 'mpegts', path
+    ], check=True)
+
+
+def run_ladder(ffmpeg, source, renditions, work_dir):
+    for index in range(len(renditions)):
+        os.makedirs(os.path.join(work_dir, str(index)), exist_ok=True)
+    cmd = [ffmpeg, '-y', '-loglevel', 'error', '-i', source]
+    cmd += build_abr_output_args(renditions, work_dir)
+
+    cpu_before = children_cpu_seconds()
+    wall_before = time.perf_counter()
+    subprocess.run(cmd, check=True)
+    return {
+        'cpu_seconds': children_cpu_seconds() - cpu_before,
+        'wall_seconds': time.perf_counter() - wall_before
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--ladder', default=os.environ.get('ABR_LADDER'))
+    arg_parser.add_argument('--duration', type=int, default=30, help='segundos de vídeo fuente')
+    arg_parser.add_argument('--size', default='1920x1080')
+    arg_parser.add_argument('--rate', type=int, default=25)
+    arg_parser.add_argument('--ffmpeg', default=os.environ.get('FFMPEG_PATH', 'ffmpeg'))
+    arg_parser.add_argument('--output', default='abr_cpu.json')
+    args = arg_parser.parse_args()
+
+    renditions = parse_ladder(args.ladder)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.ts')
+        generate_source(args.ffmpeg, source, args.duration, args.size, args.rate)
+
+        results = []
+        cases = [(r['name'], [r]) for r in renditions]
+        cases.append(('ladder', renditions))
+        for name, case in cases:
+            measurement = run_ladder(args.ffmpeg, source, case, os.path.join(tmp, name))
+            measurement['rendition'] = name
+            measurement['cpu_per_media_second'] = measurement['cpu_seconds'] / args.duration
+            results.append(measurement)
+            print(f"{name:>8}: {measurement['cpu_per_media_second']:.3f} CPU-s por segundo de vídeo")
+
+    report = {
+        'benchmark': 'abr_cpu',
+        'timestamp': time.time(),
+        'host': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'source': {'duration': args.duration, 'size': args.size, 'rate': args.rate},
+        'ladder': [r['name'] for r in renditions],
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Resultados guardados en {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Prueba del reparto de streams entre nodos con varios procesos locales.
+
+Arranca N nodos (gunicorn con un worker cada uno, base de datos compartida y
+HLS_DIR propio), importa una lista y pide un segmento de cada canal a través de
+todos los nodos. Comprueba que todos los nodos envían cada canal al mismo dueño
+(cabecera X-IPTV-Node), el reparto entre nodos, cuántos canales cambian de dueño
+al parar un nodo (solo deberían moverse los suyos), que vuelven a él al
+arrancarlo de nuevo y que las respuestas reenviadas llegan con la codificación
+que pidió el cliente. No necesita FFmpeg: los segmentos responden 404 en el dueño.
+
+Uso:
+    python benchmarks/cluster_test.py --nodes 3 --channels 300 --output cluster_test.json
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import requests
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+COOLDOWN = 2
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_node(work_dir, node_url, nodes):
+    port = node_url.rsplit(':', 1)[1]
+    env = dict(
+        os.environ,
+        DATA_DIR=os.path.join(work_dir, 'data'),
+        HLS_DIR=os.path.join(work_dir, f'hls_{port}'),
+        CLUSTER_NODES=','.join(nodes),
+        CLUSTER_SELF=node_url,
+        CLUSTER_NODE_COOLDOWN=str(COOLDOWN),
+        HEALTH_CHECK_ENABLED='0',
+        EPG_ENABLED='0',
+        PLAYLIST_REFRESH_ENABLED='0',
+        # Comprimir también las respuestas pequeñas para probar su reenvío
+        COMPRESSION_MIN_SIZE='0'
+    )
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', '1',
+         '--threads', '8', 'app.main:app'],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=open(os.path.join(work_dir, f'node_{port}.log'), 'w')
+    )
+    for _ in range(100):
+        try:
+            requests.get(f'{node_url}/health', timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'El nodo {node_url} no arrancó (ver node_{port}.log)')
+
+
+def create_playlist(node_url, channels):
+    lines = ['#EXTM3U']
+    for i in range(channels):
+        lines += [f'#EXTINF:-1 group-title="Cluster",Cluster {i}', f'http://127.0.0.1:9/live/{i}.ts']
+    response = requests.post(f'{node_url}/api/playlists', json={
+        'name': 'cluster-test', 'file_content': '\n'.join(lines)
+    }, timeout=60)
+    response.raise_for_status()
+    playlist_id = response.json()['playlist_id']
+    channel_list = requests.get(f'{node_url}/api/playlists/{playlist_id}/channels', timeout=30).json()['channels']
+    return [channel['id'] for channel in channel_list]
+
+
+def owners(entry_nodes, channel_ids):
+    """Nodo que sirve cada canal visto desde cada nodo de entrada: {canal: {nodo de entrada: dueño}}"""
+    result = {}
+    for channel_id in channel_ids:
+        result[channel_id] = {
+            entry: requests.get(
+                f'{entry}/api/stream/{channel_id}/segments/segment_000.ts', timeout=30
+            ).headers.get('X-IPTV-Node')
+            for entry in entry_nodes
+        }
+    return result
+
+
+def check_encoding(entry_nodes, channel_ids):
+    """Pide el diagnóstico de cada canal con y sin compresión desde cada nodo de entrada.
+
+    Retorna la lista de fallos: cuerpos comprimidos sin Content-Encoding (no se
+    pueden decodificar) o comprimidos cuando el cliente pidió `identity`.
+    """
+    failures = []
+    for channel_id in channel_ids:
+        for entry in entry_nodes:
+            url = f'{entry}/api/stream/{channel_id}/debug'
+            compressed = requests.get(url, headers={'Accept-Encoding': 'gzip'}, timeout=30)
+            try:
+                compressed.json()
+            except ValueError:
+                failures.append({'channel': channel_id, 'entry': entry, 'accept': 'gzip',
+                                 'content_encoding': compressed.headers.get('Content-Encoding')})
+            plain = requests.get(url, headers={'Accept-Encoding': 'identity'}, timeout=30)
+            if plain.headers.get('Content-Encoding') or not plain.content.startswith(b'{'):
+                failures.append({'channel': channel_id, 'entry': entry, 'accept': 'identity',
+                                 'content_encoding': plain.headers.get('Content-Encoding')})
+    return failures
+
+
+def consistent(seen):
+    """{canal: dueño} si todos los nodos de entrada coinciden; lanza AssertionError si no"""
+    mapping = {}
+    for channel_id, by_entry in seen.items():
+        served_by = set(by_entry.values())
+        assert len(served_by) == 1, f'Canal {channel_id} servido por {served_by}'
+        mapping[channel_id] = served_by.pop()
+    return mapping
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--nodes', type=int, default=3)
+    arg_parser.add_argument('--channels', type=int, default=300)
+    arg_parser.add_argument('--output', default='cluster_test.json')
+    args = arg_parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='cluster_test_')
+    nodes = [f'http://127.0.0.1:{free_port()}' for _ in range(args.nodes)]
+    processes = {}
+    try:
+        for node in nodes:
+            processes[node] = start_node(work_dir, node, nodes)
+        channel_ids = create_playlist(nodes[0], args.channels)
+        print(f'{len(nodes)} nodos, {len(channel_ids)} canales')
+
+        initial = consistent(owners(nodes, channel_ids))
+        distribution = Counter(initial.values())
+        print('Reparto:', ', '.join(f'{node} {count}' for node, count in sorted(distribution.items())))
+
+        # Codificación de las respuestas reenviadas (el dueño comprime, el otro nodo no la altera)
+        encoding_failures = check_encoding(nodes, channel_ids[:20])
+        print(f'Codificación de respuestas reenviadas: {len(encoding_failures)} fallos')
+
+        # Baja de un nodo: sus canales pasan a los demás y el resto no se mueve
+        leaving = nodes[-1]
+        processes.pop(leaving).terminate()
+        time.sleep(1)
+        remaining = nodes[:-1]
+        after_leave = consistent(owners(remaining, channel_ids))
+        moved = [cid for cid in channel_ids if after_leave[cid] != initial[cid]]
+        unexpected = [cid for cid in moved if initial[cid] != leaving]
+        print(f'Tras parar {leaving}: {len(moved)} canales movidos ({distribution[leaving]} eran suyos), '
+              f'{len(unexpected)} movidos sin motivo')
+
+        # Vuelta del nodo: tras la cuarentena recupera sus canales
+        processes[leaving] = start_node(work_dir, leaving, nodes)
+        time.sleep(COOLDOWN * 2)
+        owners(remaining, channel_ids)
+        after_join = consistent(owners(nodes, channel_ids))
+        restored = sum(after_join[cid] == initial[cid] for cid in channel_ids)
+        print(f'Tras volver a arrancarlo: {restored}/{len(channel_ids)} canales con su dueño original')
+
+        report = {
+            'nodes': nodes,
+            'channels': len(channel_ids),
+            'distribution': dict(distribution),
+            'encoding_failures': encoding_failures,
+            'leave': {'node': leaving, 'owned': distribution[leaving], 'moved': len(moved),
+                      'moved_unexpectedly': len(unexpected)},
+            'join': {'restored': restored}
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Resultados guardados en {args.output}')
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
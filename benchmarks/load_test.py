@@ -0,0 +1,388 @@
+"""Prueba de carga del camino de streaming HLS con un origen IPTV falso local.
+
+Genera con FFmpeg (testsrc2 + sine) un MPEG-TS y una serie HLS, los sirve desde
+un origen HTTP local que emula canales en directo y lanza N espectadores
+simulados contra `/api/stream/<id>/playlist.m3u8`, sus segmentos y
+`/api/proxy/url`. Funciona sin conexión a Internet.
+
+Informa de throughput, latencia de segmentos (p50/p99), tiempo hasta el primer
+segmento y procesos FFmpeg por canal.
+
+Uso:
+    python benchmarks/load_test.py --viewers 50 --channels 5 --duration 60 --output load_test.json
+    python benchmarks/load_test.py --app-url http://localhost:3010 --viewers 20
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin
+
+import requests
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SEGMENT_SECONDS = 2
+LIVE_WINDOW = 5
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 4)
+
+
+# === Origen IPTV falso ===
+
+def generate_media(ffmpeg, media_dir, duration):
+    """Crea source.ts (canales MPEG-TS) y hls/ (canales HLS nativos)"""
+    source = os.path.join(media_dir, 'source.ts')
+    hls_dir = os.path.join(media_dir, 'hls')
+    os.makedirs(hls_dir, exist_ok=True)
+    common = [
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=25',
+        '-f', 'lavfi', '-i', 'sine=frequency=1000:sample_rate=48000',
+        '-t', str(duration),
+        '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', '3000k', '-g', str(25 * SEGMENT_SECONDS),
+        '-c:a', 'aac', '-b:a', '128k'
+    ]
+    subprocess.run(common + ['-f', 'mpegts', source], check=True)
+    subprocess.run(common + [
+        '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS), '-hls_list_size', '0',
+        '-hls_segment_filename', os.path.join(hls_dir, 'seg_%03d.ts'),
+        os.path.join(hls_dir, 'index.m3u8')
+    ], check=True)
+    return source, sorted(os.path.basename(p) for p in glob.glob(os.path.join(hls_dir, 'seg_*.ts')))
+
+
+def make_origin_handler(source_path, duration, hls_dir, segments, started_at):
+    source_size = os.path.getsize(source_path)
+    bytes_per_second = source_size / duration
+
+    class OriginHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if re.match(r'^/live/\d+\.ts$', self.path):
+                self.stream_ts()
+            elif re.match(r'^/hls/\d+/index\.m3u8$', self.path):
+                self.live_playlist()
+            elif re.match(r'^/hls/\d+/seg_\d+\.ts$', self.path):
+                self.send_file(os.path.join(hls_dir, self.path.rsplit('/', 1)[1]), 'video/mp2t')
+            else:
+                self.send_error(404)
+
+        def stream_ts(self):
+            """Emite el MPEG-TS en bucle al ritmo de su bitrate, como un canal en directo"""
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp2t')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            chunk_size = 64 * 1024
+            try:
+                while True:
+                    with open(source_path, 'rb') as f:
+                        while True:
+                            chunk = f.read(chunk_size)
+                            if not chunk:
+                                break
+                            self.wfile.write(chunk)
+                            time.sleep(len(chunk) / bytes_per_second)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def live_playlist(self):
+            """Ventana deslizante sobre los segmentos pregenerados"""
+            sequence = int((time.time() - started_at) / SEGMENT_SECONDS)
+            lines = [
+                '#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}',
+                f'#EXT-X-MEDIA-SEQUENCE:{sequence}'
+            ]
+            for i in range(sequence, sequence + LIVE_WINDOW):
+                lines += [f'#EXTINF:{SEGMENT_SECONDS}.0,', segments[i % len(segments)]]
+            body = ('\n'.join(lines) + '\n').encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.apple.mpegurl')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_file(self, path, content_type):
+            try:
+                with open(path, 'rb') as f:
+                    body = f.read()
+            except OSError:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return OriginHandler
+
+
+def start_origin(media_dir, ffmpeg, duration):
+    source, segments = generate_media(ffmpeg, media_dir, duration)
+    handler = make_origin_handler(source, duration, os.path.join(media_dir, 'hls'), segments, time.time())
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+# === Aplicación bajo prueba ===
+
+def start_app(work_dir, ffmpeg, workers):
+    """Arranca la aplicación con gunicorn y directorios temporales"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATA_DIR=os.path.join(work_dir, 'data'),
+        HLS_DIR=os.path.join(work_dir, 'hls'),
+        FFMPEG_PATH=ffmpeg,
+        HEALTH_CHECK_ENABLED='0'
+    )
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+         '--threads', '8', '--timeout', '300', 'app.main:app'],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=open(os.path.join(work_dir, 'app.log'), 'w')
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(f'{base_url}/health', timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('La aplicación no arrancó (ver app.log)')
+
+
+def create_playlist(base_url, origin_url, channels):
+    """Importa una lista con `channels` canales MPEG-TS y otros tantos HLS nativos"""
+    lines = ['#EXTM3U']
+    for i in range(channels):
+        lines += [f'#EXTINF:-1 tvg-id="ts{i}" group-title="TS",Load TS {i}', f'{origin_url}/live/{i}.ts']
+        lines += [f'#EXTINF:-1 tvg-id="hls{i}" group-title="HLS",Load HLS {i}', f'{origin_url}/hls/{i}/index.m3u8']
+    response = requests.post(f'{base_url}/api/playlists', json={
+        'name': f'load-test-{int(time.time())}', 'file_content': '\n'.join(lines)
+    }, timeout=60)
+    response.raise_for_status()
+    playlist_id = response.json()['playlist_id']
+    channel_list = requests.get(f'{base_url}/api/playlists/{playlist_id}/channels', timeout=30).json()['channels']
+    return [(channel['id'], channel['url']) for channel in channel_list]
+
+
+# === Espectadores simulados ===
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.segment_latencies = []
+        self.playlist_latencies = []
+        self.time_to_first_segment = []
+        self.bytes = 0
+        self.segments = 0
+        self.errors = {}
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+def segment_uris(playlist_text, playlist_url):
+    return [urljoin(playlist_url, line.strip()) for line in playlist_text.splitlines()
+            if line.strip() and not line.startswith('#')]
+
+
+def viewer(base_url, channel_id, deadline, stats):
+    """Reproduce un canal como haría hls.js: refresca el playlist y descarga segmentos nuevos"""
+    session = requests.Session()
+    playlist_url = f'{base_url}/api/stream/{channel_id}/playlist.m3u8'
+    joined_at = time.perf_counter()
+    seen = set()
+    first_segment = True
+
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            response = session.get(playlist_url, timeout=30)
+        except requests.RequestException:
+            stats.error('playlist_exception')
+            time.sleep(1)
+            continue
+        with stats.lock:
+            stats.playlist_latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            stats.error(f'playlist_{response.status_code}')
+            time.sleep(1)
+            continue
+
+        # Unirse cerca del directo: solo los últimos segmentos en la primera vuelta
+        uris = segment_uris(response.text, playlist_url)
+        if first_segment:
+            seen.update(uris[:-3])
+
+        for uri in uris:
+            if uri in seen or time.time() >= deadline:
+                continue
+            seen.add(uri)
+            start = time.perf_counter()
+            try:
+                segment = session.get(uri, timeout=30)
+            except requests.RequestException:
+                stats.error('segment_exception')
+                continue
+            elapsed = time.perf_counter() - start
+            if segment.status_code != 200:
+                stats.error(f'segment_{segment.status_code}')
+                continue
+            with stats.lock:
+                stats.segment_latencies.append(elapsed)
+                stats.bytes += len(segment.content)
+                stats.segments += 1
+                if first_segment:
+                    stats.time_to_first_segment.append(time.perf_counter() - joined_at)
+            first_segment = False
+
+        time.sleep(SEGMENT_SECONDS / 2)
+
+
+def find_ffmpeg_processes(ffmpeg):
+    """Procesos FFmpeg en ejecución como (pid, URL de origen), leyendo /proc/*/cmdline"""
+    processes = []
+    for cmdline_path in glob.glob('/proc/[0-9]*/cmdline'):
+        try:
+            with open(cmdline_path, 'rb') as f:
+                args = f.read().decode(errors='ignore').split('\0')
+        except OSError:
+            continue
+        if not args or os.path.basename(args[0]) != os.path.basename(ffmpeg) or '-i' not in args:
+            continue
+        processes.append((int(cmdline_path.split('/')[2]), args[args.index('-i') + 1]))
+    return processes
+
+
+def ffmpeg_processes_by_source(ffmpeg):
+    counts = {}
+    for _, source in find_ffmpeg_processes(ffmpeg):
+        counts[source] = counts.get(source, 0) + 1
+    return counts
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--viewers', type=int, default=20)
+    arg_parser.add_argument('--channels', type=int, default=3, help='canales de cada tipo (TS y HLS)')
+    arg_parser.add_argument('--duration', type=int, default=60, help='segundos de carga')
+    arg_parser.add_argument('--ramp', type=float, default=5, help='segundos para incorporar a todos los espectadores')
+    arg_parser.add_argument('--workers', type=int, default=4, help='workers de gunicorn')
+    arg_parser.add_argument('--app-url', help='usar una aplicación ya arrancada en lugar de lanzar una')
+    arg_parser.add_argument('--ffmpeg', default=os.environ.get('FFMPEG_PATH') or shutil.which('ffmpeg') or 'ffmpeg')
+    arg_parser.add_argument('--output', default='load_test.json')
+    args = arg_parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='load_test_')
+    origin, origin_url = start_origin(os.path.join(work_dir, 'media'), args.ffmpeg, duration=30)
+    app_process = None
+    try:
+        if args.app_url:
+            base_url = args.app_url.rstrip('/')
+        else:
+            app_process, base_url = start_app(work_dir, args.ffmpeg, args.workers)
+        channels = create_playlist(base_url, origin_url, args.channels)
+        print(f'Origen en {origin_url}, aplicación en {base_url}, {len(channels)} canales')
+
+        stats = Stats()
+        deadline = time.time() + args.ramp + args.duration
+        threads = []
+        for i in range(args.viewers):
+            channel_id = channels[i % len(channels)][0]
+            thread = threading.Thread(target=viewer, args=(base_url, channel_id, deadline, stats), daemon=True)
+            thread.start()
+            threads.append(thread)
+            time.sleep(args.ramp / max(args.viewers, 1))
+
+        # Muestrear procesos FFmpeg a mitad de la prueba
+        time.sleep(max(0, deadline - time.time()) / 2)
+        processes = ffmpeg_processes_by_source(args.ffmpeg)
+        for thread in threads:
+            thread.join(timeout=60)
+
+        per_channel = {url: processes.get(url, 0) for _, url in channels}
+        report = {
+            'benchmark': 'load_test',
+            'timestamp': time.time(),
+            'host': platform.node(),
+            'cpu_count': os.cpu_count(),
+            'viewers': args.viewers,
+            'channels': len(channels),
+            'duration': args.duration,
+            'segments': stats.segments,
+            'throughput_mbps': round(8 * stats.bytes / args.duration / 1e6, 2),
+            'segments_per_second': round(stats.segments / args.duration, 2),
+            'segment_latency': {
+                'p50': percentile(stats.segment_latencies, 50),
+                'p99': percentile(stats.segment_latencies, 99)
+            },
+            'playlist_latency': {
+                'p50': percentile(stats.playlist_latencies, 50),
+                'p99': percentile(stats.playlist_latencies, 99)
+            },
+            'time_to_first_segment': {
+                'p50': percentile(stats.time_to_first_segment, 50),
+                'p99': percentile(stats.time_to_first_segment, 99),
+                'viewers_started': len(stats.time_to_first_segment)
+            },
+            'ffmpeg_processes_per_channel': per_channel,
+            'ffmpeg_processes_total': sum(processes.values()),
+            'errors': stats.errors
+        }
+    finally:
+        origin.shutdown()
+        if app_process:
+            app_process.terminate()
+            app_process.wait(timeout=30)
+        # FFmpeg huérfanos de la prueba
+        for pid, source in find_ffmpeg_processes(args.ffmpeg):
+            if source.startswith(origin_url):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({k: report[k] for k in (
+        'throughput_mbps', 'segment_latency', 'time_to_first_segment', 'ffmpeg_processes_total', 'errors'
+    )}, indent=2))
+    print(f'Resultados guardados en {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""Benchmark del parseo M3U y de la importación completa en SQLite.
+
+Genera listas M3U sintéticas (atributos variados, líneas #EXTVLCOPT/#EXTGRP,
+nombres largos, finales de línea CRLF), mide `M3UParser.parse_m3u_content`,
+la ruta completa `POST /api/playlists` contra una base de datos temporal y el
+pico de memoria. Cada tamaño se ejecuta en un proceso nuevo para que el pico
+de memoria no se mezcle entre casos. Con `--workers` se repite cada tamaño con
+distinto número de procesos de parseo para ver cómo escala con los núcleos.
+
+Uso:
+    python benchmarks/m3u_benchmark.py --sizes 10000,100000,1000000 --output m3u_bench.json
+    python benchmarks/m3u_benchmark.py --sizes 1000000 --workers 1,2,4,8 --no-import
+    python benchmarks/m3u_benchmark.py --compare m3u_bench_anterior.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT_DIR)
+
+GROUPS = ['Deportes', 'Noticias', 'Cine', 'Series', 'Infantil', 'Música', 'Documentales', 'VOD | Películas 4K']
+COUNTRIES = ['ES', 'MX', 'AR', 'US', 'UK', 'FR', 'DE', 'IT']
+
+
+def generate_m3u(count, seed=42, crlf=False):
+    """Genera una lista M3U sintética de `count` entradas"""
+    rng = random.Random(seed)
+    newline = '\r\n' if crlf else '\n'
+    lines = ['#EXTM3U x-tvg-url="http://epg.example.com/guide.xml.gz" x-tvg-name="Benchmark"']
+
+    for i in range(count):
+        country = rng.choice(COUNTRIES)
+        group = rng.choice(GROUPS)
+        name = f'{country}: Canal {i}'
+        if rng.random() < 0.1:
+            # Nombres largos como los de VOD
+            name += ' - ' + ' '.join(rng.choice(['Edición', 'Especial', 'Temporada', 'Capítulo', 'HD'])
+                                     for _ in range(rng.randint(10, 30)))
+        attributes = [f'tvg-id="canal{i}.{country.lower()}"', f'tvg-name="{name}"']
+        if rng.random() < 0.8:
+            attributes.append(f'tvg-logo="http://logos.example.com/{country.lower()}/{i}.png"')
+        if rng.random() < 0.3:
+            attributes.append(f'tvg-chno="{i}"')
+        if rng.random() < 0.2:
+            attributes.append('catchup="default" catchup-days="7"')
+        attributes.append(f'group-title="{group}"')
+
+        lines.append(f'#EXTINF:-1 {" ".join(attributes)},{name}')
+        if rng.random() < 0.05:
+            lines.append('#EXTVLCOPT:http-user-agent=Mozilla/5.0')
+        if rng.random() < 0.05:
+            lines.append(f'#EXTGRP:{group}')
+        extension = rng.choice(['ts', 'm3u8', 'mp4', 'mkv'])
+        lines.append(f'http://provider{i % 7}.example.com:8080/live/user/pass/{i}.{extension}')
+
+    return newline.join(lines) + newline
+
+
+def max_rss_mb():
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(count, crlf, repeats, import_path, workers, queue):
+    """Ejecuta un caso en un proceso hijo y devuelve el resultado por `queue`"""
+    data_dir = tempfile.mkdtemp(prefix='m3u_bench_')
+    os.environ['DATA_DIR'] = data_dir
+    os.environ['HLS_DIR'] = os.path.join(data_dir, 'hls')
+    os.environ['HEALTH_CHECK_ENABLED'] = '0'
+    os.environ['EPG_ENABLED'] = '0'
+    os.environ['PLAYLIST_REFRESH_ENABLED'] = '0'
+    os.environ['M3U_PARSE_WORKERS'] = str(workers)
+    os.environ['M3U_PARALLEL_THRESHOLD'] = '0'
+
+    from app.m3u_parser import M3UParser, shutdown_pool
+
+    content = generate_m3u(count, crlf=crlf)
+    result = {
+        'entries': count,
+        'crlf': crlf,
+        'workers': workers,
+        'content_mb': round(len(content.encode()) / 1024 / 1024, 2),
+        'rss_after_generate_mb': round(max_rss_mb(), 1)
+    }
+
+    # Umbral 0: se fuerza el modo elegido para medirlo en todos los tamaños
+    parser = M3UParser(workers=workers, parallel_threshold=0)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parsed = parser.parse_m3u_content(content)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    result['parse'] = {
+        'best_seconds': round(best, 4),
+        'mean_seconds': round(sum(timings) / len(timings), 4),
+        'entries_per_second': round(count / best),
+        'channels_parsed': len(parsed['channels']),
+        'groups': len(parsed['groups']),
+        'peak_rss_mb': round(max_rss_mb(), 1)
+    }
+    del parsed
+
+    if import_path:
+        from app.main import app
+
+        client = app.test_client()
+        start = time.perf_counter()
+        response = client.post('/api/playlists', json={'name': f'bench-{count}', 'file_content': content})
+        elapsed = time.perf_counter() - start
+        result['import'] = {
+            'seconds': round(elapsed, 4),
+            'entries_per_second': round(count / elapsed),
+            'status': response.status_code,
+            'channels_imported': (response.get_json() or {}).get('channels_count'),
+            'db_mb': round(os.path.getsize(os.path.join(data_dir, 'iptv.db')) / 1024 / 1024, 2),
+            'peak_rss_mb': round(max_rss_mb(), 1)
+        }
+
+    # Los procesos del pool no terminan solos y el hijo esperaría por ellos al salir
+    shutdown_pool()
+    queue.put(result)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous_path, report):
+    """Imprime la variación respecto a un informe anterior"""
+    with open(previous_path) as f:
+        previous = {(r['entries'], r['crlf'], r.get('workers', 1)): r for r in json.load(f)['results']}
+
+    print(f'\nComparación con {previous_path}:')
+    for result in report['results']:
+        old = previous.get((result['entries'], result['crlf'], result['workers']))
+        if not old:
+            continue
+        for stage in ('parse', 'import'):
+            if stage in result and stage in old:
+                new_rate = result[stage]['entries_per_second']
+                old_rate = old[stage]['entries_per_second']
+                change = 100 * (new_rate - old_rate) / old_rate
+                print(f"{result['entries']:>9} x{result['workers']} {stage:>6}: {old_rate:>10} -> {new_rate:>10} entradas/s ({change:+.1f}%)")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--sizes', default='10000,100000,1000000')
+    arg_parser.add_argument('--repeats', type=int, default=3, help='repeticiones del parseo (se toma la mejor)')
+    arg_parser.add_argument('--crlf', action='store_true', help='usar finales de línea CRLF')
+    arg_parser.add_argument('--workers', default='1', help='procesos de parseo a probar, p.ej. 1,2,4,8')
+    arg_parser.add_argument('--no-import', action='store_true', help='medir solo el parseo')
+    arg_parser.add_argument('--output', default='m3u_bench.json')
+    arg_parser.add_argument('--compare', help='informe JSON anterior con el que comparar')
+    args = arg_parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    cases = [(int(size), int(workers)) for size in args.sizes.split(',') for workers in args.workers.split(',')]
+    for count, workers in cases:
+        queue = context.Queue()
+        process = context.Process(
+            target=run_case, args=(count, args.crlf, args.repeats, not args.no_import, workers, queue)
+        )
+        process.start()
+        result = queue.get()
+        process.join()
+        results.append(result)
+
+        line = f"{count:>9} entradas x{workers}: parseo {result['parse']['entries_per_second']:>9}/s"
+        if 'import' in result:
+            line += f", importación {result['import']['entries_per_second']:>9}/s"
+        line += f", pico {result.get('import', result['parse'])['peak_rss_mb']} MB"
+        print(line)
+
+    report = {
+        'benchmark': 'm3u',
+        'timestamp': time.time(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Resultados guardados en {args.output}')
+
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# Configuración de gunicorn (se carga automáticamente desde el directorio de trabajo)
+import os
+import shutil
+
+# La app se importa una vez en el master y los workers la heredan con el fork:
+# importar app.main no arranca hilos ni toca la base de datos
+preload_app = True
+
+# Con preload_app la app (y sus métricas, que abren ficheros en este directorio) se importa
+# antes de on_starting: las métricas de ejecuciones anteriores se limpian al cargar esta
+# configuración, solo la primera vez (un HUP la vuelve a leer con los workers en marcha)
+_metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if _metrics_dir and not os.environ.get('IPTV_METRICS_DIR_READY'):
+    shutil.rmtree(_metrics_dir, ignore_errors=True)
+    os.makedirs(_metrics_dir, exist_ok=True)
+    os.environ['IPTV_METRICS_DIR_READY'] = '1'
+
+
+def on_starting(server):
+    """Prepara datos y HLS antes de arrancar los workers"""
+    from app.main import prepare_deployment
+    prepare_deployment()
+
+
+def post_worker_init(worker):
+    """Hilos de fondo del worker (después del fork)"""
+    from app.main import start_services
+    start_services()
+
+
+def child_exit(server, worker):
+    """Descarta los gauges 'live' de un worker que termina y los FFmpeg que deja huérfanos"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+    # Se ejecuta al recoger al worker en el master: solo SIGTERM, sin esperar a que terminen
+    from app.lifecycle import sweep_orphans
+    from app.main import HLS_DIR
+    sweep_orphans(HLS_DIR, wait=False)